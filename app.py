@@ -3,20 +3,79 @@ import pandas as pd
 import datetime
 import os
 
-from tensorflow import keras
-import pickle
-
-from utils.get_data import collect_tweets, load_csvs
-from utils.charts import show_table, show_bar, show_lines
-from utils.preprocess import clean_tweets, text_preprocess
-from utils.predict import predict
-from utils.utils import del_folder_content, most_popular_to_days
+from utils.get_data import day_row_counts, load_day
+from utils.table import filter_rows, num_pages, page_slice
+from utils.charts import payload_size, show_table, show_bar, show_lines, show_pie
+from utils.preprocess import LEMMA_CACHE
+from utils.models import preload_in_background
+from utils.jobs import DONE, FAILED, get_job_queue
+from utils.aggregate import DELTAS_FILE, INTERVALS_FILE, TOP_TERMS_FILE, day_deltas, \
+    emotion_counts_frame, load_emotion_counts, previous_day
+from utils import instrument
 from constants import *
 
-import plotly.graph_objects as go
-
 TODAY = datetime.date.today()
 
+
+def plot_chart(container, fig, name):
+    # Size of the figure sent to the browser, shown in the Performance section
+    if instrument.ENABLED:
+        instrument.gauge(f'charts.{name}.bytes', payload_size(fig))
+    container.plotly_chart(fig, use_container_width=True)
+
+
+def show_job(job_id, title, show_results=None):
+    """
+    Shows progress of a background job (see utils.jobs) with a Refresh button,
+    and its partial results with show_results (function of dict), if given.
+    Returns the job once it is done, else None
+    """
+    job = jobs.get(job_id) if job_id else None
+    if job is None:
+        return None
+    if job['status'] == FAILED:
+        st.error(f'{title} failed: {job["error"]}')
+    elif job['status'] != DONE:
+        progress = job['progress'] or {}
+        st.info(f'{title}: {progress.get("message") or job["status"]}')
+        if progress.get('total'):
+            st.progress(min(progress['done'] / progress['total'], 1.))
+        if show_results and progress.get('results'):
+            show_results(progress['results'])
+        # the job runs in the background, a rerun shows how far it got
+        st.button('🔄 Refresh', key=f'refresh-{job_id}')
+        return None
+    return job
+
+
+def show_days(results):
+    """
+    Shows emotion counts of the days analyzed so far, see utils.jobs.analyze_job
+    """
+    days = sorted(results)
+    emotion_counts = emotion_counts_frame(days,
+                                          [results[day]['counts'] for day in days],
+                                          [results[day]['words'] for day in days])
+    st.dataframe(emotion_counts)
+    fig = show_lines(df=emotion_counts,
+                     x_col='Date',
+                     y_cols=list(EMOTION_COLORS.keys()),
+                     text_col='hashtags',
+                     colors=list(EMOTION_COLORS.values()))
+    plot_chart(st, fig, 'emotions_so_far')
+
+
+# Sizes of the charts of this script run; script runs of other sessions
+# collect into their own runs (start_run is per thread, see utils.instrument)
+session_run = instrument.start_run('script')
+
+# Collection and analysis run in background workers shared by all sessions
+jobs = get_job_queue()
+
+# Lemmas of already seen tokens, so WordNet is queried only for new ones
+if not LEMMA_CACHE.stats()['size']:
+    LEMMA_CACHE.load(LEMMA_CACHE_PATH)
+
 # Banner
 st.image('images/banner.png')
 
@@ -43,6 +102,15 @@ with st.form('form1'):
         min_favs = int(col1.number_input('Min likes per tweet',
                                          value=0, step=1,
                                          min_value=0))
+        # Approximate mode: only a random sample of every day is classified
+        sample_checkbox = col2.checkbox('Approximate: classify a sample of every day', False)
+        sample_size = int(col2.number_input('Tweets in the sample',
+                                            value=SAMPLE_SIZE, step=100,
+                                            min_value=1))
+        stratify_checkbox = col2.checkbox('Sample every hour of the day', True)
+        scan_limit = int(col2.number_input('Max tweets scanned per day, 0 - the whole day',
+                                           value=0, step=1000,
+                                           min_value=0))
         # Location by name or coordinates
         location = st.text_input('Location:')
         col1, col2 = st.columns(2)
@@ -63,38 +131,61 @@ if search_btn:
         # Remove extra whitespaces for each keyword
         keyword_list = [k.strip() for k in keyword_list]
 
-        # Collect tweets and save them to dict in the following format:
-        # {'YYYY-MM-DD': pd.Dataframe(columns=['date', 'content'])}
-        dfs = collect_tweets(keywords=keyword_list,
-                             only_hashtags=hashtags_checkbox,
-                             num_tweets_per_day=num_tweets_per_day,
-                             min_favs=min_favs,
-                             begin_date=begin_date,
-                             end_date=end_date)
-
-        # Remove previous results (files) af any
-        del_folder_content(DATA_PATH)
-        del_folder_content(PREPROCESSED_DATA_PATH)
-        del_folder_content(EMOTION_COUNTS_PATH)
-
-        # Save collected raw data, named in format 'YYYY-MM-DD.csv'
-        for name, df in dfs.items():
-            df.to_csv(DATA_PATH + '/' + name + '.csv', index=False)
+        # Collect tweets, days collected and analyzed for the same query before are reused
+        query = {'keywords': keyword_list,
+                 'only_hashtags': hashtags_checkbox,
+                 'num_tweets_per_day': num_tweets_per_day,
+                 'min_favs': min_favs}
+        # The whole day (or scan_limit tweets) is scanned, sample_size of them are kept;
+        # exact searches keep their own runs, so both can be compared
+        if sample_checkbox:
+            query.update(sample_size=sample_size, stratify_by_hour=stratify_checkbox,
+                         scan_limit=scan_limit or None)
+            if scan_limit and scan_limit <= sample_size:
+                st.warning('Only the first tweets of every day are scanned and all of them are kept, '
+                           'the sample is not random: scan more tweets than the sample size')
+
+        # An identical search running for another session is shared
+        st.session_state['collect_job'] = jobs.submit('collect', {'query': query,
+                                                                  'begin_date': begin_date.isoformat(),
+                                                                  'end_date': end_date.isoformat()})
+        st.session_state.pop('analyze_job', None)
+
+# Folders of the session's search; before the first search - the data folders
+# written by run_pipeline.py
+paths = {'data_path': DATA_PATH,
+         'preprocessed_path': PREPROCESSED_DATA_PATH,
+         'counts_path': EMOTION_COUNTS_PATH}
+ready = True
+if 'collect_job' in st.session_state:
+    collect_job = show_job(st.session_state['collect_job'], 'Collecting tweets')
+    ready = collect_job is not None
+    if ready:
+        paths = {key: collect_job['result'][key] for key in paths}
+# Analysis copies the search to its own folders, with predicted labels and emotion counts
+analyze_job = jobs.get(st.session_state['analyze_job']) if ready and 'analyze_job' in st.session_state else None
+shown = paths
+if analyze_job and analyze_job['status'] == DONE:
+    shown = {key: analyze_job['result'][key] for key in paths}
+data_path, counts_path = shown['data_path'], shown['counts_path']
 
 # ---  Load RAW Data  ----------------------------------------------------------
-if any(os.scandir(DATA_PATH)):
-    # 1: Dict in format {'YYYY-MM-DD': pd.Dataframe(columns=['date', 'content'])}
-    # 2: List of the file names (['YYYY-MM-DD', ...])
-    dfs, date_options = load_csvs(DATA_PATH)
+if ready and os.path.isdir(data_path) and any(os.scandir(data_path)):
+    # There is data to analyze: load and warm up the model once per process,
+    # in the background, so it is ready when Analyze is clicked
+    preload_in_background()
+
+    # Number of tweets collected every day, {'YYYY-MM-DD': int};
+    # days are loaded only when they are needed
+    count_tweets = day_row_counts(data_path)
+    date_options = list(count_tweets)
 
-    # Count number of tweets collected every day
-    count_tweets = {k: len(df) for k, df in dfs.items()}
     st.markdown('##')  # Space before element
     st.write('\nThe following number of tweets was found:')
     col1, col2 = st.columns([2, 1])
     # Show number of collected tweets per day via bar chart
     fig = show_bar(count_tweets.keys(), count_tweets.values())
-    col1.plotly_chart(fig, use_container_width=True)
+    plot_chart(col1, fig, 'tweets_per_day')
     # Convert counts to dataframe and display to the right side to bar chart
     col2.dataframe(pd.DataFrame.from_dict(count_tweets, orient='index'), height=180)
 
@@ -102,142 +193,135 @@ if any(os.scandir(DATA_PATH)):
     if date_options:
         st.markdown('##')
         day_selected = st.selectbox(label='View by date:', options=date_options)
-        if day_selected in dfs:
-            # Select the corresponding dataframe
-            df = dfs[day_selected]
+        if day_selected in count_tweets:
+            # Load the corresponding dataframe
+            df = load_day(data_path, day_selected)
+            # Filter, only a page of tweets is sent to the browser
+            col1, col2, col3 = st.columns([3, 2, 1])
+            query = col1.text_input('Search in tweets:')
+            labels = []
+            if 'predicted_labels' in df.columns:
+                labels = col2.multiselect('Emotions:', options=list(EMOTION_COLORS.keys()))
+            rows = filter_rows(data_path, day_selected, query, labels)
+            page = col3.number_input('Page:', min_value=1, max_value=num_pages(len(rows), TABLE_PAGE_SIZE),
+                                     value=1, step=1,
+                                     # back to the first page when the filter changes
+                                     key=f'page-{day_selected}-{query}-{labels}')
             # Show table
-            fig = show_table(df)
-            st.plotly_chart(fig, use_container_width=True)
+            fig = show_table(page_slice(df, rows, page, TABLE_PAGE_SIZE))
+            plot_chart(st, fig, 'tweet_table')
+            first = (page - 1) * TABLE_PAGE_SIZE
+            st.caption(f'Tweets {min(first + 1, len(rows))}-{min(first + TABLE_PAGE_SIZE, len(rows))} '
+                       f'of {len(rows)}')
 
     st.markdown('##')
     if st.button('📈 Analyze!'):
-
-        # ---  Preprocess  -----------------------------------------------------
-        # Clean tweets: remove hashtags, mentions and other symbols
-        dfs_cleaned = {}
-        for day in date_options:
-            dfs_cleaned[day] = clean_tweets(dfs[day])
-
-        # Preprocess: tokenize, remove stop-words, lemmatize, apply stemming
-        for day in date_options:
-            df = dfs_cleaned[day]
-            df['content_preprocessed'] = [text_preprocess(t, stop_words=True, lemmatize=True) for t in
-                                          df['content_cleaned']]
-            df['content_preprocessed_with_stopwords'] = [text_preprocess(t) for t in df['content_cleaned']]
-
-        # ---  Obtain Predictions  -----------------------------------------------------
-        with st.spinner('Predicting...'):
-            # Load pretrained model
-            model = keras.models.load_model('models/lstm/content/lstm_model')
-            # Load pretrained tokenizer
-            with open('tokenizers/lstm/tokenizer.pickle', 'rb') as t:
-                tokenizer = pickle.load(t)
-
-            no_emotion, anger, fear, happiness, sadness, surprise = [], [], [], [], [], []
-            hashtags = []
-
-            for i, day in enumerate(date_options):
-                # Predict labels for each record in the dataframe
-                emotions = predict(dfs_cleaned[day]['content_preprocessed_with_stopwords'], model, tokenizer)
-                # Add decoded predicted labels to the original dataframe
-                dfs[day]['predicted_labels'] = [LABELS_TO_EMOTIONS[i] for i in emotions]
-
-                # Count number of each emotion type for the current date
-                no_emotion.append(emotions.count(0))
-                anger.append(emotions.count(1))
-                fear.append(emotions.count(3))
-                happiness.append(emotions.count(4))
-                sadness.append(emotions.count(5))
-                surprise.append(emotions.count(6))
-
-                # Calculate most popular words or hashtags for the current day
-                words_to_days = most_popular_to_days(dfs_cleaned,
-                                                     date_options,
-                                                     'words',
-                                                     num_words=10,
-                                                     min_occur=1)
-                # st.write(words_to_days)
-
-                #
-                hash_today = words_to_days[day]['word'].values
-                hashtags.append(', '.join(hash_today))
-
-            # Create a dataframe with emotion counts
-            emotion_counts = pd.DataFrame({
-                'Date': date_options,
-                'no emotion': no_emotion,
-                'anger': anger,
-                'fear': fear,
-                'happiness': happiness,
-                'sadness': sadness,
-                'surprise': surprise,
-                'hashtags': hashtags
-            })
-
-        # Remove previous data files if any
-        del_folder_content(PREPROCESSED_DATA_PATH)
-        del_folder_content(EMOTION_COUNTS_PATH)
-
-        # Replace original datafiles by datafiles with predictions
-        for name, df in dfs.items():
-            df.to_csv(DATA_PATH + '/' + name + '.csv', index=False)
-
-        # Save preprocessed data
-        for name, df in dfs_cleaned.items():
-            df.to_csv(PREPROCESSED_DATA_PATH + '/' + name + '.csv', index=False)
-
-        # Save counts ('Date', '# no_emotion', '# happiness', ...)
-        emotion_counts.to_csv(EMOTION_COUNTS_PATH + '/emotion_counts.csv', index=False)
-
-if any(os.scandir(EMOTION_COUNTS_PATH)):
+        # Every day is cleaned (hashtags, mentions and other symbols removed),
+        # tokenized, lemmatized and classified in the background; days of the
+        # search which are stale by now are collected again as they are analyzed
+        if 'collect_job' in st.session_state:
+            params = collect_job['params']
+        else:
+            params = dict(paths, days=date_options)
+        st.session_state['analyze_job'] = jobs.submit('analyze', params)
+
+    analyze_job = show_job(st.session_state.get('analyze_job'), 'Analyzing', show_days)
+    if analyze_job:
+        result = analyze_job['result']
+        info = result['model']
+        st.caption(f'Model loaded in {info["load_time"]:.1f}s'
+                   + (f', warm-up {info["warmup_time"]:.1f}s' if info['warmup_time'] else ''))
+        cache_stats = result['lemma_cache']
+        st.caption(f'Lemma cache: {cache_stats["size"]} tokens, '
+                   f'{cache_stats["hits"]} hits, {cache_stats["misses"]} misses')
+        cache_stats = result['prediction_cache']
+        st.caption(f'Prediction cache: {cache_stats["size"]} texts, '
+                   f'{cache_stats["hits"]} hits, {cache_stats["misses"]} misses')
+        dedup = result['dedup']
+        if dedup:
+            st.caption(f'Near duplicates: {dedup["classified"]} of {dedup["tweets"]} tweets classified '
+                       f'({dedup["saved_fraction"]:.0%} saved), largest cluster {dedup["largest"]}')
+
+if ready and os.path.isdir(counts_path) and any(os.scandir(counts_path)):
     # Read and show df
-    emotion_counts = pd.read_csv(EMOTION_COUNTS_PATH + '/emotion_counts.csv')
+    # Only the shown columns; counts saved before disgust was shown have 0 of it
+    emotion_counts = load_emotion_counts(counts_path, ['Date', *EMOTION_COLORS, 'hashtags'])
     st.dataframe(emotion_counts)
 
     # If all hashtags are NaN --> convert column to string type
     if emotion_counts.hashtags.isnull().all():
         emotion_counts.hashtags = emotion_counts.hashtags.astype(str)
 
+    # Confidence intervals of counts of sampled days
+    intervals_path = os.path.join(counts_path, INTERVALS_FILE)
+    bands = None
+    if os.path.exists(intervals_path):
+        bands = emotion_counts[['Date']].merge(pd.read_csv(intervals_path), on='Date', how='left')
+        st.caption(f'Counts of {bands["sample"].notnull().sum()} sampled days are estimated from '
+                   f'{int(bands["sample"].sum())} of {int(bands["population"].sum())} tweets; '
+                   f'bands are {CONFIDENCE_Z:g}-sigma confidence intervals')
+
     # ---  Plot Emotions  ------------------------------------------------------
     fig = show_lines(df=emotion_counts,
                      x_col='Date',
                      y_cols=list(EMOTION_COLORS.keys()),
                      text_col='hashtags',
-                     colors=list(EMOTION_COLORS.values()))
-
-    st.plotly_chart(fig, use_container_width=True)
+                     colors=list(EMOTION_COLORS.values()),
+                     bands=bands)
 
-    ####### TO DO #######
+    plot_chart(st, fig, 'emotions')
 
     st.markdown('##')
     col1, col2 = st.columns([1, 3])
     day_selected = col1.selectbox(label='View by date:', options=emotion_counts['Date'], key=2)
     # Select the corresponding dataframe
     df = emotion_counts[emotion_counts['Date'] == day_selected][list(EMOTION_COLORS.keys())]
-    # Show table
-    prev_day = datetime.datetime.strptime(day_selected, '%Y-%m-%d') - datetime.timedelta(1)
-    prev_day = prev_day.strftime('%Y-%m-%d')
-    col1.write(f'Compare to the previous day: {prev_day}')
-    if prev_day in list(emotion_counts['Date']):
-        df_temp = emotion_counts[(emotion_counts['Date'] == day_selected) | (emotion_counts['Date'] == prev_day)][list(EMOTION_COLORS.keys())]
-        # difference
-        diff = df_temp.iloc[1]-df_temp.iloc[0]
-        col1.write(diff.to_frame().style.applymap(
+    # Compare to the previous day, deltas are computed when counts are saved
+    col1.write(f'Compare to the previous day: {previous_day(day_selected)}')
+    deltas_path = os.path.join(counts_path, DELTAS_FILE)
+    deltas = pd.read_csv(deltas_path) if os.path.exists(deltas_path) else day_deltas(emotion_counts)
+    diff = deltas.set_index('Date').loc[day_selected, list(EMOTION_COLORS.keys())]
+    if diff.notnull().all():
+        col1.write(diff.astype(int).to_frame().style.applymap(
             func=lambda x: 'background-color: #FFCCCB' if x < 0 else ('background-color: #90ee90' if x > 0 else None)))
     else:
         col1.info('Not enough data...')
 
+    fig = show_pie(EMOTION_COLORS.keys(), df.iloc[0], EMOTION_COLORS.values())
+    plot_chart(col2, fig, 'emotions_pie')
 
-    ####### TO DO #######
-
-    fig = go.Figure(data=[go.Pie(labels=list(EMOTION_COLORS.keys()),
-                                 values=df.iloc[0],
-                                 hole=0.3,
-                                 textinfo='label+percent'),
-
-                          ])
-
-    fig.update_traces(marker=dict(colors=list(EMOTION_COLORS.values()), line=dict(color='#000000', width=1),
-                                  ), opacity=0.9)
-    fig.update_layout(margin=dict(l=0, r=0, b=0, t=0), showlegend=False, height=300, width=300)
-    col2.plotly_chart(fig, use_container_width=True)
+    # ---  Most popular words and hashtags  ------------------------------------
+    top_terms_path = os.path.join(counts_path, TOP_TERMS_FILE)
+    if os.path.exists(top_terms_path):
+        top_terms = pd.read_csv(top_terms_path, keep_default_na=False)
+        st.markdown('##')
+        for col, kind in zip(st.columns(2), ('words', 'hashtags')):
+            for title, date in (('all days', 'all'), (day_selected, day_selected)):
+                top = top_terms[(top_terms['Date'] == date) & (top_terms['kind'] == kind)]
+                col.write(f'Most popular {kind}, {title}:')
+                col.dataframe(top[['word', 'num', 'error']].reset_index(drop=True))
+                if len(top):
+                    # counts are upper bounds, num - error is a lower bound
+                    col.caption(f'Counts may be up to {top["error"].max()} too high; '
+                                f'terms not shown appeared at most {top["bound"].iloc[0]} times')
+
+# ---  Performance of the last run  --------------------------------------------
+# Timings of the session's last job (see utils.jobs), sizes of the charts of this script run
+metrics = None
+for key in ('analyze_job', 'collect_job'):
+    job = jobs.get(st.session_state[key]) if key in st.session_state else None
+    if job and job['status'] == DONE and job['result'].get('metrics'):
+        metrics = job['result']['metrics']
+        break
+gauges = session_run.gauges
+if instrument.ENABLED and (metrics and metrics['timings'] or gauges):
+    with st.expander('Performance'):
+        if metrics and metrics['timings']:
+            timings = pd.DataFrame.from_dict(metrics['timings'], orient='index')
+            timings = timings.sort_values('seconds', ascending=False)
+            st.write(f'Last run: {metrics["name"]}')
+            st.dataframe(timings)
+            if metrics['counters']:
+                st.dataframe(pd.DataFrame.from_dict(metrics['counters'], orient='index', columns=['value']))
+        if gauges:
+            st.dataframe(pd.DataFrame.from_dict(gauges, orient='index', columns=['value']))
@@ -0,0 +1,127 @@
+"""
+Latency, memory and accuracy parity of the inference backends (utils/backends.py).
+
+Run from the project root:
+    python -m benchmarks.bench_backends [--size 1k] [--batch-size 256]
+
+Every backend and quantization runs in a fresh interpreter, so load time
+and peak RSS are its own. Probabilities are compared to the Keras model.
+The first run also exports the TFLite and NumPy models, run it twice for load times.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.corpus import SIZES, synthetic_corpus
+
+CONFIGS = [('keras', None),
+           ('tflite', None), ('tflite', 'float16'), ('tflite', 'int8'),
+           ('numpy', None), ('numpy', 'float16'), ('numpy', 'int8')]
+
+
+def encoded_corpus(num_tweets, seed=0):
+    """
+    Returns np.array of padded sequences of a synthetic corpus
+    """
+    from constants import MAXLEN, TOKENIZER_PATH
+    from utils.preprocess import preprocess_tweets
+    from utils.tokenizer import load_tokenizer
+
+    df = preprocess_tweets(synthetic_corpus(num_tweets, seed=seed))
+    return load_tokenizer(TOKENIZER_PATH).texts_to_matrix(df['content_preprocessed_with_stopwords'],
+                                                          maxlen=MAXLEN)
+
+
+def run_backend(backend, quantize, sequences_path, output_path, batch_size):
+    """
+    Runs in a child process: loads the backend, predicts all sequences
+    and saves the probabilities; prints JSON with the measurements
+    """
+    from benchmarks.run import peak_rss_mb
+    from constants import MODEL_PATH
+    from utils.backends import load_backend
+
+    sequences = np.load(sequences_path)
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    mdl = load_backend(MODEL_PATH, backend, quantize)
+    load_seconds = time.perf_counter() - start
+    rss_loaded = peak_rss_mb()
+
+    latencies, probabilities = [], []
+    for begin in range(0, len(sequences), batch_size):
+        batch = sequences[begin:begin + batch_size]
+        start = time.perf_counter()
+        probabilities.append(np.asarray(mdl.predict_on_batch(batch), dtype='float32'))
+        latencies.append(time.perf_counter() - start)
+    np.save(output_path, np.vstack(probabilities))
+
+    total = sum(latencies)
+    print(json.dumps({'load_seconds': load_seconds,
+                      'model_rss_mb': rss_loaded - rss_before,
+                      'peak_rss_mb': peak_rss_mb(),
+                      'weights_mb': mdl.nbytes() / 2 ** 20 if hasattr(mdl, 'nbytes') else None,
+                      'tweets_per_second': len(sequences) / total if total else 0.,
+                      'p50_ms': float(np.percentile(latencies, 50)) * 1000,
+                      'p95_ms': float(np.percentile(latencies, 95)) * 1000}))
+
+
+def measure(backend, quantize, sequences_path, output_path, batch_size):
+    command = [sys.executable, '-m', 'benchmarks.bench_backends', '--child', backend,
+               quantize or 'none', sequences_path, output_path, '--batch-size', str(batch_size)]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode:
+        return {'error': result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'failed'}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare inference backends')
+    parser.add_argument('--size', default='1k', choices=list(SIZES))
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--atol', type=float, default=1e-3,
+                        help='maximum difference of probabilities from the Keras model')
+    parser.add_argument('--child', nargs=4, metavar=('BACKEND', 'QUANTIZE', 'SEQUENCES', 'OUTPUT'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        backend, quantize, sequences_path, output_path = args.child
+        run_backend(backend, None if quantize == 'none' else quantize,
+                    sequences_path, output_path, args.batch_size)
+        sys.exit()
+
+    from utils.backends import compare_probabilities
+
+    with tempfile.TemporaryDirectory() as folder:
+        sequences_path = os.path.join(folder, 'sequences.npy')
+        np.save(sequences_path, encoded_corpus(SIZES[args.size]))
+
+        print(f'{"backend":<18}{"load s":>8}{"model MB":>10}{"weights MB":>12}{"tweets/s":>10}'
+              f'{"p50 ms":>9}{"p95 ms":>9}{"max diff":>10}{"agree":>8}')
+        reference = None
+        for backend, quantize in CONFIGS:
+            name = backend + (f'-{quantize}' if quantize else '')
+            output_path = os.path.join(folder, name + '.npy')
+            r = measure(backend, quantize, sequences_path, output_path, args.batch_size)
+            if 'error' in r:
+                print(f'{name:<18}{r["error"]}')
+                continue
+
+            probabilities = np.load(output_path)
+            if backend == 'keras':
+                reference = probabilities
+            weights = f'{r["weights_mb"]:.1f}' if r['weights_mb'] is not None else '-'
+            line = (f'{name:<18}{r["load_seconds"]:>8.2f}{r["model_rss_mb"]:>10.0f}{weights:>12}'
+                    f'{r["tweets_per_second"]:>10,.0f}{r["p50_ms"]:>9.1f}{r["p95_ms"]:>9.1f}')
+            if reference is not None:
+                parity = compare_probabilities(reference, probabilities, args.atol)
+                line += (f'{parity["max_abs_diff"]:>10.4f}{parity["label_agreement"]:>8.1%}'
+                         + ('' if parity['passed'] else '  (above --atol)'))
+            print(line)
@@ -0,0 +1,61 @@
+"""
+Build time and payload size (JSON sent to the browser) of the app's figures.
+
+Run from the project root:
+    python -m benchmarks.bench_charts [--tweets 50000] [--days 3650]
+
+Compares a whole day in one table with a single page of it, and the
+emotion line chart with and without downsampling.
+"""
+import argparse
+import datetime
+import time
+
+import numpy as np
+
+from benchmarks.corpus import synthetic_corpus
+from constants import EMOTION_COLORS, MAX_CHART_POINTS, TABLE_PAGE_SIZE
+from utils.aggregate import emotion_counts_frame
+from utils.charts import payload_size, show_lines, show_table
+from utils.table import page_slice
+
+
+def measure(build):
+    start = time.perf_counter()
+    fig = build()
+    seconds = time.perf_counter() - start
+    return seconds, payload_size(fig)
+
+
+def emotion_counts(num_days, seed=0):
+    rng = np.random.default_rng(seed)
+    begin = datetime.date(2015, 1, 1)
+    days = [(begin + datetime.timedelta(days=i)).strftime('%Y-%m-%d') for i in range(num_days)]
+    counts = rng.poisson(50, size=(num_days, 7))
+    words = [', '.join(rng.choice(['news', 'game', 'love', 'today', 'election'], size=10)) for _ in days]
+    return emotion_counts_frame(days, counts, words)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time figures and measure their size')
+    parser.add_argument('--tweets', type=int, default=50_000, help='tweets in a day')
+    parser.add_argument('--days', type=int, default=3650, help='days in the line chart')
+    args = parser.parse_args()
+
+    df = synthetic_corpus(args.tweets, num_days=1)
+    df_counts = emotion_counts(args.days)
+
+    def lines(max_points):
+        return lambda: show_lines(df_counts, 'Date', list(EMOTION_COLORS), 'hashtags',
+                                  list(EMOTION_COLORS.values()), max_points=max_points)
+
+    figures = [(f'table, {args.tweets} tweets', lambda: show_table(df)),
+               (f'table, page of {TABLE_PAGE_SIZE}',
+                lambda: show_table(page_slice(df, np.arange(len(df)), 1, TABLE_PAGE_SIZE))),
+               (f'lines, {args.days} days', lines(args.days)),
+               (f'lines, {MAX_CHART_POINTS} points', lines(MAX_CHART_POINTS))]
+
+    print(f'{"figure":<28}{"build ms":>10}{"payload KB":>12}')
+    for name, build in figures:
+        seconds, size = measure(build)
+        print(f'{name:<28}{seconds * 1000:>10.1f}{size / 1024:>12,.0f}')
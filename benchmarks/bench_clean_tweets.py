@@ -0,0 +1,74 @@
+"""
+Throughput of clean_tweets against the original per-tweet implementation.
+
+Run from the project root:
+    python -m benchmarks.bench_clean_tweets [num_tweets]
+
+Also checks that both implementations give byte-identical
+'content_cleaned' and 'hashtags' columns.
+"""
+import re
+import sys
+import time
+
+import emoji
+
+from benchmarks.corpus import synthetic_corpus
+from utils.preprocess import clean_tweets
+
+
+def clean_tweets_reference(df, keywords=None):
+    """
+    Original implementation of clean_tweets, kept for comparison
+    """
+    df = df.copy()
+    cleaned = []
+    hashtags = []
+
+    for tweet in df['content']:
+        tweet = emoji.demojize(tweet)
+        if keywords:
+            for keyword in keywords:
+                tweet = re.sub(keyword.lower(), '', tweet)
+                tweet = re.sub(keyword.upper(), '', tweet)
+                tweet = re.sub(keyword.title(), '', tweet)
+        hashtag = re.findall(r'#(\w+)', tweet)
+        tweet = re.sub('n[\'’]t', ' not', tweet)
+        url_pattern = re.compile(r'https?://\S+|www\.\S+')
+        tweet = url_pattern.sub(r'', tweet)
+        tweet = re.sub(r'\S*@\S*\s?', '', tweet)
+        tweet = re.sub('[^\x00-\x7f]', '', tweet)
+        tweet = re.sub(r'\s+', ' ', tweet)
+        tweet = re.sub('_', ' ', tweet)
+        tweet = re.sub(r'[^\w\s]', ' ', tweet)
+        tweet = re.sub(r'\d+', ' ', tweet)
+        tweet = re.sub('amp', '', tweet)
+        tweet = tweet.strip()
+        cleaned.append(tweet)
+        hashtags.append(hashtag)
+
+    df['content_cleaned'] = cleaned
+    df['hashtags'] = hashtags
+    return df
+
+
+def timed(func, df):
+    start = time.perf_counter()
+    result = func(df)
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    num_tweets = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    df = synthetic_corpus(num_tweets)
+
+    reference, t_reference = timed(clean_tweets_reference, df)
+    result, t_result = timed(clean_tweets, df)
+
+    assert reference['content_cleaned'].tolist() == result['content_cleaned'].tolist()
+    assert reference['hashtags'].tolist() == result['hashtags'].tolist()
+
+    print(f'{num_tweets} tweets, outputs are identical')
+    print(f'reference:    {t_reference:.2f}s  {num_tweets / t_reference:,.0f} tweets/s')
+    print(f'clean_tweets: {t_result:.2f}s  {num_tweets / t_result:,.0f} tweets/s')
+    print(f'speed-up:     {t_reference / t_result:.1f}x')
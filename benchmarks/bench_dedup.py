@@ -0,0 +1,31 @@
+"""
+Near-duplicate clustering (utils/dedup.py) on a synthetic corpus:
+time, number of clusters and share of inference saved per threshold.
+
+Run from the project root:
+    python -m benchmarks.bench_dedup [--size 100k] [--thresholds 0.6 0.8 0.9 1.0]
+"""
+import argparse
+import time
+
+from benchmarks.corpus import SIZES, synthetic_corpus
+from utils.dedup import cluster_summary, cluster_texts
+from utils.preprocess import clean_tweets
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cluster near-duplicate tweets')
+    parser.add_argument('--size', default='100k', choices=list(SIZES))
+    parser.add_argument('--thresholds', nargs='+', type=float, default=[0.6, 0.8, 0.9, 1.0])
+    parser.add_argument('--num-perm', type=int, default=64)
+    args = parser.parse_args()
+
+    texts = clean_tweets(synthetic_corpus(SIZES[args.size]))['content_cleaned']
+    print(f'{len(texts)} tweets, {texts.nunique()} distinct after cleaning\n')
+    print(f'{"threshold":>10}{"seconds":>10}{"clusters":>10}{"largest":>9}{"saved":>8}   sizes')
+    for threshold in args.thresholds:
+        start = time.perf_counter()
+        summary = cluster_summary(cluster_texts(texts, threshold, args.num_perm))
+        seconds = time.perf_counter() - start
+        sizes = ', '.join(f'{size}: {num}' for size, num in list(summary['sizes'].items())[:6])
+        print(f'{threshold:>10.2f}{seconds:>10.2f}{summary["clusters"]:>10}{summary["largest"]:>9}'
+              f'{summary["saved_fraction"]:>8.1%}   {sizes}')
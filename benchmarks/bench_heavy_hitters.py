@@ -0,0 +1,60 @@
+"""
+Space-Saving sketches (utils/heavy_hitters.py) against exact counting
+on a Zipf-distributed vocabulary: terms kept in memory, time,
+recall of the true top terms and observed vs reported error.
+
+Run from the project root:
+    python -m benchmarks.bench_heavy_hitters [--days 30] [--tokens-per-day 200000] [--capacities 100 200 1000]
+"""
+import argparse
+import time
+from collections import Counter
+
+import numpy as np
+
+from utils.heavy_hitters import SpaceSaving
+
+K = 10
+
+
+def zipf_days(num_days, tokens_per_day, seed=0):
+    rng = np.random.default_rng(seed)
+    return [[f'w{i}' for i in rng.zipf(1.2, tokens_per_day)] for _ in range(num_days)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Top terms in fixed memory')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--tokens-per-day', type=int, default=200_000)
+    parser.add_argument('--capacities', nargs='+', type=int, default=[100, 200, 1000])
+    args = parser.parse_args()
+
+    days = zipf_days(args.days, args.tokens_per_day)
+
+    start = time.perf_counter()
+    exact_days = [Counter(tokens) for tokens in days]
+    exact = sum(exact_days, Counter())
+    seconds = time.perf_counter() - start
+    true_top = {term for term, _ in exact.most_common(K)}
+    print(f'{args.days} days, {sum(map(len, days))} tokens, {len(exact)} distinct\n')
+    print(f'{"method":<16}{"terms kept":>12}{"seconds":>10}{"recall@10":>11}{"max error":>11}{"bound":>9}')
+    print(f'{"exact":<16}{sum(map(len, exact_days)) + len(exact):>12}{seconds:>10.2f}{1:>11.0%}{0:>11}{0:>9}')
+
+    for capacity in args.capacities:
+        start = time.perf_counter()
+        # a sketch per day, merged into all days
+        total = SpaceSaving(capacity)
+        kept = 0
+        for tokens in days:
+            sketch = SpaceSaving(capacity)
+            for begin in range(0, len(tokens), 10_000):
+                sketch.update(tokens[begin:begin + 10_000])
+            kept += len(sketch)
+            total.merge(sketch)
+        seconds = time.perf_counter() - start
+
+        top = total.top_k(K)
+        recall = len(true_top & set(top['word'])) / K
+        max_error = max(count - exact[term] for term, (count, _) in total.counters.items())
+        print(f'{"space-saving " + str(capacity):<16}{kept + len(total):>12}{seconds:>10.2f}'
+              f'{recall:>11.0%}{max_error:>11}{total.error_bound():>9}')
@@ -0,0 +1,58 @@
+"""
+Approximate mode (utils/sampling.py): error of estimated emotion counts,
+width and coverage of their confidence intervals per sample size,
+on a day with labels that depend on the hour.
+
+Run from the project root:
+    python -m benchmarks.bench_sampling [--tweets 100000] [--sizes 500 1000 5000] [--trials 200]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from constants import CONFIDENCE_Z
+from utils.aggregate import NUM_CLASSES
+from utils.sampling import estimate_counts, sample_stream
+
+
+def synthetic_day(num_tweets, seed=0):
+    # (hour, label), more tweets and more happiness in the evening
+    rng = np.random.default_rng(seed)
+    hours = rng.choice(24, size=num_tweets, p=np.linspace(1, 3, 24) / np.linspace(1, 3, 24).sum())
+    weights = np.ones((24, NUM_CLASSES))
+    weights[:, 4] += np.arange(24) / 6
+    weights /= weights.sum(axis=1, keepdims=True)
+    labels = (rng.random(num_tweets)[:, None] > np.cumsum(weights[hours], axis=1)).sum(axis=1)
+    return list(zip(hours.astype(str), labels))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Accuracy of estimated emotion counts')
+    parser.add_argument('--tweets', type=int, default=100_000, help='tweets in the day')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[500, 1000, 5000])
+    parser.add_argument('--trials', type=int, default=200)
+    args = parser.parse_args()
+
+    tweets = synthetic_day(args.tweets)
+    true = np.bincount([label for _, label in tweets], minlength=NUM_CLASSES)
+    print(f'{args.tweets} tweets, counts {true.tolist()}\n')
+    print(f'{"size":>6}{"stratified":>12}{"sample ms":>11}{"mean error":>12}{"interval":>10}{"coverage":>10}')
+
+    for size in args.sizes:
+        for stratified in (False, True):
+            stratum = (lambda tweet: tweet[0]) if stratified else None
+            errors, widths, covered, seconds = [], [], [], 0.
+            for trial in range(args.trials):
+                start = time.perf_counter()
+                sample, population = sample_stream(tweets, size, stratum, seed=trial)
+                seconds += time.perf_counter() - start
+                strata = np.array([tweet[0] if stratified else 'all' for tweet in sample])
+                estimate = estimate_counts([label for _, label in sample], strata, population,
+                                           NUM_CLASSES, CONFIDENCE_Z)
+                low, high = np.array(estimate['counts_low']), np.array(estimate['counts_high'])
+                errors.append(np.abs(np.array(estimate['counts']) - true).mean())
+                widths.append((high - low).mean())
+                covered.append(((low <= true) & (true <= high)).mean())
+            print(f'{size:>6}{str(stratified):>12}{seconds / args.trials * 1000:>11.1f}'
+                  f'{np.mean(errors):>12,.0f}{np.mean(widths):>10,.0f}{np.mean(covered):>10.1%}')
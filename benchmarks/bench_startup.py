@@ -0,0 +1,57 @@
+"""
+Time to import everything app.py imports before the search form is rendered.
+
+Run from the project root:
+    python -m benchmarks.bench_startup [repeats]
+
+Every repeat runs in a fresh interpreter. Also checks that the ML stack
+and other heavy packages are not loaded at startup.
+"""
+import ast
+import json
+import subprocess
+import sys
+
+# Packages that must be loaded only when they are needed
+HEAVY_MODULES = ['tensorflow', 'keras', 'snscrape', 'plotly']
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+{imports}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed,
+                  'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def app_imports(path='app.py'):
+    """
+    Returns source of the top-level import statements of app.py
+    """
+    with open(path, encoding='utf-8') as f:
+        source = f.read()
+    tree = ast.parse(source)
+    return '\n'.join(ast.get_source_segment(source, node) for node in tree.body
+                     if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+
+def measure(imports):
+    code = PROBE.format(imports=imports, heavy=HEAVY_MODULES)
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    imports = app_imports()
+    runs = [measure(imports) for _ in range(repeats)]
+
+    times = sorted(run['seconds'] for run in runs)
+    print(f'app imports: best {times[0]:.2f}s, median {times[len(times) // 2]:.2f}s ({repeats} runs)')
+
+    loaded = runs[-1]['loaded']
+    if loaded:
+        print(f'heavy modules loaded at startup: {loaded}')
+        sys.exit(1)
+    print(f'none of {HEAVY_MODULES} is loaded at startup')
@@ -0,0 +1,80 @@
+"""
+Pickled Keras tokenizer vs CompactTokenizer (utils/tokenizer.py):
+load time, memory, encoding speed, and that both give the same matrix.
+
+Run from the project root:
+    python -m benchmarks.bench_tokenizer [--size 100k]
+"""
+import argparse
+import pickle
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from keras_preprocessing.sequence import pad_sequences
+
+from benchmarks.corpus import SIZES, synthetic_corpus
+from constants import MAXLEN, TOKENIZER_PATH
+from utils.preprocess import preprocess_tweets
+from utils.tokenizer import CompactTokenizer
+
+
+def load_measured(load):
+    """
+    Returns tuple (loaded object, seconds, MB allocated by loading)
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = load()
+    seconds = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0] / 2 ** 20
+    tracemalloc.stop()
+    return result, seconds, size
+
+
+def best_of(func, repeats=3):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return result, min(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the Keras and the compact tokenizer')
+    parser.add_argument('--size', default='100k', choices=list(SIZES))
+    args = parser.parse_args()
+
+    def load_keras():
+        with open(TOKENIZER_PATH, 'rb') as f:
+            return pickle.load(f)
+
+    keras_tokenizer, keras_load, keras_mb = load_measured(load_keras)
+    with tempfile.TemporaryDirectory() as folder:
+        CompactTokenizer.from_keras(keras_tokenizer).save(folder)
+
+        compact_tokenizer, compact_load, compact_mb = load_measured(lambda: CompactTokenizer.load(folder))
+
+        df = preprocess_tweets(synthetic_corpus(SIZES[args.size]))
+        num_tokens = int(df['content_preprocessed_with_stopwords'].map(len).sum())
+        print(f'{SIZES[args.size]} tweets, {num_tokens} tokens\n')
+        print(f'{"":<10}{"load ms":>10}{"memory MB":>11}{"encode s":>10}{"tokens/s":>12}')
+
+        same = True
+        for texts in (df['content_preprocessed_with_stopwords'], df['content']):
+            expected, keras_seconds = best_of(
+                lambda: pad_sequences(keras_tokenizer.texts_to_sequences(texts), maxlen=MAXLEN))
+            actual, compact_seconds = best_of(lambda: compact_tokenizer.texts_to_matrix(texts, maxlen=MAXLEN))
+            same = same and expected.shape == actual.shape and bool(np.array_equal(expected, actual))
+            if texts is df['content']:
+                continue
+            print(f'{"keras":<10}{keras_load * 1000:>10.1f}{keras_mb:>11.1f}{keras_seconds:>10.2f}'
+                  f'{num_tokens / keras_seconds:>12,.0f}')
+            print(f'{"compact":<10}{compact_load * 1000:>10.1f}{compact_mb:>11.1f}{compact_seconds:>10.2f}'
+                  f'{num_tokens / compact_seconds:>12,.0f}')
+
+    print('\nsame matrices for token lists and raw texts' if same else '\nMATRICES DIFFER')
+    sys.exit(0 if same else 1)
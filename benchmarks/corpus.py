@@ -0,0 +1,71 @@
+"""
+Reproducible synthetic tweet corpora for benchmarks.
+"""
+import datetime
+import random
+
+import pandas as pd
+
+WORDS = ['i', 'love', 'this', 'so', 'much', 'can', 'not', 'believe', 'they', 'did',
+         'that', 'again', 'what', 'a', 'day', 'people', 'are', 'angry', 'about', 'news',
+         'happy', 'sad', 'today', 'amp', 'example', 'champion', 'don\'t', 'won’t', 'isn\'t',
+         'running', 'feelings', 'scared', 'wonderful', 'terrible', 'surprised', 'game',
+         'election', 'weather', 'friends', 'family', 'watching', 'tonight', 'never', 'always']
+EMOJIS = ['😂', '❤️', '🔥', '✨', '😭', '🙏', '😡', '😱', '🥺', '👀', '🇺🇸', '👍🏽']
+HASHTAGS = ['#trending', '#news_today', '#NFL', '#Election2022', '#love', '#mondaymotivation']
+MENTIONS = ['@someone', '@user_123', '@NewsDesk', '@a_b_c']
+URLS = ['https://t.co/abc123XYZ', 'https://t.co/Q9w8E7r6T5', 'www.example.com/page']
+OTHER = ['2022', '&amp;', '!!!', '...', '\n', 'café', '—', '  ', 'e-mail@addr.com', '10:30']
+
+SIZES = {'1k': 1_000, '100k': 100_000, '1M': 1_000_000}
+
+
+def _tweet(rng):
+    parts = rng.choices(WORDS, k=rng.randint(3, 35))
+    parts += rng.choices(EMOJIS, k=rng.choice([0, 0, 1, 2, 3]))
+    parts += rng.choices(HASHTAGS, k=rng.choice([0, 0, 1, 2]))
+    parts += rng.choices(MENTIONS, k=rng.choice([0, 1, 2]))
+    parts += rng.choices(URLS, k=rng.choice([0, 0, 1]))
+    parts += rng.choices(OTHER, k=rng.randint(0, 3))
+    rng.shuffle(parts)
+    return ' '.join(parts)
+
+
+def synthetic_corpus(num_tweets, seed=0, duplicate_rate=0.3, num_days=7,
+                     begin_date=datetime.date(2022, 10, 2)):
+    """
+    Generates tweet-like texts with emojis, urls, mentions, hashtags and duplicates.
+
+    :param num_tweets: int, number of tweets
+    :param seed: int, the same seed gives the same corpus
+    :param duplicate_rate: float, share of tweets that repeat an earlier one
+        (as retweets, with 'RT @user: ' in front half of the time)
+    :param num_days: int, tweets are spread evenly over that many days
+    :param begin_date: datetime.date, first day
+    :return: pd.DataFrame with columns 'date' and 'content'
+    """
+    rng = random.Random(seed)
+    tweets = []
+    for i in range(num_tweets):
+        if tweets and rng.random() < duplicate_rate:
+            tweet = rng.choice(tweets)
+            if rng.random() < 0.5:
+                tweet = 'RT ' + rng.choice(MENTIONS) + ': ' + tweet
+        else:
+            tweet = _tweet(rng)
+        tweets.append(tweet)
+
+    days = [begin_date + datetime.timedelta(days=i * num_days // max(num_tweets, 1))
+            for i in range(num_tweets)]
+    dates = [datetime.datetime.combine(day, datetime.time(rng.randrange(24), rng.randrange(60)),
+                                       tzinfo=datetime.timezone.utc)
+             for day in days]
+    return pd.DataFrame({'date': dates, 'content': tweets})
+
+
+def split_days(df):
+    """
+    Returns dict in format {'YYYY-MM-DD': pd.DataFrame}, as collect_tweets does
+    """
+    day = df['date'].map(lambda d: d.strftime('%Y-%m-%d'))
+    return {name: part.reset_index(drop=True) for name, part in df.groupby(day)}
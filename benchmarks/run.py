@@ -0,0 +1,190 @@
+"""
+Benchmark suite: times every stage of the pipeline on synthetic corpora.
+
+Run from the project root:
+    python -m benchmarks.run --sizes 1k 100k [--predict] [--output benchmarks/results]
+    python -m benchmarks.run --compare old.json new.json
+
+For every stage reports throughput (tweets/s), p50/p95 latency of a batch
+of tweets and peak RSS of the process, and saves the results as JSON.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.corpus import SIZES, split_days, synthetic_corpus
+from utils.preprocess import clean_tweets, preprocess_texts, preprocess_tweets
+from utils.heavy_hitters import TERM_COLUMNS, TermSketches
+from utils.term_freq import TermIndex
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 2 ** 10
+
+
+def _batches(df, batch_size):
+    return [df.iloc[start:start + batch_size] for start in range(0, len(df), batch_size)]
+
+
+def time_batches(func, batches):
+    """
+    Runs func on every batch
+    Returns tuple (list of results, list of seconds per batch)
+    """
+    results, latencies = [], []
+    for batch in batches:
+        start = time.perf_counter()
+        results.append(func(batch))
+        latencies.append(time.perf_counter() - start)
+    return results, latencies
+
+
+def summarize(num_tweets, latencies):
+    total = sum(latencies)
+    return {'tweets': num_tweets,
+            'seconds': total,
+            'tweets_per_second': num_tweets / total if total else 0.,
+            'p50_ms': float(np.percentile(latencies, 50)) * 1000,
+            'p95_ms': float(np.percentile(latencies, 95)) * 1000,
+            'peak_rss_mb': peak_rss_mb()}
+
+
+def run_size(num_tweets, batch_size, with_predict, seed=0):
+    df = synthetic_corpus(num_tweets, seed=seed)
+    batches = _batches(df, batch_size)
+    results = {}
+
+    cleaned, latencies = time_batches(clean_tweets, batches)
+    results['clean'] = summarize(num_tweets, latencies)
+
+    def preprocess(batch):
+        views = preprocess_texts(batch['content_cleaned'], views=('tokens', 'lemmatized'))
+        batch = batch.copy()
+        batch['content_preprocessed'] = views['lemmatized']
+        batch['content_preprocessed_with_stopwords'] = views['tokens']
+        return batch
+
+    preprocessed, latencies = time_batches(preprocess, cleaned)
+    results['preprocess'] = summarize(num_tweets, latencies)
+
+    # most popular words of every day, over the whole corpus at once
+    df_preprocessed = pd.concat(preprocessed)
+    dfs = split_days(df_preprocessed)
+    days = sorted(dfs)
+
+    def top_words(_):
+        term_index = TermIndex(dfs, days)
+        return [term_index.top_k(day, 'words', num_words=10, min_occur=1) for day in days]
+
+    _, latencies = time_batches(top_words, [None])
+    results['term_freq'] = summarize(num_tweets, latencies)
+
+    # the same with Space-Saving sketches, as the pipeline counts them
+    def top_terms(_):
+        term_sketches = TermSketches()
+        for day in days:
+            term_sketches.add_day(day, dfs[day], TERM_COLUMNS)
+        return term_sketches.top_terms(10)
+
+    _, latencies = time_batches(top_terms, [None])
+    results['top_terms'] = summarize(num_tweets, latencies)
+
+    if with_predict:
+        from utils.models import get_model
+        from utils.predict import predict
+        mdl, tokenizer = get_model()
+
+        def classify(batch):
+            return predict(batch['content_preprocessed_with_stopwords'], mdl, tokenizer)
+
+        _, latencies = time_batches(classify, preprocessed)
+        results['predict'] = summarize(num_tweets, latencies)
+
+        def end_to_end(batch):
+            batch = preprocess_tweets(batch)
+            labels = predict(batch['content_preprocessed_with_stopwords'], mdl, tokenizer)
+            return np.bincount(labels, minlength=7)
+
+        _, latencies = time_batches(end_to_end, batches)
+        results['end_to_end'] = summarize(num_tweets, latencies)
+    else:
+        def end_to_end(batch):
+            return preprocess_tweets(batch)
+
+        _, latencies = time_batches(end_to_end, batches)
+        results['end_to_end_no_predict'] = summarize(num_tweets, latencies)
+
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    for size, stages in results.items():
+        print(f'\n{size} tweets')
+        print(f'{"stage":<24}{"tweets/s":>12}{"p50 ms":>10}{"p95 ms":>10}{"peak RSS MB":>13}')
+        for stage, r in stages.items():
+            print(f'{stage:<24}{r["tweets_per_second"]:>12,.0f}{r["p50_ms"]:>10.1f}'
+                  f'{r["p95_ms"]:>10.1f}{r["peak_rss_mb"]:>13.0f}')
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)['results']
+    with open(new_path) as f:
+        new = json.load(f)['results']
+    print(f'{"size":<8}{"stage":<24}{"old tweets/s":>14}{"new tweets/s":>14}{"change":>9}')
+    for size in new:
+        for stage, r in new[size].items():
+            if stage not in old.get(size, {}):
+                continue
+            before = old[size][stage]['tweets_per_second']
+            after = r['tweets_per_second']
+            print(f'{size:<8}{stage:<24}{before:>14,.0f}{after:>14,.0f}{after / before:>8.2f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline stages')
+    parser.add_argument('--sizes', nargs='+', default=['1k', '100k'], choices=list(SIZES))
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='tweets per batch, latency percentiles are per batch')
+    parser.add_argument('--predict', action='store_true', help='also time the LSTM model')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmarks/results', help='folder for JSON results')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit()
+
+    results = {size: run_size(SIZES[size], args.batch_size, args.predict, args.seed)
+               for size in args.sizes}
+    print_results(results)
+
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, time.strftime('%Y%m%d-%H%M%S') + '.json')
+    with open(path, 'w') as f:
+        json.dump({'commit': git_commit(),
+                   'python': platform.python_version(),
+                   'machine': platform.machine(),
+                   'batch_size': args.batch_size,
+                   'seed': args.seed,
+                   'results': results}, f, indent=2)
+    print(f'\nSaved to {path}')
@@ -1,6 +1,57 @@
 DATA_PATH = 'data/raw'
 PREPROCESSED_DATA_PATH = 'data/preprocessed'
 EMOTION_COUNTS_PATH = 'data/emotion_counts'
+# Collected and analyzed days of previous searches
+RUNS_PATH = 'data/runs'
+# Background jobs of the app: queue, folders of their files, jobs run at once
+JOBS_DB_PATH = 'cache/jobs.sqlite'
+JOBS_PATH = 'data/jobs'
+JOB_WORKERS = 2
+# A finished job is returned for an identical submit only this long, seconds;
+# later the job runs again, so stale days are collected and the current model is used
+JOB_REUSE_SECONDS = 60
+# Memory for loaded days kept between reruns
+DAY_CACHE_MB = 256
+# Tweets per page of the tweet table
+TABLE_PAGE_SIZE = 50
+# Longer lines of line charts are downsampled
+MAX_CHART_POINTS = 500
+
+MODEL_PATH = 'models/lstm/content/lstm_model'
+TOKENIZER_PATH = 'tokenizers/lstm/tokenizer.pickle'
+# Use the array-backed tokenizer converted from the pickled one (utils/tokenizer.py)
+COMPACT_TOKENIZER = True
+# Length the LSTM model was trained with
+MAXLEN = 231
+# How the model is run: 'keras', 'tflite' or 'numpy' (see utils/backends.py),
+# weights of 'tflite' and 'numpy' can be quantized: None, 'float16' or 'int8'
+INFERENCE_BACKEND = 'keras'
+INFERENCE_QUANTIZATION = None
+
+# token -> (part of speech, lemma), saved between runs
+LEMMA_CACHE_PATH = 'cache/lemma_cache.json'
+
+# Predictions of already seen texts
+PREDICTION_CACHE_PATH = 'cache/predictions.sqlite'
+PREDICTION_CACHE_SIZE = 1_000_000
+
+# Timings and counters of the last run
+METRICS_JSON_PATH = 'cache/metrics.json'
+METRICS_PROMETHEUS_PATH = 'cache/metrics.prom'
+
+# Near-identical tweets (estimated Jaccard similarity of word pairs after
+# cleaning) are classified once, None - classify every tweet
+DEDUP_THRESHOLD = 0.8
+
+# Approximate mode: tweets classified per day, the rest of the day is only counted;
+# z-score of confidence intervals of the estimated counts (1.96 - 95%)
+SAMPLE_SIZE = 1000
+CONFIDENCE_Z = 1.96
+
+# Preprocessing worker processes (None - one per CPU, 1 - no workers)
+PREPROCESS_WORKERS = None
+# Days larger than this are split between workers
+PREPROCESS_CHUNK_SIZE = 2000
 
 LABELS_TO_EMOTIONS = {0: 'no emotion',
                       1: 'anger',
@@ -14,6 +65,7 @@ LABELS_TO_EMOTIONS = {0: 'no emotion',
 EMOTION_COLORS = {
     'no emotion': '#4895ef',
     'anger': '#4361ee',
+    'disgust': '#560bad',
     'fear': '#3f37c9',
     'happiness': '#f72585',
     'sadness': '#7209b7',
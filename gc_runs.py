@@ -0,0 +1,28 @@
+"""
+Deletes stored search runs (see utils.run_store) and finished background
+jobs of the app with their files (see utils.jobs).
+
+    python gc_runs.py [--max-age-days DAYS] [--max-size-mb MB] [--jobs-max-age-days DAYS]
+"""
+import argparse
+
+from constants import *
+from utils.jobs import JobQueue
+from utils.run_store import gc_runs
+
+parser = argparse.ArgumentParser(description='Delete old search runs')
+parser.add_argument('--max-age-days', type=float, default=None,
+                    help='delete runs not used for longer than this')
+parser.add_argument('--max-size-mb', type=float, default=None,
+                    help='then delete least recently used runs until all runs fit')
+parser.add_argument('--jobs-max-age-days', type=float, default=None,
+                    help='delete jobs finished longer ago than this')
+args = parser.parse_args()
+
+deleted = gc_runs(RUNS_PATH, max_age_days=args.max_age_days, max_size_mb=args.max_size_mb)
+for path in deleted:
+    print(f'deleted {path}')
+print(f'{len(deleted)} runs deleted')
+
+if args.jobs_max_age_days is not None:
+    print(f'{JobQueue(JOBS_DB_PATH, JOBS_PATH).gc(args.jobs_max_age_days)} jobs deleted')
@@ -0,0 +1,36 @@
+"""
+Converts csv files of the data folders to Parquet, once:
+raw and preprocessed days, emotion counts and days of stored runs.
+Days and emotion counts are now written as Parquet (see utils.storage);
+csv files which were not converted are still read.
+
+    python migrate_to_parquet.py [--delete-csv]
+"""
+import os
+import sys
+
+from constants import *
+from utils.aggregate import COUNTS_FILE, COUNTS_NAME
+from utils.storage import migrate_csv_folder, read_csv, write_table
+
+delete_csv = '--delete-csv' in sys.argv
+
+folders = [DATA_PATH, PREPROCESSED_DATA_PATH]
+if os.path.isdir(RUNS_PATH):
+    for run in sorted(os.listdir(RUNS_PATH)):
+        for sub in ('raw', 'analyzed'):
+            if os.path.isdir(os.path.join(RUNS_PATH, run, sub)):
+                folders.append(os.path.join(RUNS_PATH, run, sub))
+
+for folder in folders:
+    if os.path.isdir(folder):
+        created = migrate_csv_folder(folder, delete_csv=delete_csv)
+        print(f'{folder}: {len(created)} files converted')
+
+# Proportions, deltas, intervals and top terms stay csv files
+path_to_counts = os.path.join(EMOTION_COUNTS_PATH, COUNTS_NAME + '.csv')
+if os.path.exists(path_to_counts):
+    write_table(read_csv(path_to_counts), os.path.join(EMOTION_COUNTS_PATH, COUNTS_FILE))
+    if delete_csv:
+        os.remove(path_to_counts)
+    print(f'{EMOTION_COUNTS_PATH}: {COUNTS_NAME} converted')
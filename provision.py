@@ -0,0 +1,13 @@
+"""
+Downloads data needed to run the app, once per machine:
+
+    python provision.py
+"""
+from utils.resources import download_nltk_resources, missing_nltk_resources
+
+downloaded = download_nltk_resources()
+print(f'NLTK: downloaded {downloaded}' if downloaded else 'NLTK: all packages are installed')
+
+missing = missing_nltk_resources()
+if missing:
+    raise SystemExit(f'NLTK packages {missing} could not be downloaded')
@@ -0,0 +1,91 @@
+"""
+Collects and analyzes tweets without the app, e.g. from cron:
+collect -> clean -> preprocess -> predict -> aggregate, day by day.
+Writes the same files the app reads.
+
+    python run_pipeline.py --begin 2022-10-02 --end 2022-10-09 --keywords "cats, dogs"
+    python run_pipeline.py --begin 2022-10-02 --end 2022-10-09 --replay data/raw
+    python run_pipeline.py --begin 2022-10-02 --end 2022-10-09 --sample-size 2000 --stratify
+"""
+import argparse
+import datetime
+
+from constants import *
+from utils.backends import BACKENDS
+from utils.models import get_model, model_fingerprint
+from utils.pipeline import PipelineStats, search_days
+from utils.prediction_cache import get_prediction_cache
+from utils.progress import ConsoleProgress
+from utils.sources import ReplaySource
+
+
+def parse_date(text):
+    return datetime.datetime.strptime(text, '%Y-%m-%d').date()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Collect tweets and classify their emotions')
+    parser.add_argument('--begin', type=parse_date, required=True, help='first day, YYYY-MM-DD')
+    parser.add_argument('--end', type=parse_date, required=True, help='day after the last one, YYYY-MM-DD')
+    parser.add_argument('--keywords', default='', help='keywords separated by comma')
+    parser.add_argument('--num-tweets-per-day', type=int, default=10)
+    parser.add_argument('--min-favs', type=int, default=0)
+    parser.add_argument('--only-hashtags', action='store_true')
+    parser.add_argument('--replay', default=None,
+                        help='folder with YYYY-MM-DD.parquet files or a JSONL file to read instead of Twitter')
+    parser.add_argument('--workers', type=int, default=PREPROCESS_WORKERS,
+                        help='preprocessing worker processes, 1 - no workers')
+    parser.add_argument('--backend', default=INFERENCE_BACKEND, choices=BACKENDS,
+                        help='how the model is run, see utils/backends.py')
+    parser.add_argument('--quantize', default=INFERENCE_QUANTIZATION, choices=['float16', 'int8'],
+                        help='quantized weights, tflite and numpy backends only')
+    parser.add_argument('--dedup-threshold', type=float, default=DEDUP_THRESHOLD,
+                        help='near-duplicate tweets are classified once, 0 - classify every tweet')
+    parser.add_argument('--sample-size', type=int, default=None,
+                        help='classify a random sample of this many tweets of the whole day '
+                             '(--num-tweets-per-day is not used), counts of the day are estimated '
+                             'with confidence intervals')
+    parser.add_argument('--stratify', action='store_true',
+                        help='sample every hour of the day in proportion to its tweets, with --sample-size')
+    parser.add_argument('--scan-limit', type=int, default=None,
+                        help='sample only the first tweets of every day, with --sample-size; '
+                             'should be well above it, default - the whole day')
+    args = parser.parse_args()
+
+    if args.end <= args.begin:
+        parser.error('--end must be later than --begin')
+
+    progress = ConsoleProgress()
+    stats = PipelineStats()
+
+    # Split keywords into a list, remove extra whitespaces
+    keyword_list = [k.strip() for k in args.keywords.split(',')]
+    query = {'keywords': keyword_list,
+             'only_hashtags': args.only_hashtags,
+             'num_tweets_per_day': args.num_tweets_per_day,
+             'min_favs': args.min_favs}
+    if args.sample_size:
+        query.update(sample_size=args.sample_size, stratify_by_hour=args.stratify,
+                     scan_limit=args.scan_limit)
+
+    model, tokenizer = get_model(backend=args.backend, quantize=args.quantize)
+    prediction_cache = get_prediction_cache(PREDICTION_CACHE_PATH,
+                                            model_fingerprint(backend=args.backend, quantize=args.quantize),
+                                            PREDICTION_CACHE_SIZE)
+
+    # Every day is cleaned and classified as soon as it is collected
+    for day, counts, words in search_days(query, args.begin, args.end, model, tokenizer,
+                                          source=ReplaySource(args.replay) if args.replay else None,
+                                          cache=prediction_cache,
+                                          progress=progress,
+                                          stats=stats,
+                                          workers=args.workers,
+                                          dedup_threshold=args.dedup_threshold or None):
+        print(day, {LABELS_TO_EMOTIONS[label]: n for label, n in counts.items()})
+
+    print(stats.report())
+
+
+# Preprocessing workers are spawned and import __main__, the pipeline must not run again in them
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+import datetime
+import os
+
+import numpy as np
+import pandas as pd
+
+from constants import LABELS_TO_EMOTIONS
+from utils import storage
+
+# Emotions in the order of labels, EMOTIONS[label] is the name of the label
+EMOTIONS = [LABELS_TO_EMOTIONS[label] for label in range(len(LABELS_TO_EMOTIONS))]
+NUM_CLASSES = len(EMOTIONS)
+
+# Files saved to EMOTION_COUNTS_PATH, emotion counts are stored as Parquet (see utils.storage)
+COUNTS_NAME = 'emotion_counts'
+COUNTS_FILE = COUNTS_NAME + '.parquet'
+PROPORTIONS_FILE = 'emotion_proportions.csv'
+DELTAS_FILE = 'emotion_deltas.csv'
+INTERVALS_FILE = 'emotion_intervals.csv'
+TOP_TERMS_FILE = 'top_terms.csv'
+
+
+def label_names(labels):
+    """
+    Accepts array of int labels
+    Returns np.array of emotion names
+    """
+    return np.asarray(EMOTIONS, dtype=object)[np.asarray(labels, dtype='int64')]
+
+
+def count_labels(labels_by_day):
+    """
+    Counts labels of all days with a single np.bincount
+
+    Accepts:
+    --> labels_by_day - list of arrays of int labels, one per day
+
+    Returns np.array of shape (number of days, NUM_CLASSES), int64
+
+    """
+    lengths = [len(labels) for labels in labels_by_day]
+    if not sum(lengths):
+        return np.zeros((len(lengths), NUM_CLASSES), dtype='int64')
+    labels = np.concatenate([np.asarray(labels, dtype='int64') for labels in labels_by_day])
+    day_index = np.repeat(np.arange(len(lengths)), lengths)
+    counts = np.bincount(day_index * NUM_CLASSES + labels, minlength=len(lengths) * NUM_CLASSES)
+    return counts.reshape(len(lengths), NUM_CLASSES)
+
+
+def counts_to_dict(counts):
+    """
+    Accepts row of counts (np.array of NUM_CLASSES)
+    Returns dict {label: number of tweets}
+    """
+    return {label: int(n) for label, n in enumerate(counts)}
+
+
+def counts_matrix(counts):
+    """
+    Accepts list of dicts {label: number of tweets}
+    Returns np.array of shape (len(counts), NUM_CLASSES)
+    """
+    matrix = np.zeros((len(counts), NUM_CLASSES), dtype='int64')
+    for row, day_counts in enumerate(counts):
+        for label, n in day_counts.items():
+            matrix[row, int(label)] = n
+    return matrix
+
+
+def emotion_counts_frame(days, counts, words):
+    """
+    Creates a dataframe with emotion counts, as saved in COUNTS_FILE
+
+    Accepts:
+    --> days - list of str dates
+    --> counts - list of dicts {label: number of tweets}, one per day,
+        or array of shape (number of days, NUM_CLASSES), see count_labels
+    --> words - list of str, most popular words of each day
+
+    Returns DataFrame with columns 'Date', all emotions and 'hashtags'
+
+    """
+    if not isinstance(counts, np.ndarray):
+        counts = counts_matrix(counts)
+    emotion_counts = pd.DataFrame(counts.reshape(-1, NUM_CLASSES), columns=EMOTIONS)
+    emotion_counts.insert(0, 'Date', list(days))
+    emotion_counts['hashtags'] = list(words)
+    return emotion_counts
+
+
+def estimated_counts(estimates):
+    """
+    Accepts dict returned by utils.sampling.estimate_counts
+    Returns np.array of NUM_CLASSES estimated counts, rounded to int
+    """
+    return np.rint(estimates['counts']).astype('int64')
+
+
+def intervals_frame(estimates):
+    """
+    Creates a dataframe with confidence intervals of estimated emotion counts,
+    as saved in emotion_intervals.csv
+
+    Accepts:
+    --> estimates - dict {str date: dict returned by utils.sampling.estimate_counts
+        or None if the day was not sampled}
+
+    Returns DataFrame with columns 'Date', '<emotion> low' and '<emotion> high'
+    for all emotions, 'sample' and 'population' (tweets classified and found),
+    one row per sampled day; None if no day was sampled
+
+    """
+    rows = []
+    for day, estimate in estimates.items():
+        if not estimate:
+            continue
+        row = {'Date': day}
+        for emotion, low, high in zip(EMOTIONS, estimate['counts_low'], estimate['counts_high']):
+            row[f'{emotion} low'] = low
+            row[f'{emotion} high'] = high
+        row['sample'] = estimate['sample']
+        row['population'] = estimate['population']
+        rows.append(row)
+    return pd.DataFrame(rows) if rows else None
+
+
+def proportions(emotion_counts):
+    """
+    Accepts DataFrame created by emotion_counts_frame
+    Returns DataFrame with 'Date' and share of every emotion in the day's tweets,
+    0 for days without tweets
+    """
+    counts = emotion_counts[EMOTIONS].to_numpy(dtype='float64')
+    totals = counts.sum(axis=1, keepdims=True)
+    shares = np.divide(counts, totals, out=np.zeros_like(counts), where=totals > 0)
+    result = pd.DataFrame(shares, columns=EMOTIONS)
+    result.insert(0, 'Date', emotion_counts['Date'].to_numpy())
+    return result
+
+
+def day_deltas(emotion_counts):
+    """
+    Accepts DataFrame created by emotion_counts_frame
+    Returns DataFrame with 'Date' and change of every emotion count
+    since the previous calendar day, NaN if the previous day is not in the frame
+    """
+    dates = pd.to_datetime(emotion_counts['Date']).to_numpy()
+    counts = emotion_counts[EMOTIONS].to_numpy(dtype='float64')
+
+    # row of the previous day of every row, -1 if there is none
+    order = np.argsort(dates)
+    prev_dates = dates - np.timedelta64(1, 'D')
+    pos = np.searchsorted(dates[order], prev_dates)
+    pos = np.minimum(pos, len(dates) - 1)
+    found = dates[order][pos] == prev_dates
+    prev_rows = np.where(found, order[pos], -1)
+
+    deltas = np.full_like(counts, np.nan)
+    deltas[found] = counts[found] - counts[prev_rows[found]]
+    result = pd.DataFrame(deltas, columns=EMOTIONS)
+    result.insert(0, 'Date', emotion_counts['Date'].to_numpy())
+    return result
+
+
+def save_emotion_counts(emotion_counts, counts_path, intervals=None, top_terms=None):
+    """
+    Saves emotion counts, proportions and day-over-day deltas to counts_path,
+    so views do not compute them on every rerun;
+    confidence intervals of sampled days, see intervals_frame;
+    most popular words and hashtags, see utils.heavy_hitters.TermSketches.top_terms
+    """
+    storage.write_day(emotion_counts, counts_path, COUNTS_NAME)
+    proportions(emotion_counts).to_csv(os.path.join(counts_path, PROPORTIONS_FILE), index=False)
+    day_deltas(emotion_counts).to_csv(os.path.join(counts_path, DELTAS_FILE), index=False)
+    if intervals is not None:
+        intervals.to_csv(os.path.join(counts_path, INTERVALS_FILE), index=False)
+    if top_terms is not None:
+        top_terms.to_csv(os.path.join(counts_path, TOP_TERMS_FILE), index=False)
+
+
+def load_emotion_counts(counts_path, columns=None):
+    """
+    Reads emotion counts saved by save_emotion_counts (or emotion_counts.csv of older versions)
+
+    Accepts:
+    --> counts_path - str, folder with emotion counts
+    --> columns - list of columns to read, None - all of them;
+        emotions missing in the file (counts saved before they were shown) are 0
+
+    Returns DataFrame, see emotion_counts_frame
+
+    """
+    if columns is None:
+        return storage.read_day(counts_path, COUNTS_NAME)
+    saved = storage.day_columns(counts_path, COUNTS_NAME)
+    emotion_counts = storage.read_day(counts_path, COUNTS_NAME, [col for col in columns if col in saved])
+    for col in columns:
+        if col not in saved and col in EMOTIONS:
+            emotion_counts[col] = 0
+    return emotion_counts[[col for col in columns if col in emotion_counts]]
+
+
+def previous_day(day):
+    """
+    Accepts str date 'YYYY-MM-DD'
+    Returns str date of the day before
+    """
+    return (datetime.datetime.strptime(day, '%Y-%m-%d') - datetime.timedelta(1)).strftime('%Y-%m-%d')
@@ -1,7 +1,85 @@
-import plotly.graph_objects as go
+import numpy as np
+import pandas as pd
 
+from constants import MAX_CHART_POINTS
+from utils.instrument import timed
 
+# plotly is imported in the functions, so it is loaded only when a chart is drawn
+
+
+def payload_size(fig):
+    """
+    Returns int, size in bytes of the figure's JSON sent to the browser
+    """
+    return len(fig.to_json().encode('utf-8'))
+
+
+def hover_text(texts):
+    """
+    Accepts pd.Series of comma separated words
+    Returns pd.Series of the words one per line, for hover text;
+    'None' if there are no words
+    """
+    texts = texts.astype(str).str.strip()
+    markup = texts.str.replace(r'\s*,\s*', '<br>', regex=True) + '<br>'
+    return markup.where(texts != '', 'None')
+
+
+def lttb(x, y, num_points):
+    """
+    Largest-Triangle-Three-Buckets downsampling of a line.
+
+    Accepts:
+    --> x, y - arrays of numbers, x sorted
+    --> num_points - int, number of points to keep
+
+    Returns np.array of indices of the points kept, the first and the last are always kept
+
+    """
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    n = len(x)
+    if num_points >= n or num_points < 3:
+        return np.arange(n)
+
+    # points between the first and the last one split into num_points - 2 buckets
+    edges = np.floor(np.linspace(1, n - 1, num_points - 1)).astype('int64')
+    selected = np.empty(num_points, dtype='int64')
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(num_points - 2):
+        start, end = edges[i], edges[i + 1]
+        # average point of the next bucket
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        # point making the largest triangle with the previous selected point and the average
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def _as_numbers(values):
+    # dates as nanoseconds, anything else as positions
+    try:
+        return pd.to_datetime(values).to_numpy().astype('int64')
+    except (ValueError, TypeError):
+        return np.arange(len(values))
+
+
+def _transparent(color, alpha=0.25):
+    """
+    Accepts color '#rrggbb'
+    Returns str 'rgba(r,g,b,alpha)'
+    """
+    r, g, b = (int(color[i:i + 2], 16) for i in (1, 3, 5))
+    return f'rgba({r},{g},{b},{alpha})'
+
+
+@timed('charts.show_table')
 def show_table(df):
+    import plotly.graph_objects as go
+
     fig = go.Figure(data=[go.Table(
         columnwidth=[200, 1200],
         header=dict(values=list(df.columns),
@@ -21,6 +99,7 @@ def show_table(df):
     return fig
 
 
+@timed('charts.show_bar')
 def show_bar(x, y):
     """
     Create a vertical bar chart using Plotly.
@@ -29,6 +108,8 @@ def show_bar(x, y):
     :param y: array-like
     :return: plotly Figure object
     """
+    import plotly.graph_objects as go
+
     fig = go.Figure([go.Bar(x=list(x),
                             y=list(y),
                             text=list(y), textposition='auto')])
@@ -40,36 +121,55 @@ def show_bar(x, y):
     return fig
 
 
-def show_lines(df, x_col, y_cols, text_col, colors):
+@timed('charts.show_lines')
+def show_lines(df, x_col, y_cols, text_col, colors, max_points=MAX_CHART_POINTS, bands=None):
+    """
+    Create a line chart using Plotly, one line per column of y_cols.
+
+    :param df: pd.DataFrame
+    :param x_col: str, column with x values (dates)
+    :param y_cols: list of columns, one line per column
+    :param text_col: str, column with comma separated words shown on hover
+    :param colors: list of colors, one per line
+    :param max_points: int, longer lines are downsampled with LTTB
+    :param bands: pd.DataFrame with the rows of df and columns '<y_col> low', '<y_col> high',
+        drawn as error bands around the lines (NaN - no band on that day)
+    :return: plotly Figure object
+    """
+    import plotly.graph_objects as go
+
     fig = go.Figure()
+    df = df.reset_index(drop=True)
 
-    # preprocess hashtags for each day
-    # for hint on hover
-
-    hvr = []
-    for i in range(len(df)):
-        # split string with hashtags
-        txt = df[text_col].loc[i].split(',')
-        # clean whitespaces
-        txt = [t.strip() for t in txt]
-        # create an array of strings for each day
-        txt_markup = ''
-        for j in txt:
-            txt_markup += j + '<br>'
-        if txt_markup == '<br>':
-            txt_markup = 'None'
-        hvr.append(txt_markup)
+    # hashtags of each day, for hint on hover
+    hvr = hover_text(df[text_col]).to_numpy()
+    x = df[x_col].to_numpy()
+    x_numbers = _as_numbers(df[x_col]) if len(df) > max_points else None
 
     hover = 'Date: %{x}' + '<br>Num tweets: %{y}<br>' + \
             '--------------<br>Hashtags:<br>--------------<br><b>%{text}</b>'
 
     for y_col, color in zip(y_cols, colors):
-        fig.add_trace(go.Scatter(x=df[x_col],
-                                 y=df[y_col],
+        y = df[y_col].to_numpy()
+        points = lttb(x_numbers, y, max_points) if x_numbers is not None else slice(None)
+        if bands is not None and f'{y_col} low' in bands:
+            # upper bound, then lower bound filled up to it
+            for bound, fill in (('high', None), ('low', 'tonexty')):
+                fig.add_trace(go.Scatter(x=x[points],
+                                         y=bands[f'{y_col} {bound}'].to_numpy()[points],
+                                         line=dict(width=0),
+                                         fill=fill,
+                                         fillcolor=_transparent(color),
+                                         legendgroup=y_col,
+                                         showlegend=False,
+                                         hoverinfo='skip'))
+        fig.add_trace(go.Scatter(x=x[points],
+                                 y=y[points],
                                  name=y_col,
                                  line=dict(color=color),
+                                 legendgroup=y_col,
                                  hovertemplate=hover,
-                                 text=hvr, fill='tozeroy'))
+                                 text=hvr[points], fill='tozeroy' if bands is None else None))
 
     fig.update_layout(hovermode='closest',
                       margin=dict(l=0, r=0, b=10))
@@ -77,3 +177,28 @@ def show_lines(df, x_col, y_cols, text_col, colors):
     fig.update_xaxes(showgrid=True, gridcolor='#d2d7df')
     fig.update_yaxes(showgrid=True, gridcolor='#d2d7df')
     return fig
+
+
+@timed('charts.show_pie')
+def show_pie(labels, values, colors):
+    """
+    Create a donut chart using Plotly.
+
+    :param labels: list of str
+    :param values: array-like
+    :param colors: list of colors, one per label
+    :return: plotly Figure object
+    """
+    import plotly.graph_objects as go
+
+    fig = go.Figure(data=[go.Pie(labels=list(labels),
+                                 values=values,
+                                 hole=0.3,
+                                 textinfo='label+percent'),
+
+                          ])
+
+    fig.update_traces(marker=dict(colors=list(colors), line=dict(color='#000000', width=1),
+                                  ), opacity=0.9)
+    fig.update_layout(margin=dict(l=0, r=0, b=0, t=0), showlegend=False, height=300, width=300)
+    return fig
@@ -0,0 +1,144 @@
+"""
+Near-duplicate clustering of tweets with MinHash and LSH.
+
+Retweets and templated posts that differ only in a mention or a link are
+the same text once cleaned, or nearly so; only one tweet per cluster has
+to be classified.
+"""
+import zlib
+from collections import Counter
+
+import numpy as np
+
+from utils.instrument import timed
+
+# Prime just below 2**32: hashes (a * x + b) % _PRIME fit in uint64 without overflow
+_PRIME = 4294967291
+
+
+def lsh_params(threshold, num_perm):
+    """
+    Returns tuple (bands, rows): texts with Jaccard similarity above the threshold
+    share a band with high probability, the S-curve crosses 1/2 near (1/bands)^(1/rows)
+    """
+    return min(((num_perm // rows, rows) for rows in range(1, num_perm + 1)),
+               key=lambda p: abs((1. / p[0]) ** (1. / p[1]) - threshold))
+
+
+class MinHasher:
+    """
+    MinHash signatures of texts, computed for many texts at once
+    """
+
+    def __init__(self, num_perm=64, shingle_size=2, seed=1):
+        """
+        :param num_perm: int, length of signatures
+        :param shingle_size: int, number of words in a shingle
+        :param seed: int, the same seed gives the same signatures
+        """
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.a = rng.randint(1, _PRIME, size=num_perm).astype('uint64')
+        self.b = rng.randint(0, _PRIME, size=num_perm).astype('uint64')
+
+    def shingles(self, text):
+        """
+        Returns set of hashes of word n-grams of the text, a text shorter than
+        shingle_size (also an empty one) is a single shingle
+        """
+        words = str(text).split()
+        k = self.shingle_size
+        grams = [' '.join(words[i:i + k]) for i in range(len(words) - k + 1)] or [' '.join(words)]
+        return {zlib.crc32(gram.encode('utf-8')) for gram in grams}
+
+    def signatures(self, texts, chunk_size=2000):
+        """
+        Accepts array of texts
+        Returns np.array of shape (len(texts), num_perm), uint32
+        """
+        texts = list(texts)
+        result = np.empty((len(texts), self.num_perm), dtype='uint32')
+        for begin in range(0, len(texts), chunk_size):
+            shingles = [self.shingles(text) for text in texts[begin:begin + chunk_size]]
+            lengths = np.fromiter(map(len, shingles), dtype='int64', count=len(shingles))
+            hashes = np.fromiter((h for s in shingles for h in s), dtype='uint64', count=int(lengths.sum()))
+            permuted = (hashes[:, None] * self.a + self.b) % _PRIME
+            starts = np.cumsum(lengths) - lengths
+            result[begin:begin + len(shingles)] = np.minimum.reduceat(permuted, starts, axis=0)
+        return result
+
+
+def cluster_signatures(signatures, threshold, bands, rows):
+    """
+    Groups signatures sharing any LSH band, then drops members
+    less similar to their representative than the threshold.
+
+    Returns np.array, for every text the index of its cluster's representative
+    (the first text of the cluster)
+    """
+    n = len(signatures)
+    representatives = np.arange(n)
+    if n < 2:
+        return representatives
+
+    # bucket of every text in every band
+    buckets = []
+    for band in range(bands):
+        block = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        keys = block.view(np.dtype((np.void, block.dtype.itemsize * rows))).ravel()
+        buckets.append(np.unique(keys, return_inverse=True)[1].ravel())
+
+    # connected components: every text takes the smallest index reachable through shared buckets
+    while True:
+        previous = representatives
+        for bucket in buckets:
+            smallest = np.full(bucket.max() + 1, n, dtype=representatives.dtype)
+            np.minimum.at(smallest, bucket, representatives)
+            representatives = smallest[bucket]
+        representatives = representatives[representatives]
+        if np.array_equal(representatives, previous):
+            break
+
+    # chains of similar texts can join dissimilar ones, those stay on their own
+    similarity = (signatures == signatures[representatives]).mean(axis=1)
+    return np.where(similarity >= threshold, representatives, np.arange(n))
+
+
+@timed('dedup.cluster')
+def cluster_texts(texts, threshold=0.8, num_perm=64, shingle_size=2):
+    """
+    Finds clusters of near-identical texts.
+
+    Accepts:
+    --> texts - array of cleaned texts
+    --> threshold - float, estimated Jaccard similarity of word n-grams
+        a text must have with its cluster's representative
+    --> num_perm - int, length of MinHash signatures
+    --> shingle_size - int, number of words in a shingle
+
+    Returns np.array, for every text the index of its cluster's representative
+
+    """
+    hasher = MinHasher(num_perm, shingle_size)
+    bands, rows = lsh_params(threshold, num_perm)
+    return cluster_signatures(hasher.signatures(texts), threshold, bands, rows)
+
+
+def cluster_summary(representatives):
+    """
+    Accepts array returned by cluster_texts
+    Returns dict with number of 'tweets', 'clusters', size of the 'largest' cluster,
+    'saved_fraction' - share of tweets not classified, and
+    'sizes' - {cluster size: number of clusters}
+    """
+    representatives = np.asarray(representatives)
+    if not len(representatives):
+        return {'tweets': 0, 'clusters': 0, 'largest': 0, 'saved_fraction': 0., 'sizes': {}}
+    sizes = np.bincount(representatives)
+    sizes = sizes[sizes > 0]
+    return {'tweets': len(representatives),
+            'clusters': len(sizes),
+            'largest': int(sizes.max()),
+            'saved_fraction': 1. - len(sizes) / len(representatives),
+            'sizes': dict(sorted(Counter(sizes.tolist()).items()))}
@@ -1,14 +1,70 @@
 import datetime
-import itertools
+import json
+import os
+import threading
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import pandas as pd
-import snscrape.modules.twitter as sntwitter
-import streamlit as st
 
-import time
-import os
+from constants import DAY_CACHE_MB
+from utils.instrument import count, current_run, timed, use_run
+from utils.progress import Progress
+from utils.rate_limit import TokenBucket, retry
+from utils.sampling import sample_stream, tweet_hour
+from utils.sources import COLUMNS, SnscrapeSource
+from utils.storage import count_rows, day_file, list_days, read_day
 
 
 # --- Collect data -------------------------------------------------------------
+def build_query(keywords=False,
+                min_favs=10,
+                only_hashtags=False,
+                city=False,
+                radius=False,
+                geocode=False):
+    """
+    Returns Twitter search query (without dates) for the given params,
+    see collect_tweets for their description
+    """
+    # add keywords to query if given
+    if keywords:
+        keywords = ' OR '.join(keywords)
+        search = keywords
+        search = search + ' lang:en' + ' min_faves:{}'.format(min_favs)
+    else:
+        search = 'lang:en' + ' min_faves:{}'.format(min_favs)
+
+    if only_hashtags:
+        search = search + ' filter:hashtags'
+
+    if city:
+        search = search + ' near:{}'.format(city)
+
+    if city and radius:
+        search = search + ' near:{}'.format(city) + ' within:{}'.format(radius)
+
+    if geocode:
+        search = search + ' geocode:{}'.format(geocode)
+
+    return search
+
+
+def day_windows(begin_date, end_date):
+    """
+    Returns list of tuples ('YYYY-MM-DD', next 'YYYY-MM-DD') for every day
+    from begin_date (included) to end_date (not included)
+    """
+    windows = []
+    for day in range((end_date - begin_date).days):
+        today = begin_date + datetime.timedelta(days=day)
+        tomorrow = today + datetime.timedelta(days=1)
+        windows.append((today.strftime('%Y-%m-%d'), tomorrow.strftime('%Y-%m-%d')))
+    return windows
+
+
+@timed('collect_tweets')
 def collect_tweets(begin_date,
                    end_date,
                    keywords=False,
@@ -17,7 +73,16 @@ def collect_tweets(begin_date,
                    city=False,
                    radius=False,
                    geocode=False,
-                   num_tweets_per_day=10
+                   num_tweets_per_day=10,
+                   days=None,
+                   source=None,
+                   max_workers=4,
+                   requests_per_second=1.,
+                   retries=3,
+                   progress=None,
+                   sample_size=None,
+                   stratify_by_hour=False,
+                   scan_limit=None
                    ):
     """
     Collects posts from Twitter by given params
@@ -32,110 +97,183 @@ def collect_tweets(begin_date,
     --> radius - string (e.g. 10km), works only with city
     --> geocode - coordinates (lat,long,radius; e.g. 37.7764685,-122.4172004,10km)
     --> num_tweets_per_day --> int, there may be less tweets if enough haven't been found
+    --> days - list of str dates 'YYYY-MM-DD' to collect instead of all days
+        from begin_date to end_date
+    --> source - utils.sources.TweetSource, default - live search with snscrape
+    --> max_workers - int, number of days collected concurrently
+    --> requests_per_second - float, rate limit shared by all workers
+    --> retries - int, how many times a failed day is retried (with backoff)
+    --> progress - utils.progress.Progress, receives progress of collection
+    --> sample_size - int, keep a uniform random sample of this many tweets
+        of all tweets of every day (num_tweets_per_day is not used), None - keep
+        the first num_tweets_per_day tweets
+    --> stratify_by_hour - bool, sample every hour of the day in proportion
+        to its number of tweets, works only with sample_size
+    --> scan_limit - int, with sample_size: sample only the first scan_limit tweets
+        of a day, None - the whole day
 
     Returns a dictionary, where:
     --> key - string date in format Y-m-d
     --> value - DataFrame with columns 'date' and 'content',
-        which contains collected tweets on a certain day
+        which contains collected tweets on a certain day;
+        when sampled, df.attrs['population'] is {stratum: number of tweets found}
 
     """
+    search = build_query(keywords, min_favs, only_hashtags, city, radius, geocode)
+    windows = day_windows(begin_date, end_date)
+    if days is not None:
+        windows = [window for window in windows if window[0] in days]
+
+    source = source or SnscrapeSource()
+    bucket = TokenBucket(requests_per_second)
+
+    if sample_size and scan_limit is not None and scan_limit <= sample_size:
+        warnings.warn(f'Only {scan_limit} tweets are scanned per day for a sample of {sample_size}: '
+                      f'every scanned tweet is kept, the sample is the first tweets found')
+
+    def sample_day(since, until):
+        # the whole day (or scan_limit tweets) is scanned,
+        # only the sample is kept, the rest is counted and dropped
+        stratum = (lambda tweet: tweet_hour(tweet[0])) if stratify_by_hour else None
+        tweets = source.iter_tweets(search, since, until, scan_limit)
+        sample, population = sample_stream(tweets, sample_size, stratum)
+        df = pd.DataFrame(sample, columns=COLUMNS)
+        df.attrs['population'] = population
+        return df
+
+    run = current_run()
+
+    def collect_day(since, until):
+        def request():
+            bucket.acquire()
+            if sample_size:
+                return sample_day(since, until)
+            return source.get_tweets(search, since, until, num_tweets_per_day)
+        # timings of the worker threads go to the run of the caller
+        with use_run(run):
+            return retry(request, retries=retries)
 
-    # initialize query
-    # add keywords to query if given
-    if keywords:
-        keywords = ' OR '.join(keywords)
-        print('\n\n', keywords, '\n\n')
-        search = keywords
-        search = search + ' lang:en' + ' min_faves:{}'.format(min_favs)
-    else:
-        search = 'lang:en' + ' min_faves:{}'.format(min_favs)
-
-    if only_hashtags:
-        search = search + ' filter:hashtags'
-
-    if city:
-        search = search + ' near:{}'.format(city)
+    dataframes = {}
 
-    if city and radius:
-        search = search + ' near:{}'.format(city) + ' within:{}'.format(radius)
+    progress = progress or Progress()
+    progress.start('collect', len(windows), f'Request: {search}')
 
-    if geocode:
-        search = search + ' geocode:{}'.format(geocode)
+    # Days are collected concurrently, progress is reported from this thread
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(collect_day, since, until): since
+                   for since, until in windows}
+        for done, future in enumerate(as_completed(futures), start=1):
+            dataframes[futures[future]] = future.result()
+            progress.update('collect', done, len(windows))
 
-    # get date interval
-    days = end_date - begin_date
+    progress.finish('collect', 'All data collected!')
+    count('tweets.collected', sum(len(df) for df in dataframes.values()))
+    if sample_size:
+        count('tweets.found', sum(sum(df.attrs['population'].values()) for df in dataframes.values()))
 
-    dataframes = {}
+    # Keep days in chronological order
+    return {since: dataframes[since] for since, _ in windows}
 
-    # Percentage increment, add placeholder for request, progress bar
-    percent_increment = 1. / days.days
-    percent_current = 0
-    placeholder = st.empty()
-    my_bar = st.progress(percent_current)
 
-    for day in range(1, days.days + 1):
-        today = begin_date
-        tomorrow = today + datetime.timedelta(days=1)
+# --- Load data ----------------------------------------------------------------
+# Number of rows of every day file in a folder, so they are not read to be counted
+MANIFEST_FILE = '_manifest.json'
 
-        # dates to string
-        today_str = today.strftime('%Y-%m-%d')
-        tomorrow_str = tomorrow.strftime('%Y-%m-%d')
+# Loaded days: {(path to file, mtime, size, columns): pd.DataFrame}, least recently used first
+_DAY_CACHE = OrderedDict()
+_DAY_CACHE_BYTES = {}
+_CACHE_LOCK = threading.Lock()
 
-        # progress bar
-        my_bar.progress(percent_current)
-        # placeholder.markdown(f'Searching for tweets on day <b>{today_str}</b>',
-        #                      unsafe_allow_html=True)
 
-        # search tweets by query
-        search_new = search + ' since:{}'.format(today_str) + ' until:{}'.format(tomorrow_str)
-        placeholder.write(f'Request: {search_new}')
-        scraped_tweets = sntwitter.TwitterSearchScraper(search_new).get_items()
+def _file_state(path_to_file):
+    stat = os.stat(path_to_file)
+    return stat.st_mtime, stat.st_size
 
-        # get necessary number of tweets
-        sliced_scraped_tweets = itertools.islice(scraped_tweets, num_tweets_per_day)
 
-        # turn collected tweets into dataframe
-        df = pd.DataFrame(sliced_scraped_tweets)
+def _read_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-        if len(df) > 0:
-            df = df[['date', 'content']]
-        else:
-            df = pd.DataFrame(columns=['date', 'content'])
 
-        # add dataframe to dictionary
-        dataframes[today_str] = df
+def _write_manifest(path, manifest):
+    path_to_manifest = os.path.join(path, MANIFEST_FILE)
+    with open(path_to_manifest + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(path_to_manifest + '.tmp', path_to_manifest)
 
-        # move to next day
-        begin_date += datetime.timedelta(days=1)
 
-        # increase progress
-        percent_current += percent_increment
+def day_row_counts(path):
+    """
+    Number of tweets of every day, read from the manifest.
+    Only files changed since they were counted are parsed.
 
-    # Empty progress bar and labels
-    my_bar.empty()
-    placeholder.empty()
-    placeholder.success('All data collected!')
-    time.sleep(1.5)
-    placeholder.empty()
+    :param path: str, path to folder containing files of days (see utils.storage.write_day)
+    :return: dict in format {'date': int}, sorted by date
+    """
+    manifest = _read_manifest(path)
+    counts = {}
+    changed = False
 
-    return dataframes
+    for day in list_days(path):
+        path_to_file = day_file(path, day)
+        mtime, size = _file_state(path_to_file)
+        entry = manifest.get(day)
+        if entry is None or entry['mtime'] != mtime or entry['size'] != size:
+            # the footer of a Parquet file, a csv file is parsed
+            rows = len(load_day(path, day)) if path_to_file.endswith('.csv') else count_rows(path_to_file)
+            entry = {'rows': rows, 'mtime': mtime, 'size': size}
+            manifest[day] = entry
+            changed = True
+        counts[day] = entry['rows']
 
+    # forget deleted files
+    for day in set(manifest) - set(counts):
+        del manifest[day]
+        changed = True
 
-def load_csvs(path):
-    """
-    Load csv files in dictionary.
+    if changed:
+        _write_manifest(path, manifest)
+    return counts
 
-    :param path: str, path to folder containing csv files only
-    :return: dict in format {'date': pd.DataFrame}
-    """
-    dfs_dict = {}
-    date_options_ = []
 
-    for f in os.listdir(path):
-        path_to_csv = os.path.join(path, f)
-        date = f.split('.')[0]
+def _df_bytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
 
-        dfs_dict[date] = pd.read_csv(path_to_csv)
-        date_options_.append(date)
 
-    return dfs_dict, date_options_
+def load_day(path, day, columns=None, memory_budget_mb=DAY_CACHE_MB):
+    """
+    Loads a single day, cached by file path, modification time and columns.
+
+    :param path: str, path to folder containing files of days (see utils.storage.write_day)
+    :param day: str date
+    :param columns: list of columns to read, None - all of them
+    :param memory_budget_mb: float, least recently used days are dropped
+        from the cache when all cached days take more memory
+    :return: pd.DataFrame, do not modify it in place - it is shared
+    """
+    path_to_file = day_file(path, day)
+    state = _file_state(path_to_file)
+    key = (path_to_file,) + state + (tuple(columns) if columns else None,)
+
+    with _CACHE_LOCK:
+        if key in _DAY_CACHE:
+            _DAY_CACHE.move_to_end(key)
+            return _DAY_CACHE[key]
+
+    df = read_day(path, day, columns)
+
+    with _CACHE_LOCK:
+        # older versions of the same file are not needed anymore
+        for old_key in [k for k in _DAY_CACHE if k[0] == path_to_file and k[1:3] != state]:
+            del _DAY_CACHE[old_key]
+            del _DAY_CACHE_BYTES[old_key]
+        _DAY_CACHE[key] = df
+        _DAY_CACHE_BYTES[key] = _df_bytes(df)
+        while len(_DAY_CACHE) > 1 and sum(_DAY_CACHE_BYTES.values()) > memory_budget_mb * 2 ** 20:
+            old_key, _ = _DAY_CACHE.popitem(last=False)
+            del _DAY_CACHE_BYTES[old_key]
+
+    return df
@@ -0,0 +1,211 @@
+"""
+Most popular words and hashtags in fixed memory (Space-Saving).
+
+A sketch keeps at most `capacity` terms with an upper bound of their count
+and how much it may be overestimated. Sketches of days or of workers are
+merged into the sketch of the whole range, again of the same size.
+"""
+import heapq
+import itertools
+from collections import Counter
+
+import pandas as pd
+
+from utils.instrument import timed
+
+# Terms kept per sketch, the count of any term is overestimated
+# by at most (number of terms counted) / capacity
+SKETCH_CAPACITY = 200
+
+# What can be counted and which dataframe column it comes from
+TERM_COLUMNS = {'words': 'content_preprocessed',
+                'hashtags': 'hashtags'}
+
+
+class SpaceSaving:
+    """
+    Space-Saving summary of a stream of terms.
+
+    For a term in the sketch its true count is between count - error and count;
+    a term not in the sketch appeared at most min_count() times.
+    """
+
+    def __init__(self, capacity=SKETCH_CAPACITY):
+        """
+        :param capacity: int, maximum number of terms kept
+        """
+        self.capacity = capacity
+        # term -> (upper bound of count, maximum overestimation)
+        self.counters = {}
+        # number of terms counted
+        self.total = 0
+
+    def __len__(self):
+        return len(self.counters)
+
+    def min_count(self):
+        """
+        Returns int, upper bound of the count of any term not in the sketch
+        """
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(count for count, _ in self.counters.values())
+
+    def error_bound(self):
+        """
+        Returns int, maximum overestimation of any count, at most total / capacity
+        """
+        return self.min_count()
+
+    def update(self, terms):
+        """
+        Counts terms, e.g. tokens of a batch of tweets.
+        The batch is counted exactly and merged, so the sketch is updated
+        once per batch instead of once per term.
+
+        :param terms: iterable of str
+        """
+        batch = Counter(terms)
+        # not full, so terms missing from the batch count as 0
+        exact = SpaceSaving(len(batch) + 1)
+        exact.counters = {term: (n, 0) for term, n in batch.items()}
+        exact.total = sum(batch.values())
+        self.merge(exact)
+
+    def update_lists(self, token_lists, batch_size=1000):
+        """
+        :param token_lists: iterable of lists of terms, e.g. a column of tokens
+        :param batch_size: int, lists counted exactly before they are merged,
+            bounds memory used on top of the sketch
+        """
+        token_lists = iter(token_lists)
+        while True:
+            batch = list(itertools.islice(token_lists, batch_size))
+            if not batch:
+                return
+            self.update(term for tokens in batch for term in tokens)
+
+    def merge(self, other):
+        """
+        Adds counts of another sketch, e.g. of another day or worker.
+        A term missing from one of the sketches gets that sketch's min_count,
+        so counts stay upper bounds; then only the largest counts are kept.
+        """
+        own_min, other_min = self.min_count(), other.min_count()
+        merged = {}
+        for term in self.counters.keys() | other.counters.keys():
+            count, error = self.counters.get(term, (own_min, own_min))
+            other_count, other_error = other.counters.get(term, (other_min, other_min))
+            merged[term] = (count + other_count, error + other_error)
+
+        if len(merged) > self.capacity:
+            merged = dict(heapq.nlargest(self.capacity, merged.items(), key=lambda item: item[1][0]))
+        self.counters = merged
+        self.total += other.total
+        return self
+
+    def top_k(self, k=10, min_occur=1):
+        """
+        Most popular terms.
+
+        Accepts:
+        --> k - int, how many terms to return
+        --> min_occur - int, minimum (estimated) count of a term
+
+        Returns DataFrame with columns 'word', 'num' (upper bound of the count)
+        and 'error' (num - error is a lower bound), sorted by 'num'
+
+        """
+        items = [(term, count, error) for term, (count, error) in self.counters.items()
+                 if count >= min_occur]
+        items = heapq.nsmallest(k, items, key=lambda item: (-item[1], item[2], item[0]))
+        return pd.DataFrame(items, columns=['word', 'num', 'error'])
+
+    def guaranteed(self, k=10):
+        """
+        Returns list of terms of top_k(k), which are certainly more popular
+        than any term not in the sketch
+        """
+        return [term for term, num, error in self.top_k(k).itertuples(index=False)
+                if num - error > self.min_count()]
+
+    def to_dict(self):
+        """
+        Returns JSON-serializable dict, see from_dict
+        """
+        return {'capacity': self.capacity, 'total': self.total,
+                'counters': {term: list(value) for term, value in self.counters.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['capacity'])
+        sketch.total = data['total']
+        sketch.counters = {term: tuple(value) for term, value in data['counters'].items()}
+        return sketch
+
+
+def day_sketches(df, columns=TERM_COLUMNS, kinds=('words', 'hashtags'), capacity=SKETCH_CAPACITY):
+    """
+    Counts terms of a day.
+
+    :param df: pd.DataFrame with columns of lists of terms
+    :param columns: dict {kind: column}
+    :return: dict {kind: SpaceSaving}
+    """
+    sketches = {}
+    for kind in kinds:
+        sketch = SpaceSaving(capacity)
+        sketch.update_lists(df[columns[kind]])
+        sketches[kind] = sketch
+    return sketches
+
+
+class TermSketches:
+    """
+    Space-Saving sketches of every kind of term (see TERM_COLUMNS)
+    of every day, and of all days together.
+    """
+
+    def __init__(self, kinds=('words', 'hashtags'), capacity=SKETCH_CAPACITY):
+        self.kinds = tuple(kinds)
+        self.capacity = capacity
+        # {day: {kind: SpaceSaving}}
+        self.days = {}
+        # {kind: SpaceSaving}, all days merged
+        self.total = {kind: SpaceSaving(capacity) for kind in self.kinds}
+
+    @timed('heavy_hitters.add_day')
+    def add_day(self, day, df, columns):
+        """
+        Counts terms of a day.
+
+        :param day: str date
+        :param df: pd.DataFrame with columns of lists of terms
+        :param columns: dict {kind: column}
+        :return: dict {kind: SpaceSaving} of the day
+        """
+        return self.add_sketches(day, day_sketches(df, columns, self.kinds, self.capacity))
+
+    def add_sketches(self, day, sketches):
+        """
+        Adds sketches of a day counted before, e.g. by a worker or in a previous run
+        """
+        self.days[day] = sketches
+        for kind in self.kinds:
+            self.total[kind].merge(sketches[kind])
+        return sketches
+
+    def top_terms(self, k=10):
+        """
+        Returns DataFrame with columns 'Date' ('all' for all days), 'kind',
+        'word', 'num', 'error' and 'bound' (error bound of the whole sketch)
+        """
+        frames = []
+        for day, sketches in [('all', self.total)] + sorted(self.days.items()):
+            for kind in self.kinds:
+                top = sketches[kind].top_k(k)
+                top.insert(0, 'kind', kind)
+                top.insert(0, 'Date', day)
+                top['bound'] = sketches[kind].error_bound()
+                frames.append(top)
+        return pd.concat(frames, ignore_index=True)
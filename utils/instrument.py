@@ -0,0 +1,193 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Turned off with EMOTIONS_INSTRUMENTATION=0, then timers cost a single check
+ENABLED = os.environ.get('EMOTIONS_INSTRUMENTATION', '1') != '0'
+
+_NULL_TIMER = nullcontext()
+_LOCK = threading.Lock()
+
+
+class Run:
+    """
+    Timings and counters collected during a single run (e.g. one Analyze click)
+    """
+
+    def __init__(self, name='run'):
+        self.name = name
+        self.started_at = time.time()
+        # {name: {'calls', 'seconds', 'max_seconds'}}
+        self.timings = {}
+        # {name: value}
+        self.counters = {}
+        # {name: last value}, e.g. size of the last figure sent to the browser
+        self.gauges = {}
+
+    def add_time(self, name, seconds):
+        with _LOCK:
+            timing = self.timings.get(name)
+            if timing is None:
+                timing = self.timings[name] = {'calls': 0, 'seconds': 0., 'max_seconds': 0.}
+            timing['calls'] += 1
+            timing['seconds'] += seconds
+            if seconds > timing['max_seconds']:
+                timing['max_seconds'] = seconds
+
+    def add_count(self, name, value=1):
+        with _LOCK:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        with _LOCK:
+            self.gauges[name] = value
+
+    def merge(self, other):
+        """
+        Adds timings, counters and gauges of another run, e.g. of a worker process
+        """
+        with _LOCK:
+            for name, timing in other.timings.items():
+                total = self.timings.setdefault(name, {'calls': 0, 'seconds': 0., 'max_seconds': 0.})
+                total['calls'] += timing['calls']
+                total['seconds'] += timing['seconds']
+                total['max_seconds'] = max(total['max_seconds'], timing['max_seconds'])
+            for name, value in other.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            self.gauges.update(other.gauges)
+
+    def as_dict(self):
+        return {'name': self.name,
+                'started_at': self.started_at,
+                'duration': time.time() - self.started_at,
+                'timings': self.timings,
+                'counters': self.counters,
+                'gauges': self.gauges}
+
+    def to_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+    def to_prometheus(self, path, prefix='emotions'):
+        """
+        Saves timings and counters in Prometheus text exposition format,
+        e.g. for the node_exporter textfile collector
+        """
+        lines = [f'# TYPE {prefix}_stage_seconds_total counter',
+                 f'# TYPE {prefix}_stage_calls_total counter',
+                 f'# TYPE {prefix}_stage_max_seconds gauge',
+                 f'# TYPE {prefix}_count_total counter',
+                 f'# TYPE {prefix}_gauge gauge']
+        for name, timing in sorted(self.timings.items()):
+            lines.append(f'{prefix}_stage_seconds_total{{stage="{name}"}} {timing["seconds"]:.6f}')
+            lines.append(f'{prefix}_stage_calls_total{{stage="{name}"}} {timing["calls"]}')
+            lines.append(f'{prefix}_stage_max_seconds{{stage="{name}"}} {timing["max_seconds"]:.6f}')
+        for name, value in sorted(self.counters.items()):
+            lines.append(f'{prefix}_count_total{{name="{name}"}} {value}')
+        for name, value in sorted(self.gauges.items()):
+            lines.append(f'{prefix}_gauge{{name="{name}"}} {value}')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+# Runs of threads that started one (e.g. background jobs), the others collect into _default
+_default = Run()
+_local = threading.local()
+
+
+def start_run(name='run'):
+    """
+    Starts collecting into a new Run in the current thread, returns it.
+    Runs of other threads (e.g. other jobs) are not affected
+    """
+    _local.run = Run(name)
+    return _local.run
+
+
+def current_run():
+    return getattr(_local, 'run', _default)
+
+
+@contextmanager
+def use_run(run):
+    """
+    Collects into the run in the current thread, e.g. in threads started by a job:
+
+        run = current_run()
+        ...
+        with use_run(run):
+            ...
+    """
+    previous = getattr(_local, 'run', None)
+    _local.run = run
+    try:
+        yield run
+    finally:
+        if previous is None:
+            del _local.run
+        else:
+            _local.run = previous
+
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        current_run().add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def timer(name):
+    """
+    Context manager, adds time spent inside to the current run:
+
+        with timer('io.csv_write'):
+            df.to_csv(...)
+    """
+    if not ENABLED:
+        return _NULL_TIMER
+    return _Timer(name)
+
+
+def timed(name):
+    """
+    Decorator, adds time spent in every call of the function to the current run
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                current_run().add_time(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1):
+    """
+    Adds value to a counter of the current run
+    """
+    if ENABLED:
+        current_run().add_count(name, value)
+
+
+def gauge(name, value):
+    """
+    Sets a value of the current run, replacing the previous one
+    """
+    if ENABLED:
+        current_run().set_gauge(name, value)
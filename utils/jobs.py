@@ -0,0 +1,440 @@
+"""
+Background jobs: collection and analysis run in a pool of worker threads
+of the app's process instead of the Streamlit script run, so reruns do not
+interrupt them and sessions only poll their progress.
+
+Jobs are stored in SQLite with their parameters, progress and results.
+Submitting a job identical to a queued, running or just finished one returns
+that job, so concurrent sessions share the work. Every job writes its files
+to its own folder, sessions do not overwrite each other's data; jobs of
+the same search share its RunStore, which serializes them.
+"""
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from constants import JOB_REUSE_SECONDS, JOB_WORKERS, JOBS_DB_PATH, JOBS_PATH, METRICS_JSON_PATH, METRICS_PROMETHEUS_PATH
+from utils import instrument
+from utils.instrument import count
+from utils.progress import Progress
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+# Job kinds: {kind: function (JobQueue, job dict, Progress) -> JSON-serializable result}
+HANDLERS = {}
+
+# Open queues, one per file: {path: JobQueue}
+_QUEUES = {}
+_LOCK = threading.Lock()
+
+
+def handler(kind):
+    """
+    Registers a function running jobs of the kind
+    """
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def job_key(kind, params):
+    """
+    Returns str, identical jobs have the same key
+    """
+    text = json.dumps([kind, params], sort_keys=True, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _owner():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _owner_alive(owner):
+    host, _, pid = (owner or '').rpartition(':')
+    if host != socket.gethostname():
+        # another machine sharing the file, its jobs are its own business
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobProgress(Progress):
+    """
+    Saves progress of a job, so sessions can poll it, with partial results
+    (e.g. days analyzed so far) under 'results'
+    """
+
+    def __init__(self, queue, job_id, min_interval=0.2):
+        self.queue = queue
+        self.job_id = job_id
+        self.min_interval = min_interval
+        self._saved_at = 0.
+        self._state = {}
+        # {key: JSON-serializable value}
+        self.results = {}
+
+    def _flush(self, force=False):
+        now = time.monotonic()
+        if force or now - self._saved_at >= self.min_interval:
+            self._saved_at = now
+            self.queue.set_progress(self.job_id, dict(self._state, results=self.results))
+
+    def _save(self, stage, done, total, message, force=False):
+        self._state = {'stage': stage, 'done': done, 'total': total, 'message': message}
+        self._flush(force)
+
+    def add_result(self, key, value):
+        """
+        Adds a partial result, saved with the progress
+        """
+        self.results[key] = value
+        self._flush()
+
+    def start(self, stage, total, message=None):
+        self._save(stage, 0, total, message, force=True)
+
+    def update(self, stage, done, total, message=None):
+        self._save(stage, done, total, message, force=done == total)
+
+    def finish(self, stage, message=None):
+        self._save(stage, 1, 1, message, force=True)
+
+
+class JobQueue:
+    """
+    Job queue persisted in SQLite, with a pool of worker threads.
+
+    Jobs left running by a process that is gone are queued again when
+    the queue is opened. Results are kept until gc removes them.
+    """
+
+    def __init__(self, path=JOBS_DB_PATH, root=JOBS_PATH, workers=JOB_WORKERS, reuse_seconds=JOB_REUSE_SECONDS):
+        """
+        :param path: str, path to the SQLite file
+        :param root: str, folder with a subfolder of files per job
+        :param workers: int, jobs run at once
+        :param reuse_seconds: float, how long a finished job is returned for an identical submit
+        """
+        self.path = path
+        self.root = root
+        self.workers = workers
+        self.reuse_seconds = reuse_seconds
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        # transactions are explicit, see _transaction
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        with self._transaction():
+            self._conn.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                               'id TEXT PRIMARY KEY, kind TEXT, key TEXT, params TEXT, '
+                               'status TEXT, progress TEXT, result TEXT, error TEXT, owner TEXT, '
+                               'created_at REAL, started_at REAL, finished_at REAL)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, status)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)')
+            # the process running these jobs has stopped
+            for row in self._conn.execute('SELECT id, owner FROM jobs WHERE status = ?', (RUNNING,)).fetchall():
+                if not _owner_alive(row['owner']):
+                    self._conn.execute('UPDATE jobs SET status = ?, owner = NULL WHERE id = ?',
+                                       (QUEUED, row['id']))
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            # IMMEDIATE: other processes sharing the file wait, so a job is claimed once
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    # ---  Sessions  -----------------------------------------------------------
+    def submit(self, kind, params):
+        """
+        Queues a job, unless an identical one is queued, running or finished
+        less than reuse_seconds ago. Older results are not reused: days may be stale
+        by now (see utils.run_store.RunStore) and the model may have been reloaded.
+        Failed jobs are queued again.
+
+        :param kind: str, key of HANDLERS
+        :param params: JSON-serializable dict
+        :return: str, id of the job
+        """
+        if kind not in HANDLERS:
+            raise ValueError(f'Unknown job kind: {kind}')
+        key = job_key(kind, params)
+        with self._transaction():
+            row = self._conn.execute('SELECT id, status FROM jobs WHERE key = ? '
+                                     'AND (status IN (?, ?) OR (status = ? AND finished_at >= ?)) '
+                                     'ORDER BY created_at DESC LIMIT 1',
+                                     (key, QUEUED, RUNNING, DONE, time.time() - self.reuse_seconds)).fetchone()
+            if row is not None:
+                count('jobs.reused' if row['status'] == DONE else 'jobs.shared')
+                return row['id']
+            job_id = uuid.uuid4().hex[:16]
+            self._conn.execute('INSERT INTO jobs (id, kind, key, params, status, created_at) '
+                               'VALUES (?, ?, ?, ?, ?, ?)',
+                               (job_id, kind, key, json.dumps(params, default=str), QUEUED, time.time()))
+        count('jobs.submitted')
+        self.start()
+        self._wake.set()
+        return job_id
+
+    def get(self, job_id):
+        """
+        Returns dict with 'id', 'kind', 'params', 'status', 'progress', 'result',
+        'error', 'created_at', 'started_at', 'finished_at' and 'folder'
+        of the job, None if there is no such job
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._as_dict(row) if row is not None else None
+
+    def jobs(self, status=None, limit=50):
+        """
+        Returns list of the latest jobs, see get
+        """
+        query, args = 'SELECT * FROM jobs', ()
+        if status:
+            query, args = query + ' WHERE status = ?', (status,)
+        with self._lock:
+            rows = self._conn.execute(query + ' ORDER BY created_at DESC LIMIT ?', args + (limit,)).fetchall()
+        return [self._as_dict(row) for row in rows]
+
+    def folder(self, job_id):
+        """
+        Returns str, folder with files of the job
+        """
+        return os.path.join(self.root, job_id)
+
+    def _as_dict(self, row):
+        job = dict(row)
+        for column in ('params', 'progress', 'result'):
+            job[column] = json.loads(job[column]) if job[column] else None
+        job['folder'] = self.folder(job['id'])
+        del job['key'], job['owner']
+        return job
+
+    # ---  Workers  ------------------------------------------------------------
+    def set_progress(self, job_id, progress):
+        with self._transaction():
+            self._conn.execute('UPDATE jobs SET progress = ? WHERE id = ?',
+                               (json.dumps(progress, default=str), job_id))
+
+    def _claim(self):
+        # the oldest queued job, or None
+        with self._transaction():
+            row = self._conn.execute('SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1',
+                                     (QUEUED,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute('UPDATE jobs SET status = ?, owner = ?, started_at = ? WHERE id = ?',
+                               (RUNNING, _owner(), time.time(), row['id']))
+        return self.get(row['id'])
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._transaction():
+            self._conn.execute('UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? '
+                               'WHERE id = ?',
+                               (status, json.dumps(result, default=str) if result is not None else None,
+                                error, time.time(), job_id))
+
+    def run_job(self, job):
+        """
+        Runs a claimed job in the current thread and saves its result or error
+        """
+        os.makedirs(job['folder'], exist_ok=True)
+        try:
+            result = HANDLERS[job['kind']](self, job, JobProgress(self, job['id']))
+        except Exception as e:
+            count('jobs.failed')
+            self._finish(job['id'], FAILED, error=f'{type(e).__name__}: {e}')
+        else:
+            count('jobs.done')
+            self._finish(job['id'], DONE, result=result)
+
+    def _work(self):
+        while not self._stop.is_set():
+            job = self._claim()
+            if job is None:
+                # woken up by submit, or polls for jobs of other processes
+                self._wake.wait(1.)
+                self._wake.clear()
+                continue
+            self.run_job(job)
+
+    def start(self):
+        """
+        Starts the worker threads, once
+        """
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def close(self):
+        """
+        Stops the workers after their current jobs
+        """
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._conn.close()
+
+    def gc(self, max_age_days):
+        """
+        Removes finished jobs older than max_age_days, with their folders
+        """
+        cutoff = time.time() - max_age_days * 86400
+        with self._transaction():
+            rows = self._conn.execute('SELECT id FROM jobs WHERE status IN (?, ?) AND finished_at < ?',
+                                      (DONE, FAILED, cutoff)).fetchall()
+            self._conn.executemany('DELETE FROM jobs WHERE id = ?', [(row['id'],) for row in rows])
+        for row in rows:
+            shutil.rmtree(self.folder(row['id']), ignore_errors=True)
+        return len(rows)
+
+
+def get_job_queue(path=JOBS_DB_PATH, root=JOBS_PATH, workers=JOB_WORKERS):
+    """
+    Returns JobQueue of the file, opened once per process, workers started
+    """
+    with _LOCK:
+        if path not in _QUEUES:
+            _QUEUES[path] = JobQueue(path, root, workers)
+        queue = _QUEUES[path]
+    queue.start()
+    return queue
+
+
+def save_metrics(run):
+    # Timings of the run, for monitoring
+    os.makedirs(os.path.dirname(METRICS_JSON_PATH), exist_ok=True)
+    run.to_json(METRICS_JSON_PATH)
+    run.to_prometheus(METRICS_PROMETHEUS_PATH)
+
+
+def job_paths(folder):
+    """
+    Returns dict of folders a search writes to: 'data_path', 'preprocessed_path', 'counts_path'
+    """
+    paths = {'data_path': os.path.join(folder, 'raw'),
+             'preprocessed_path': os.path.join(folder, 'preprocessed'),
+             'counts_path': os.path.join(folder, 'emotion_counts')}
+    for path in paths.values():
+        os.makedirs(path, exist_ok=True)
+    return paths
+
+
+def _copy_files(source, destination):
+    # files of a folder, e.g. days of a search an analysis works on
+    if not os.path.isdir(source):
+        return
+    for entry in os.scandir(source):
+        if entry.is_file():
+            shutil.copy(entry.path, os.path.join(destination, entry.name))
+
+
+# ---  Jobs of the app  --------------------------------------------------------
+@handler('collect')
+def collect_job(queue, job, progress):
+    """
+    Collects tweets of a search into the job's folder.
+
+    params: 'query' (see utils.pipeline.collect_days), 'begin_date', 'end_date' ('YYYY-MM-DD')
+    result: 'days', folders (see job_paths) and 'metrics' (see utils.instrument.Run.as_dict)
+    """
+    from utils.pipeline import collect_days
+
+    params = job['params']
+    paths = job_paths(job['folder'])
+    # timings of this job only, other jobs run in other threads
+    run = instrument.start_run('search')
+    _, days = collect_days(params['query'],
+                           begin_date=datetime.date.fromisoformat(params['begin_date']),
+                           end_date=datetime.date.fromisoformat(params['end_date']),
+                           progress=progress,
+                           **paths)
+    save_metrics(run)
+    return dict(paths, days=days, metrics=run.as_dict())
+
+
+@handler('analyze')
+def analyze_job(queue, job, progress):
+    """
+    Analyzes a search in the job's folder, so the folders of the search job
+    (or the data folders written by run_pipeline.py) are not modified.
+    With the search parameters, days collected before are reused and the others
+    (e.g. stale ones) are collected as they are analyzed (see utils.pipeline.search_days);
+    without them, collected days are copied from the given folders and analyzed.
+
+    params: 'query', 'begin_date', 'end_date' of a search (see collect_job), or
+    'days', 'data_path', 'preprocessed_path', 'counts_path' of collected days (see job_paths)
+    progress results: {day: {'counts': {label: number of tweets}, 'words': str}} of days done so far
+    result: 'days', folders with predicted labels and emotion counts (see job_paths),
+    'dedup' (see PipelineStats.dedup_summary), 'stages' (see PipelineStats.as_dict),
+    'model' (see utils.models.model_info), 'lemma_cache' and 'prediction_cache' stats, 'metrics'
+    """
+    from constants import PREDICTION_CACHE_PATH, PREDICTION_CACHE_SIZE
+    from utils.models import get_model, model_fingerprint, model_info
+    from utils.pipeline import PipelineStats, analyze_days, search_days
+    from utils.prediction_cache import get_prediction_cache
+    from utils.preprocess import LEMMA_CACHE
+
+    params = job['params']
+    paths = job_paths(job['folder'])
+    run = instrument.start_run('analyze')
+    model, tokenizer = get_model()
+    prediction_cache = get_prediction_cache(PREDICTION_CACHE_PATH, model_fingerprint(), PREDICTION_CACHE_SIZE)
+    stats = PipelineStats()
+    if 'query' in params:
+        # days are cleaned and classified as soon as they are collected
+        days = search_days(params['query'],
+                           datetime.date.fromisoformat(params['begin_date']),
+                           datetime.date.fromisoformat(params['end_date']),
+                           model, tokenizer,
+                           cache=prediction_cache, progress=progress, stats=stats, **paths)
+    else:
+        _copy_files(params['data_path'], paths['data_path'])
+        _copy_files(params['preprocessed_path'], paths['preprocessed_path'])
+        days = analyze_days(params['days'], model, tokenizer,
+                            cache=prediction_cache, progress=progress, stats=stats, **paths)
+    for day, counts, words in days:
+        # sessions show the days done so far
+        progress.add_result(day, {'counts': counts, 'words': words})
+    save_metrics(run)
+    return dict(paths,
+                days=sorted(progress.results),
+                dedup=stats.dedup_summary(),
+                stages=stats.as_dict(),
+                model=model_info(),
+                lemma_cache=LEMMA_CACHE.stats(),
+                prediction_cache=prediction_cache.stats(),
+                metrics=run.as_dict())
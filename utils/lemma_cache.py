@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class LemmaCache:
+    """
+    Bounded LRU cache: token -> (part of speech, lemma).
+
+    Tweet vocabularies are very skewed, so most tokens are looked up in
+    WordNet again and again; with the cache each token is looked up once.
+    The cache can be saved to a json file and preloaded at startup.
+    """
+
+    def __init__(self, maxsize=200_000):
+        """
+        :param maxsize: int, maximum number of tokens kept
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # tokens computed since the last take_new, None - not tracked
+        self._new = None
+
+    def get(self, token, compute):
+        """
+        Accepts token and a function token -> (pos, lemma),
+        which is called only if the token is not cached
+        Returns tuple (pos, lemma)
+
+        """
+        with self._lock:
+            value = self._data.get(token)
+            if value is not None:
+                self._data.move_to_end(token)
+                self.hits += 1
+                return value
+
+        value = compute(token)
+
+        with self._lock:
+            self.misses += 1
+            self._data[token] = value
+            if self._new is not None:
+                self._new[token] = value
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def track_new(self):
+        """
+        Remembers tokens computed from now on, e.g. in a worker process, see take_new
+        """
+        with self._lock:
+            self._new = {}
+
+    def take_new(self):
+        """
+        Returns list of (token, (pos, lemma)) computed since the last call,
+        empty if new tokens are not tracked
+        """
+        with self._lock:
+            if not self._new:
+                return []
+            items, self._new = list(self._new.items()), {}
+        return items
+
+    def add_items(self, items):
+        """
+        Adds (token, (pos, lemma)) pairs, e.g. computed by worker processes
+
+        :return: int, number of tokens which were not cached
+        """
+        added = 0
+        with self._lock:
+            for token, (pos, lemma) in items:
+                added += token not in self._data
+                self._data[token] = (pos, lemma)
+                self._data.move_to_end(token)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return added
+
+    def stats(self):
+        """
+        Returns dict with 'size', 'maxsize', 'hits', 'misses' and 'hit_rate'
+        """
+        total = self.hits + self.misses
+        return {'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.}
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+            if self._new is not None:
+                self._new = {}
+
+    def save(self, path):
+        """
+        Saves cached tokens to a json file, least recently used first.
+        The file is written under a temporary name and then replaced,
+        so concurrent saves never leave it half-written
+        """
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with self._lock:
+            items = list(self._data.items())
+        # a temporary file of its own for every writer, e.g. two analysis jobs
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=folder or '.',
+                                         suffix='.tmp', delete=False) as f:
+            json.dump(items, f)
+        os.replace(f.name, path)
+
+    def load(self, path):
+        """
+        Adds tokens from a json file created by save(), if the file exists;
+        only the maxsize most recently used tokens of the file are read.
+        A corrupt file is skipped, the cache is only slower without it
+
+        :return: int, number of tokens added, which were not cached
+        """
+        if not os.path.exists(path):
+            return 0
+        try:
+            with open(path, encoding='utf-8') as f:
+                items = json.load(f)
+            return self.add_items(items[-self.maxsize:])
+        except (ValueError, TypeError) as e:
+            logger.warning('Lemma cache %s is not loaded: %s', path, e)
+            return 0
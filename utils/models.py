@@ -0,0 +1,166 @@
+import hashlib
+import os
+import threading
+import time
+
+import numpy as np
+
+from constants import *
+from utils.backends import load_backend
+from utils.predict import model_buckets
+from utils.tokenizer import load_tokenizer
+
+# Process-wide registry of loaded models, shared by every Streamlit
+# session and rerun: {(model_path, tokenizer_path, backend, quantize): entry}
+_REGISTRY = {}
+_LOCK = threading.Lock()
+# Threads loading models in the background, one per key of _REGISTRY: {key: threading.Thread}
+_PRELOADS = {}
+_PRELOAD_LOCK = threading.Lock()
+
+
+def _files_signature(*paths):
+    """
+    Accepts paths to files or folders (SavedModel is a folder)
+    Returns a tuple of (path, mtime, size) for every file found,
+    used to detect that the model or tokenizer has changed on disk
+
+    """
+    signature = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for f in sorted(files):
+                    full_path = os.path.join(root, f)
+                    stat = os.stat(full_path)
+                    signature.append((full_path, stat.st_mtime, stat.st_size))
+        elif os.path.exists(path):
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime, stat.st_size))
+    return tuple(sorted(signature))
+
+
+def model_fingerprint(model_path=MODEL_PATH, tokenizer_path=TOKENIZER_PATH,
+                      backend=INFERENCE_BACKEND, quantize=INFERENCE_QUANTIZATION):
+    """
+    Returns str, a hash of the model and tokenizer files (names, sizes and
+    modification times), changes whenever any of the files changes,
+    the backend or quantization
+    """
+    signature = repr(_files_signature(model_path, tokenizer_path))
+    if backend != 'keras' or quantize:
+        signature += f'|{backend}|{quantize}'
+    return hashlib.sha1(signature.encode('utf-8')).hexdigest()
+
+
+def warmup(mdl, maxlen=MAXLEN):
+    """
+    Runs a single prediction on a dummy padded sequence, so that graph
+    tracing happens here and not on the first user request.
+
+    :param mdl: keras model or another backend (see utils.backends)
+    :param maxlen: int, length of the dummy sequence
+    :return: float, seconds spent
+    """
+    start = time.perf_counter()
+    mdl.predict_on_batch(np.zeros((1, maxlen), dtype='int32'))
+    return time.perf_counter() - start
+
+
+def _load(model_path, tokenizer_path, do_warmup, backend, quantize):
+    start = time.perf_counter()
+    mdl = load_backend(model_path, backend, quantize)
+    tokenizer = load_tokenizer(tokenizer_path, COMPACT_TOKENIZER)
+    load_time = time.perf_counter() - start
+
+    warmup_time = None
+    if do_warmup:
+        start = time.perf_counter()
+        warmup(mdl)
+        # also traces the shorter lengths, if the model can be fed them
+        model_buckets(mdl)
+        warmup_time = time.perf_counter() - start
+
+    return {'model': mdl,
+            'tokenizer': tokenizer,
+            'signature': _files_signature(model_path, tokenizer_path),
+            'loaded_at': time.time(),
+            'load_time': load_time,
+            'warmup_time': warmup_time}
+
+
+def get_model(model_path=MODEL_PATH, tokenizer_path=TOKENIZER_PATH,
+              do_warmup=True, reload_if_changed=True,
+              backend=INFERENCE_BACKEND, quantize=INFERENCE_QUANTIZATION):
+    """
+    Returns pre-trained model and tokenizer, loading them only once per process.
+
+    Accepts:
+    --> model_path - str, path to the Keras SavedModel folder
+    --> tokenizer_path - str, path to the pickled tokenizer
+    --> do_warmup - bool, if True - run a dummy prediction right after loading
+    --> reload_if_changed - bool, if True - load again when the files
+        on disk have changed since the last load
+    --> backend - 'keras', 'tflite' or 'numpy', see utils.backends
+    --> quantize - None, 'float16' or 'int8', weights of 'tflite' and 'numpy' models
+
+    Returns a tuple (model, tokenizer), the model has predict_on_batch
+
+    """
+    key = (model_path, tokenizer_path, backend, quantize)
+    with _LOCK:
+        entry = _REGISTRY.get(key)
+        if entry is not None and reload_if_changed:
+            if entry['signature'] != _files_signature(model_path, tokenizer_path):
+                entry = None
+        if entry is None:
+            entry = _load(model_path, tokenizer_path, do_warmup, backend, quantize)
+            _REGISTRY[key] = entry
+    return entry['model'], entry['tokenizer']
+
+
+def preload_in_background(model_path=MODEL_PATH, tokenizer_path=TOKENIZER_PATH,
+                          backend=INFERENCE_BACKEND, quantize=INFERENCE_QUANTIZATION):
+    """
+    Starts loading and warming up the model in a daemon thread, so the page
+    renders without waiting for it. Later get_model() calls wait for the lock.
+    Reruns while the model is loading get the same thread instead of a new one.
+
+    :return: threading.Thread, or None if the model is already loaded
+    """
+    key = (model_path, tokenizer_path, backend, quantize)
+    if key in _REGISTRY:
+        return None
+    # not _LOCK: it is held for the whole load
+    with _PRELOAD_LOCK:
+        thread = _PRELOADS.get(key)
+        if thread is not None and thread.is_alive():
+            return thread
+        thread = threading.Thread(target=get_model,
+                                  args=(model_path, tokenizer_path),
+                                  kwargs={'backend': backend, 'quantize': quantize},
+                                  daemon=True)
+        _PRELOADS[key] = thread
+        thread.start()
+    return thread
+
+
+def model_info(model_path=MODEL_PATH, tokenizer_path=TOKENIZER_PATH,
+               backend=INFERENCE_BACKEND, quantize=INFERENCE_QUANTIZATION):
+    """
+    Returns load statistics of an already loaded model:
+    {'loaded_at', 'load_time', 'warmup_time'} (seconds), or None if not loaded
+
+    """
+    entry = _REGISTRY.get((model_path, tokenizer_path, backend, quantize))
+    if entry is None:
+        return None
+    return {k: entry[k] for k in ('loaded_at', 'load_time', 'warmup_time')}
+
+
+def clear_registry():
+    """
+    Drops all loaded models, next get_model() call loads them again
+    """
+    with _LOCK:
+        _REGISTRY.clear()
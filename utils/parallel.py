@@ -0,0 +1,73 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from constants import LEMMA_CACHE_PATH
+from utils.instrument import Run, use_run
+
+# Worker pools are expensive to start, so they are kept for the whole process
+_EXECUTORS = {}
+_LOCK = threading.Lock()
+
+
+def _init_worker(lemma_cache_path):
+    # NLTK resources, stopwords and compiled rules are loaded on import,
+    # once per worker process
+    from utils import preprocess
+    if lemma_cache_path:
+        preprocess.LEMMA_CACHE.load(lemma_cache_path)
+    # lemmas looked up here are sent back with every chunk
+    preprocess.LEMMA_CACHE.track_new()
+
+
+def preprocess_chunk(df, keywords=None):
+    """
+    Preprocesses tweets (see utils.preprocess.preprocess_tweets), in a worker process
+    or in the current one.
+
+    Returns tuple (preprocessed dataframe, seconds spent, list of lemmas looked up
+    in a worker process (see utils.lemma_cache.LemmaCache.take_new),
+    utils.instrument.Run with timings of the chunk, to be merged into the caller's run)
+    """
+    from utils.preprocess import LEMMA_CACHE, preprocess_tweets
+
+    # timers fired here are returned, a worker process has no run of its own
+    with use_run(Run('preprocess_chunk')) as run:
+        start = time.perf_counter()
+        df = preprocess_tweets(df, keywords)
+        seconds = time.perf_counter() - start
+    return df, seconds, LEMMA_CACHE.take_new(), run
+
+
+def get_executor(workers, lemma_cache_path=LEMMA_CACHE_PATH):
+    """
+    Returns a process pool with the given number of workers, created once.
+    Workers are started with 'spawn', as forking a process that already
+    runs TensorFlow threads is not safe.
+    """
+    key = (workers, lemma_cache_path)
+    with _LOCK:
+        if key not in _EXECUTORS:
+            _EXECUTORS[key] = ProcessPoolExecutor(max_workers=workers,
+                                                  mp_context=multiprocessing.get_context('spawn'),
+                                                  initializer=_init_worker,
+                                                  initargs=(lemma_cache_path,))
+        return _EXECUTORS[key]
+
+
+def shutdown_executors():
+    with _LOCK:
+        for executor in _EXECUTORS.values():
+            executor.shutdown()
+        _EXECUTORS.clear()
+
+
+
+def split_chunks(df, chunk_size):
+    """
+    Returns list of parts of the dataframe of at most chunk_size rows
+    """
+    if len(df) <= chunk_size:
+        return [df]
+    return [df.iloc[start:start + chunk_size] for start in range(0, len(df), chunk_size)]
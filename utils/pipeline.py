@@ -0,0 +1,485 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import nullcontext
+
+import numpy as np
+import pandas as pd
+
+from constants import *
+from utils.aggregate import NUM_CLASSES, count_labels, counts_to_dict, emotion_counts_frame, \
+    estimated_counts, intervals_frame, label_names, save_emotion_counts
+from utils.dedup import cluster_summary, cluster_texts
+from utils.get_data import collect_tweets, day_windows, load_day
+from utils.heavy_hitters import TERM_COLUMNS, TermSketches
+from utils.instrument import count, current_run, use_run
+from utils.parallel import get_executor, preprocess_chunk, split_chunks
+from utils.preprocess import LEMMA_CACHE
+from utils.predict import predict
+from utils.progress import Progress
+from utils.run_store import RunStore
+from utils.sampling import estimate_counts, strata_of
+from utils.sources import COLUMNS
+from utils.storage import write_day
+from utils.utils import del_folder_content
+
+# Marks the end of a stream
+_DONE = object()
+
+
+class PipelineStats:
+    """
+    Number of tweets and time spent in every stage of the pipeline
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.started = time.perf_counter()
+        # near-duplicate clusters: {cluster size: number of clusters}
+        self.cluster_sizes = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, tweets, seconds):
+        with self._lock:
+            totals = self.stages.setdefault(stage, {'tweets': 0, 'seconds': 0.})
+            totals['tweets'] += tweets
+            totals['seconds'] += seconds
+
+    def add_clusters(self, representatives):
+        """
+        Accepts representative of every tweet, see utils.dedup.cluster_texts
+        """
+        sizes = cluster_summary(representatives)['sizes']
+        with self._lock:
+            for size, num in sizes.items():
+                self.cluster_sizes[size] = self.cluster_sizes.get(size, 0) + num
+
+    def dedup_summary(self):
+        """
+        Returns dict with number of 'tweets', 'classified' tweets, size of
+        the 'largest' cluster and 'saved_fraction' of inference, or None
+        if tweets were not deduplicated
+        """
+        if not self.cluster_sizes:
+            return None
+        tweets = sum(size * num for size, num in self.cluster_sizes.items())
+        classified = sum(self.cluster_sizes.values())
+        return {'tweets': tweets,
+                'classified': classified,
+                'largest': max(self.cluster_sizes),
+                'saved_fraction': 1. - classified / tweets if tweets else 0.}
+
+    def as_dict(self):
+        """
+        Returns {stage: {'tweets', 'seconds', 'tweets_per_second'}}
+        """
+        return {stage: dict(totals, tweets_per_second=totals['tweets'] / totals['seconds']
+                            if totals['seconds'] else 0.)
+                for stage, totals in self.stages.items()}
+
+    def report(self):
+        """
+        Returns str, a table with throughput of every stage
+        """
+        lines = [f'{"stage":<12}{"tweets":>10}{"seconds":>10}{"tweets/s":>12}']
+        for stage, totals in self.as_dict().items():
+            lines.append(f'{stage:<12}{totals["tweets"]:>10}{totals["seconds"]:>10.2f}'
+                         f'{totals["tweets_per_second"]:>12,.1f}')
+        dedup = self.dedup_summary()
+        if dedup:
+            lines.append(f'near duplicates: {dedup["classified"]} of {dedup["tweets"]} tweets classified, '
+                         f'{dedup["saved_fraction"]:.1%} of inference saved, '
+                         f'largest cluster {dedup["largest"]}')
+        lines.append(f'total wall time: {time.perf_counter() - self.started:.2f}s')
+        return '\n'.join(lines)
+
+
+class _StageError:
+    def __init__(self, error):
+        self.error = error
+
+
+def _put(q, item, stop):
+    # put that gives up when the consumer has gone away
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return _DONE
+
+
+def _run_stage(func, q_in, q_out, stop, run):
+    """
+    Applies func to every item from q_in and puts results to q_out,
+    forwards the end of the stream and errors; timings go to the run
+    of the thread that started the pipeline
+    """
+    try:
+        with use_run(run):
+            while True:
+                item = _get(q_in, stop)
+                if item is _DONE or isinstance(item, _StageError):
+                    _put(q_out, item, stop)
+                    return
+                if not _put(q_out, func(item), stop):
+                    return
+    except Exception as e:
+        _put(q_out, _StageError(e), stop)
+
+
+def stream_days(days, load_day, mdl, tokenizer, keywords=None,
+                workers=PREPROCESS_WORKERS, min_rows_for_pool=PREPROCESS_CHUNK_SIZE,
+                chunk_size=PREPROCESS_CHUNK_SIZE, queue_size=2, stats=None,
+                dedup_threshold=DEDUP_THRESHOLD, **predict_kwargs):
+    """
+    Streams every day through loading, cleaning and preprocessing, and prediction.
+
+    The first stage loads a day from disk or collects it (see search_days),
+    so a day is cleaned and classified as soon as it is collected. Stages run
+    in their own threads, connected by bounded queues, so a day is predicted
+    while the next ones are loaded and preprocessed, and only a few days are
+    held in memory at once.
+
+    Accepts:
+    --> days - list of str dates
+    --> load_day - function str date -> pd.DataFrame(columns=['date', 'content']),
+        e.g. dfs.get, partial(utils.get_data.load_day, data_path) or a collector of a day
+    --> mdl, tokenizer - pre-trained model and tokenizer
+    --> keywords - list of keywords to delete from tweets
+    --> workers - int, preprocessing worker processes, 1 - preprocess in a thread
+    --> min_rows_for_pool - int, smaller days are preprocessed in a thread
+    --> chunk_size - int, larger days are split into chunks preprocessed by several workers
+    --> queue_size - int, maximum number of days waiting between two stages
+    --> stats - PipelineStats, receives time spent in every stage
+    --> dedup_threshold - float, near-identical cleaned tweets (see utils.dedup)
+        are classified once and share the label, None - classify every tweet
+    Other keyword arguments are passed to utils.predict.predict
+
+    Yields tuples (day, raw dataframe with 'predicted_labels',
+    preprocessed dataframe, list of int labels) in the order of days
+
+    """
+    stop = threading.Event()
+    q_days = queue.Queue()
+    q_raw, q_preprocessed, q_results = (queue.Queue(maxsize=queue_size) for _ in range(3))
+
+    executor = get_executor(workers) if workers != 1 else None
+    stats = stats or PipelineStats()
+    # run of the caller, stage threads and worker processes report to it
+    run = current_run()
+
+    def load(day):
+        start = time.perf_counter()
+        df = load_day(day)
+        stats.add('load', len(df), time.perf_counter() - start)
+        return day, df
+
+    def preprocess(item):
+        day, df = item
+        if executor is None or len(df) < min_rows_for_pool:
+            future = Future()
+            future.set_result(preprocess_chunk(df, keywords))
+            futures = [future]
+        else:
+            # futures are passed on, so chunks of a day and several days are preprocessed at once
+            futures = [executor.submit(preprocess_chunk, chunk, keywords)
+                       for chunk in split_chunks(df, chunk_size)]
+        return day, df, futures
+
+    def classify(item):
+        day, df, futures = item
+        parts, seconds = [], 0.
+        for future in futures:
+            part, part_seconds, lemmas, chunk_run = future.result()
+            parts.append(part)
+            seconds += part_seconds
+            # lemmas looked up by workers are not looked up again
+            LEMMA_CACHE.add_items(lemmas)
+            # timers fired while preprocessing, also in worker processes
+            run.merge(chunk_run)
+        df_preprocessed = pd.concat(parts) if len(parts) > 1 else parts[0]
+        # time spent by all workers on the day
+        stats.add('preprocess', len(df), seconds)
+
+        texts = df_preprocessed['content_preprocessed_with_stopwords']
+        if dedup_threshold:
+            # one tweet per cluster of near duplicates is classified
+            start = time.perf_counter()
+            representatives = cluster_texts(df_preprocessed['content_cleaned'], dedup_threshold)
+            classified, cluster_of = np.unique(representatives, return_inverse=True)
+            stats.add('dedup', len(df), time.perf_counter() - start)
+            stats.add_clusters(representatives)
+            count('dedup.tweets', len(df))
+            count('dedup.classified', len(classified))
+            texts = texts.iloc[classified]
+
+        start = time.perf_counter()
+        labels = predict(texts, mdl, tokenizer, **predict_kwargs)
+        if dedup_threshold:
+            labels = np.asarray(labels, dtype='int64')[cluster_of.ravel()].tolist() if len(labels) else []
+        stats.add('predict', len(df), time.perf_counter() - start)
+        df = df.copy()
+        df['predicted_labels'] = label_names(labels)
+        return day, df, df_preprocessed, labels
+
+    for day in days:
+        q_days.put(day)
+    q_days.put(_DONE)
+
+    threads = [threading.Thread(target=_run_stage, args=args, daemon=True)
+               for args in ((load, q_days, q_raw, stop, run),
+                            (preprocess, q_raw, q_preprocessed, stop, run),
+                            (classify, q_preprocessed, q_results, stop, run))]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            item = _get(q_results, stop)
+            if item is _DONE:
+                return
+            if isinstance(item, _StageError):
+                raise item.error
+            yield item
+    finally:
+        # also stops the stages if the consumer stops early
+        stop.set()
+
+
+def collect_days(query, begin_date, end_date, source=None, progress=None, stats=None,
+                 data_path=DATA_PATH, preprocessed_path=PREPROCESSED_DATA_PATH,
+                 counts_path=EMOTION_COUNTS_PATH):
+    """
+    Collects tweets for a search and puts them to the data folders the app reads.
+    Days collected and analyzed for the same query before are reused.
+
+    Accepts:
+    --> query - dict with 'keywords', 'only_hashtags', 'num_tweets_per_day', 'min_favs',
+        optionally 'sample_size', 'stratify_by_hour' and 'scan_limit' (see utils.get_data.collect_tweets)
+    --> begin_date, end_date - datetime.date objects, end_date NOT INCLUDED
+    --> source - utils.sources.TweetSource, default - live search
+    --> progress - utils.progress.Progress
+    --> stats - PipelineStats, receives time spent on collection
+
+    Returns a tuple (RunStore, list of str dates)
+
+    """
+    run_store = RunStore(query)
+    days = [since for since, _ in day_windows(begin_date, end_date)]
+    # a search or analysis of the same query in another job finishes first,
+    # so files of its days are not replaced while they are written
+    with run_store.lock:
+        run_store.reload()
+        days_to_collect = run_store.missing_days(days)
+
+        if days_to_collect:
+            start = time.perf_counter()
+            # {'YYYY-MM-DD': pd.Dataframe(columns=['date', 'content'])}
+            dfs = collect_tweets(begin_date=begin_date,
+                                 end_date=end_date,
+                                 days=days_to_collect,
+                                 source=source,
+                                 progress=progress,
+                                 **query)
+            for name, df in dfs.items():
+                run_store.save_raw(name, df, df.attrs.get('population'))
+            if stats is not None:
+                stats.add('collect', sum(len(df) for df in dfs.values()), time.perf_counter() - start)
+
+        # Remove previous results (files) af any
+        del_folder_content(data_path)
+        del_folder_content(preprocessed_path)
+        del_folder_content(counts_path)
+
+        # Save raw data of the search, named in format 'YYYY-MM-DD.parquet'
+        for day in days:
+            run_store.export_day(day, data_path, preprocessed_path)
+        run_store.mark_current(data_path)
+
+        # All days were analyzed before - emotion counts are ready
+        if not run_store.unanalyzed_days(days):
+            save_emotion_counts(run_store.emotion_counts(days), counts_path, run_store.emotion_intervals(days),
+                                run_store.term_sketches(days).top_terms())
+
+    return run_store, days
+
+
+def analyze_days(days, mdl, tokenizer, cache=None, progress=None, stats=None,
+                 data_path=DATA_PATH, preprocessed_path=PREPROCESSED_DATA_PATH,
+                 counts_path=EMOTION_COUNTS_PATH, workers=PREPROCESS_WORKERS,
+                 dedup_threshold=DEDUP_THRESHOLD, confidence_z=CONFIDENCE_Z, collect_day=None):
+    """
+    Classifies emotions of collected days and saves the results: raw data with
+    predicted labels, preprocessed data and emotion counts
+    (see utils.aggregate.save_emotion_counts).
+    Days analyzed before for the same search are not analyzed again.
+    Counts of sampled days (see utils.get_data.collect_tweets) are estimated
+    for the whole day, with confidence intervals. Most popular words and hashtags
+    of every day and of all days are counted in fixed memory (utils.heavy_hitters).
+
+    Accepts:
+    --> days - list of str dates in data_path
+    --> mdl, tokenizer - pre-trained model and tokenizer
+    --> cache - utils.prediction_cache.PredictionCache
+    --> progress - utils.progress.Progress
+    --> stats - PipelineStats, receives time spent in every stage
+    --> workers - int, preprocessing worker processes
+    --> dedup_threshold - float, similarity of near duplicates classified once,
+        None - classify every tweet
+    --> confidence_z - float, z-score of confidence intervals of sampled days
+    --> collect_day - function str date -> pd.DataFrame(columns=['date', 'content']),
+        collects a day (see search_days); days missing or stale in the search's
+        RunStore are then collected by the first stage of the stream, one at a time,
+        instead of read from data_path
+
+    Yields tuples (day, dict {label: number of tweets}, str most popular words)
+    as days are done; emotion counts are saved after the last one.
+    The lock of the search's RunStore is held until the generator is exhausted
+
+    """
+    progress = progress or Progress()
+    stats = stats or PipelineStats()
+    del_folder_content(counts_path)
+
+    # Only days not analyzed in previous searches
+    run_store = RunStore.current(data_path)
+    # a search of the same query in another job waits until the days are saved
+    with run_store.lock if run_store else nullcontext():
+        if run_store:
+            run_store.reload()
+        days = sorted(days)
+        days_to_analyze = run_store.unanalyzed_days(days) if run_store else days
+        days_to_collect = set(run_store.missing_days(days)) if run_store and collect_day else set()
+        days_to_analyze = sorted(set(days_to_analyze) | days_to_collect)
+
+        def load(day):
+            if day not in days_to_collect:
+                return load_day(data_path, day, COLUMNS)
+            # collected while the previous days are preprocessed and classified
+            start = time.perf_counter()
+            df = collect_day(day)
+            stats.add('collect', len(df), time.perf_counter() - start)
+            run_store.save_raw(day, df, df.attrs.get('population'))
+            write_day(df, data_path, day)
+            return df
+
+        # Counts and most popular words of every day, estimates of sampled days
+        day_counts = {}
+        day_words = {}
+        day_estimates = {}
+        term_sketches = TermSketches()
+        for day in days:
+            if day not in days_to_analyze:
+                day_counts[day], day_words[day] = run_store.analysis(day)
+                day_estimates[day] = run_store.estimates(day)
+                sketches = run_store.sketches(day)
+                if sketches:
+                    term_sketches.add_sketches(day, sketches)
+                yield day, day_counts[day], day_words[day]
+
+        progress.start('analyze', len(days_to_analyze), 'Analyzing...')
+        for day, df_raw, df_cleaned, emotions in stream_days(days_to_analyze,
+                                                              load,
+                                                              mdl, tokenizer,
+                                                              workers=workers,
+                                                              stats=stats,
+                                                              dedup_threshold=dedup_threshold,
+                                                              cache=cache):
+            start = time.perf_counter()
+            # Replace original datafile by datafile with predictions,
+            # save preprocessed data (token lists as list columns), both to Parquet
+            write_day(df_raw, data_path, day)
+            write_day(df_cleaned, preprocessed_path, day)
+
+            # Count number of each emotion type for the current date
+            day_counts[day] = counts_to_dict(count_labels([emotions])[0])
+            population = run_store.population(day) if run_store else None
+            day_estimates[day] = None
+            if population:
+                day_estimates[day] = estimate_counts(emotions, strata_of(df_raw['date'], population),
+                                                     population, NUM_CLASSES, confidence_z)
+
+            # Most popular words and hashtags of the current day, merged into all days
+            sketches = term_sketches.add_day(day, df_cleaned, TERM_COLUMNS)
+            day_words[day] = ', '.join(sketches['words'].top_k(10)['word'])
+
+            if run_store:
+                run_store.save_analysis(day, df_raw, df_cleaned, day_counts[day], day_words[day],
+                                        day_estimates[day], sketches)
+            if day_estimates[day]:
+                # counts of the sample are scaled to the whole day
+                day_counts[day] = counts_to_dict(estimated_counts(day_estimates[day]))
+            stats.add('aggregate', len(df_raw), time.perf_counter() - start)
+
+            progress.update('analyze', len(day_counts) - len(days) + len(days_to_analyze),
+                            len(days_to_analyze), f'Analyzed {len(day_counts)} of {len(days)} days...')
+            yield day, day_counts[day], day_words[day]
+        progress.finish('analyze')
+
+        LEMMA_CACHE.save(LEMMA_CACHE_PATH)
+
+        # Save counts ('Date', 'no emotion', 'anger', ...), their proportions and deltas
+        emotion_counts = emotion_counts_frame(days,
+                                              [day_counts[d] for d in days],
+                                              [day_words[d] for d in days])
+        save_emotion_counts(emotion_counts, counts_path, intervals_frame({d: day_estimates[d] for d in days}),
+                            term_sketches.top_terms())
+
+
+def search_days(query, begin_date, end_date, mdl, tokenizer, source=None, progress=None, stats=None,
+                data_path=DATA_PATH, preprocessed_path=PREPROCESSED_DATA_PATH,
+                counts_path=EMOTION_COUNTS_PATH, **analyze_kwargs):
+    """
+    Collects and analyzes a search in one stream: every day goes to cleaning
+    and prediction as soon as it is collected, instead of after all days
+    (collect_days, then analyze_days). Days collected and analyzed for the same
+    query before are reused, the files are the same as of the two steps.
+
+    Accepts:
+    --> query, begin_date, end_date, source - see collect_days
+    --> mdl, tokenizer - pre-trained model and tokenizer
+    --> progress - utils.progress.Progress, receives progress of analysis
+    --> stats - PipelineStats, receives time spent in every stage, collection included
+    Other keyword arguments are passed to analyze_days
+
+    Yields tuples as analyze_days
+
+    """
+    run_store = RunStore(query)
+    days = [since for since, _ in day_windows(begin_date, end_date)]
+    with run_store.lock:
+        run_store.reload()
+        missing = set(run_store.missing_days(days))
+        # Files of days to collect are replaced once they are collected,
+        # e.g. when tweets are replayed from data_path itself
+        for name in os.listdir(data_path):
+            if name.rsplit('.', 1)[0] not in missing:
+                os.remove(os.path.join(data_path, name))
+        del_folder_content(preprocessed_path)
+        # Days of previous searches are exported now, the others once they are collected
+        for day in days:
+            if day not in missing:
+                run_store.export_day(day, data_path, preprocessed_path)
+        run_store.mark_current(data_path)
+
+    def collect_day(day):
+        # a single day, with retries and rate limiting of collect_tweets
+        return collect_tweets(begin_date=begin_date, end_date=end_date, days=[day],
+                              source=source, **query)[day]
+
+    yield from analyze_days(days, mdl, tokenizer, progress=progress, stats=stats,
+                            data_path=data_path, preprocessed_path=preprocessed_path,
+                            counts_path=counts_path, collect_day=collect_day, **analyze_kwargs)
@@ -1,20 +1,193 @@
-from keras_preprocessing.sequence import pad_sequences
+import threading
+import weakref
+
 import numpy as np
 
+from constants import MAXLEN
+from utils.backends import NumpyModel
+from utils.instrument import count, timed, timer
+from utils.prediction_cache import text_key
+from utils.tokenizer import encode, pad_encoded
+
+# Every sequence is padded to MAXLEN, as the model was trained
+BUCKETS = (MAXLEN,)
+# Sequences are padded to the smallest bucket they fit in, only for models
+# that mask the padding and accept any length, see model_buckets
+LENGTH_BUCKETS = (16, 32, 64, 128, MAXLEN)
+
+# Buckets of models already checked: {model: tuple of lengths}
+_MODEL_BUCKETS = weakref.WeakKeyDictionary()
+_LOCK = threading.Lock()
+
+
+def _bucket_batches(lengths, buckets, batch_size, max_batch_tokens):
+    """
+    Accepts lengths of sequences and bucket bounds
+    Yields tuples (bucket length, indices of sequences in the batch)
+
+    """
+    lengths = np.minimum(np.asarray(lengths), buckets[-1])
+    bucket_ids = np.searchsorted(buckets, lengths)
+
+    for bucket_id, bucket_len in enumerate(buckets):
+        indices = np.flatnonzero(bucket_ids == bucket_id)
+        if not len(indices):
+            continue
+        size = batch_size
+        if max_batch_tokens:
+            size = max(1, min(size, max_batch_tokens // bucket_len))
+        for start in range(0, len(indices), size):
+            yield bucket_len, indices[start:start + size]
+
+
+def masks_padding(mdl):
+    """
+    Returns True if the model ignores padding (index 0 is masked) and accepts
+    sequences of any length, so shorter padding does not change predictions.
+    Models which can not tell (e.g. TFLite) are assumed not to.
+    """
+    if isinstance(mdl, NumpyModel):
+        return any(layer['type'] == 'embedding' and layer['mask_zero'] for layer in mdl.layers)
+    layers = getattr(mdl, 'layers', None)
+    try:
+        shape = mdl.input_shape
+    except (AttributeError, RuntimeError):
+        return False
+    if layers is None or len(shape) != 2 or shape[1] is not None:
+        return False
+    return any(getattr(layer, 'mask_zero', False) or type(layer).__name__ == 'Masking'
+               for layer in layers)
+
 
-def predict(texts, mdl, tokenizer):
+def bucket_parity_error(mdl, buckets, texts_per_bucket=8, seed=0):
+    """
+    Returns float, maximum difference of probabilities of random sequences
+    padded to their bucket and padded to the last (full) length
+    """
+    rng = np.random.default_rng(seed)
+    bounds = (0,) + tuple(buckets)
+    lengths = np.concatenate([rng.integers(low + 1, high + 1, texts_per_bucket)
+                              for low, high in zip(bounds[:-1], bounds[1:])])
+    # small indices, every embedding has them
+    ids = rng.integers(1, 50, int(lengths.sum()))
+
+    full = np.asarray(mdl.predict_on_batch(pad_encoded(ids, lengths, maxlen=buckets[-1])))
+    error = 0.
+    for bucket_len, indices in _bucket_batches(lengths, buckets, len(lengths), None):
+        batch = np.asarray(mdl.predict_on_batch(pad_encoded(ids, lengths, maxlen=bucket_len, rows=indices)))
+        error = max(error, float(np.abs(batch - full[indices]).max()))
+    return error
+
+
+def model_buckets(mdl, buckets=LENGTH_BUCKETS, atol=1e-4):
+    """
+    Returns buckets the model's sequences are padded to, checked once per model:
+    buckets if the model masks the padding, accepts their lengths and predicts
+    the same as with full padding (see bucket_parity_error), else BUCKETS
+    """
+    with _LOCK:
+        if mdl in _MODEL_BUCKETS:
+            return _MODEL_BUCKETS[mdl]
+
+    result = BUCKETS
+    if masks_padding(mdl):
+        try:
+            if bucket_parity_error(mdl, buckets) <= atol:
+                result = tuple(buckets)
+        except Exception:
+            # e.g. a model traced for a fixed length rejects shorter sequences
+            pass
+    count('predict.bucketing', int(result != BUCKETS))
+
+    with _LOCK:
+        _MODEL_BUCKETS[mdl] = result
+    return result
+
+
+def predict_proba(texts, mdl, tokenizer, batch_size=256, max_batch_tokens=None,
+                  buckets=None):
+    """
+    Accepts array of texts (strings or lists of tokens), pre-trained deep learning model
+    and tokenizer (utils.tokenizer.CompactTokenizer or Keras tokenizer)
+    Returns np.array of shape (len(texts), number of classes) with probabilities,
+    in the same order as texts
+
+    Sequences are sorted into length buckets and every batch is padded only
+    to the length of its bucket, if the model allows it (see model_buckets).
+
+    :param batch_size: int, maximum number of sequences per batch
+    :param max_batch_tokens: int, maximum of batch_size * padded length, caps memory
+    :param buckets: sorted tuple of lengths, the last one is the maximum length;
+        with buckets=(MAXLEN,) every sequence is padded to MAXLEN;
+        None - checked for the model by model_buckets
+    """
+    buckets = buckets or model_buckets(mdl)
+    with timer('predict.texts_to_sequences'):
+        ids, lengths = encode(tokenizer, texts)
+
+    probabilities = None
+    for bucket_len, indices in _bucket_batches(lengths, buckets, batch_size, max_batch_tokens):
+        pad = pad_encoded(ids, lengths, maxlen=bucket_len, rows=indices)
+        with timer('predict.model'):
+            batch = np.asarray(mdl.predict_on_batch(pad))
+        if probabilities is None:
+            probabilities = np.zeros((len(lengths), batch.shape[1]), dtype=batch.dtype)
+        # put predictions back in the original order
+        probabilities[indices] = batch
+
+    if probabilities is None:
+        return np.zeros((0, 0), dtype='float32')
+    return probabilities
+
+
+def cached_predict_proba(texts, mdl, tokenizer, cache, **kwargs):
+    """
+    Same as predict_proba, but the model is run only on texts
+    not found in the cache (utils.prediction_cache.PredictionCache),
+    every distinct text is classified once
+    """
+    texts = list(texts)
+    keys = [text_key(t) for t in texts]
+    with timer('predict.cache_lookup'):
+        found = cache.get_many(keys)
+    hits = sum(key in found for key in keys)
+    count('prediction_cache.hits', hits)
+    count('prediction_cache.misses', len(keys) - hits)
+
+    # one text per missing key
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in found and key not in missing:
+            missing[key] = text
+
+    if missing:
+        probabilities = predict_proba(list(missing.values()), mdl, tokenizer, **kwargs)
+        new = dict(zip(missing.keys(), probabilities))
+        cache.put_many(new)
+        found.update(new)
+
+    if not texts:
+        return np.zeros((0, 0), dtype='float32')
+    return np.vstack([found[key] for key in keys])
+
+
+@timed('predict')
+def predict(texts, mdl, tokenizer, return_proba=False, cache=None, **kwargs):
     """
     Accepts array of texts (strings) and pre-trained deep learning model
     Returns array of predicted labels
+    (and np.array of probabilities if return_proba is True)
 
-    """
-    # text = []
-    sequences = tokenizer.texts_to_sequences(texts)
-    pad = pad_sequences(sequences, maxlen=231) # hard-coded :)
-    predictions = mdl.predict(pad)
-    labels = np.argmax(predictions, axis=1)
-    lbls_arr = []
-    for lbl in labels:
-        lbls_arr.append(lbl)
-    return lbls_arr
+    If cache is given, predictions are looked up in it first
 
+    Other keyword arguments are passed to predict_proba
+
+    """
+    if cache is not None:
+        probabilities = cached_predict_proba(texts, mdl, tokenizer, cache, **kwargs)
+    else:
+        probabilities = predict_proba(texts, mdl, tokenizer, **kwargs)
+    labels = np.argmax(probabilities, axis=1).tolist() if len(probabilities) else []
+    if return_proba:
+        return labels, probabilities
+    return labels
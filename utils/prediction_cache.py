@@ -0,0 +1,146 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+# Open caches, one per file and model: {(path, fingerprint): PredictionCache}
+_CACHES = {}
+_LOCK = threading.Lock()
+
+
+def normalize_text(text):
+    """
+    Accepts text (a string or a list of tokens)
+    Returns the string used as the cache key
+    """
+    if isinstance(text, str):
+        return ' '.join(text.lower().split())
+    return ' '.join(token.lower() for token in text)
+
+
+def text_key(text):
+    return hashlib.sha1(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+class PredictionCache:
+    """
+    Persistent cache of predicted probabilities, stored in SQLite.
+
+    Keys are hashes of normalized texts, so repeated retweets and copied
+    texts are classified once. Entries are keyed by text and model fingerprint,
+    so models sharing the file (e.g. the app and a quantized run_pipeline.py)
+    keep their own predictions. When there are more than
+    max_entries * (1 + evict_margin), least recently used are evicted down to
+    max_entries, so eviction runs once in a while rather than on every put;
+    entries of models no longer used age out this way.
+    """
+
+    def __init__(self, path, fingerprint, max_entries=1_000_000, evict_margin=0.1):
+        """
+        :param path: str, path to the SQLite file
+        :param fingerprint: str, identifies the model and tokenizer
+        :param max_entries: int, maximum number of cached texts after eviction
+        :param evict_margin: float, fraction of max_entries added before eviction
+        """
+        self.path = path
+        self.fingerprint = fingerprint
+        self.max_entries = max_entries
+        self.high_water = int(max_entries * (1. + evict_margin))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            primary_key = [row[1] for row in self._conn.execute('PRAGMA table_info(predictions)') if row[5]]
+            if primary_key == ['key']:
+                # created when entries were keyed by text only, it is only a cache
+                self._conn.execute('DROP TABLE predictions')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS predictions ('
+                               'key TEXT, fingerprint TEXT, proba BLOB, last_used REAL, '
+                               'PRIMARY KEY (key, fingerprint))')
+            # least recently used are found without sorting the table
+            self._conn.execute('CREATE INDEX IF NOT EXISTS predictions_last_used ON predictions (last_used)')
+        # number of entries, counted once; puts add to it, replaced keys make it an upper bound
+        self._size = self._count()
+
+    def get_many(self, keys):
+        """
+        Accepts list of keys
+        Returns dict {key: np.array of probabilities} for keys found
+        """
+        found = {}
+        unique_keys = list(set(keys))
+        now = time.time()
+        with self._lock, self._conn:
+            # in portions, SQLite limits the number of parameters
+            for start in range(0, len(unique_keys), 500):
+                portion = unique_keys[start:start + 500]
+                marks = ','.join('?' * len(portion))
+                rows = self._conn.execute(f'SELECT key, proba FROM predictions '
+                                          f'WHERE fingerprint = ? AND key IN ({marks})',
+                                          [self.fingerprint] + portion).fetchall()
+                for key, proba in rows:
+                    found[key] = np.frombuffer(proba, dtype='float32')
+                self._conn.execute(f'UPDATE predictions SET last_used = ? '
+                                   f'WHERE fingerprint = ? AND key IN ({marks})',
+                                   [now, self.fingerprint] + portion)
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items):
+        """
+        Accepts dict {key: np.array of probabilities}
+        """
+        now = time.time()
+        rows = [(key, self.fingerprint, np.asarray(proba, dtype='float32').tobytes(), now)
+                for key, proba in items.items()]
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO predictions (key, fingerprint, proba, last_used) '
+                                   'VALUES (?, ?, ?, ?)', rows)
+            self._size += len(rows)
+            if self._size > self.high_water:
+                self._evict()
+
+    def _count(self):
+        return self._conn.execute('SELECT COUNT(*) FROM predictions').fetchone()[0]
+
+    def _evict(self):
+        # the estimate may count replaced keys, the exact size is checked first
+        self._size = self._count()
+        if self._size > self.max_entries:
+            deleted = self._conn.execute('DELETE FROM predictions WHERE key IN ('
+                                         'SELECT key FROM predictions ORDER BY last_used LIMIT ?)',
+                                         (self._size - self.max_entries,)).rowcount
+            self._size -= deleted
+
+    def stats(self):
+        """
+        Returns dict with 'size', 'hits' and 'misses'
+        """
+        with self._lock:
+            size = self._count()
+        return {'size': size, 'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def get_prediction_cache(path, fingerprint, max_entries=1_000_000):
+    """
+    Returns PredictionCache for the file and model, opened once per process
+    """
+    key = (path, fingerprint)
+    with _LOCK:
+        if key not in _CACHES:
+            _CACHES[key] = PredictionCache(path, fingerprint, max_entries)
+        return _CACHES[key]
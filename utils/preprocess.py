@@ -1,13 +1,14 @@
 import emoji
 import re
-import nltk
+import pandas as pd
 from nltk.corpus import stopwords
 from collections import Counter
+from functools import lru_cache
 
-nltk.download('omw-1.4')
-nltk.download('punkt')
-nltk.download('stopwords')
-nltk.download('wordnet')
+from utils.resources import check_nltk_resources
+
+# NLTK data is only looked up locally, see provision.py
+check_nltk_resources()
 
 from nltk.tokenize import word_tokenize
 from nltk.stem import WordNetLemmatizer
@@ -15,66 +16,121 @@ from nltk.stem import PorterStemmer
 
 from nltk.corpus import wordnet
 
+from utils.instrument import count, timed, timer
+from utils.lemma_cache import LemmaCache
+
 STOPWORDS = set(stopwords.words('english'))
+STEMMER = PorterStemmer()
+LEMMATIZER = WordNetLemmatizer()
+# token -> (part of speech, lemma), shared by the whole process
+LEMMA_CACHE = LemmaCache()
 
-def clean_tweets(df, keywords=None):
+# ---  Cleaning rules, compiled once  -------------------------------------------
+HASHTAG_PATTERN = re.compile(r'#(\w+)')
+URL_PATTERN = re.compile(r'https?://\S+|www\.\S+')
+MENTION_PATTERN = re.compile(r'\S*@\S*\s?')
+# new lines and redundant whitespaces, underscores, other symbols, numbers:
+# everything is replaced by a single whitespace in one pass
+SYMBOLS_PATTERN = re.compile(r'\s+|_|[^\w\s]|\d+')
+
+
+class TweetCleaner:
     """
-    Accepts dataframe with 'content' column and list of keywords
-    Adds columns 'content_cleaned', 'hashtags'
-    Returns old dataset with new columns
+    Cleans tweets with rules compiled once.
 
+    Substitutions are done in the same order as they were originally
+    written, merged where this does not change the output, plain strings
+    are replaced with str.replace instead of regular expressions.
     """
-    df = df.copy()
-    cleaned = []
-    hashtags = []
 
-    for tweet in df['content']:
+    def __init__(self, keywords=None):
+        """
+        :param keywords: list of strings to delete from tweets (in any case)
+        """
+        keywords = [k for k in (keywords or []) if k]
+        if keywords:
+            # longest first, so that a keyword is not cut by its own prefix
+            keywords = sorted(set(keywords), key=len, reverse=True)
+            self.keywords_pattern = re.compile('|'.join(re.escape(k) for k in keywords),
+                                               re.IGNORECASE)
+        else:
+            self.keywords_pattern = None
+
+    def clean(self, tweet):
+        """
+        Accepts tweet (a single string)
+        Returns a tuple (cleaned tweet, list of hashtags)
+
+        """
         # replace emojis with words (meanings)
-        tweet = emoji.demojize(tweet)
+        if not tweet.isascii():
+            with timer('clean.demojize'):
+                tweet = emoji.demojize(tweet)
 
-        if keywords:
+        if self.keywords_pattern is not None:
             # delete keywords if given
-            for keyword in keywords:
-                tweet = re.sub(keyword.lower(), '', tweet)
-                tweet = re.sub(keyword.upper(), '', tweet)
-                tweet = re.sub(keyword.title(), '', tweet)
+            tweet = self.keywords_pattern.sub('', tweet)
 
         # find all hashtags
-        hashtag = re.findall(r'#(\w+)', tweet)
+        hashtags = HASHTAG_PATTERN.findall(tweet)
 
-        tweet = re.sub('n[\'’]t', ' not', tweet)
+        tweet = tweet.replace("n't", ' not').replace('n’t', ' not')
 
         # remove urls
-        url_pattern = re.compile(r'https?://\S+|www\.\S+')
-        tweet = url_pattern.sub(r'', tweet)
+        tweet = URL_PATTERN.sub('', tweet)
 
         # remove mentions
-        tweet = re.sub('\S*@\S*\s?', '', tweet)
+        tweet = MENTION_PATTERN.sub('', tweet)
 
         # remove non-english symbols
-        tweet = re.sub('[^\x00-\x7f]', '', tweet)
-
-        # remove new line characters
-        tweet = re.sub('\s+', ' ', tweet)
+        if not tweet.isascii():
+            tweet = tweet.encode('ascii', 'ignore').decode('ascii')
 
-        tweet = re.sub('_', ' ', tweet)
+        # remove new line characters, underscores, other symbols and numbers
+        tweet = SYMBOLS_PATTERN.sub(' ', tweet)
 
-        # remove other symbols
-        tweet = re.sub(r'[^\w\s]', ' ', tweet)
+        tweet = tweet.replace('amp', '')
 
-        # remove numbers
-        tweet = re.sub('\d+', ' ', tweet)
+        # remove redundant whitespaces
+        return tweet.strip(), hashtags
+
+    def clean_series(self, tweets):
+        """
+        Accepts pd.Series (or any iterable) of tweets
+        Returns a tuple of lists (cleaned tweets, hashtags)
+
+        """
+        cleaned = []
+        hashtags = []
+        clean = self.clean
+        for tweet in tweets:
+            text, tags = clean(tweet)
+            cleaned.append(text)
+            hashtags.append(tags)
+        return cleaned, hashtags
+
+
+@lru_cache(maxsize=32)
+def get_cleaner(keywords=()):
+    """
+    Returns a TweetCleaner for a tuple of keywords, compiled only once
+    """
+    return TweetCleaner(list(keywords))
 
-        tweet = re.sub('amp', '', tweet)
 
-        # remove redundant whitespaces
-        tweet = tweet.strip()
+@timed('clean_tweets')
+def clean_tweets(df, keywords=None):
+    """
+    Accepts dataframe with 'content' column and list of keywords
+    Adds columns 'content_cleaned', 'hashtags'
+    Returns old dataset with new columns
 
-        cleaned.append(tweet)
-        hashtags.append(hashtag)
+    """
+    df = df.copy()
+    cleaner = get_cleaner(tuple(keywords) if keywords else ())
 
-    df['content_cleaned'] = cleaned
-    df['hashtags'] = hashtags
+    df['content_cleaned'], df['hashtags'] = cleaner.clean_series(df['content'])
+    count('tweets.cleaned', len(df))
 
     return df
 
@@ -90,13 +146,13 @@ def get_part_of_speech(word):
     # get a set of synonyms for the word
     probable_part_of_speech = wordnet.synsets(word)
 
-    pos_counts = Counter()
-
     # set each value to the number of synonyms that fall into each part of speech
-    pos_counts["n"] = len([item for item in probable_part_of_speech if item.pos()=="n"])
-    pos_counts["v"] = len([item for item in probable_part_of_speech if item.pos()=="v"])
-    pos_counts["a"] = len([item for item in probable_part_of_speech if item.pos()=="a"])
-    pos_counts["r"] = len([item for item in probable_part_of_speech if item.pos()=="r"])
+    # (ties are resolved in this order)
+    pos_counts = Counter({'n': 0, 'v': 0, 'a': 0, 'r': 0})
+    for item in probable_part_of_speech:
+        pos = item.pos()
+        if pos in pos_counts:
+            pos_counts[pos] += 1
 
     # return the most common part of speech
     most_likely_part_of_speech = pos_counts.most_common(1)[0][0]
@@ -104,14 +160,22 @@ def get_part_of_speech(word):
     return most_likely_part_of_speech
 
 
-def text_preprocess(text,
-                    stop_words=False, stem=False, lemmatize=False, keywords=False):
-    '''
-    Accepts text (a single string), parameters of preprocessing (bool) and
-    a list of keywords (strings) to delete
-    Returns preprocessed text
+def _pos_and_lemma(token):
+    with timer('preprocess.wordnet'):
+        pos = get_part_of_speech(token)
+        return pos, LEMMATIZER.lemmatize(token, pos)
 
-    '''
+
+def lemmatize_token(token):
+    """
+    Accepts token
+    Returns lemma of the token, WordNet is queried only on a cache miss
+
+    """
+    return LEMMA_CACHE.get(token, _pos_and_lemma)[1]
+
+
+def _tokenize(text, keywords=False):
     # clean text from non-words
     text = text.lower()
 
@@ -124,18 +188,93 @@ def text_preprocess(text,
         tokens = [token for token in tokens if token.upper() not in keywords]
         tokens = [token for token in tokens if token.title() not in keywords]
 
+    return tokens
+
+
+@timed('text_preprocess')
+def text_preprocess(text,
+                    stop_words=False, stem=False, lemmatize=False, keywords=False):
+    '''
+    Accepts text (a single string), parameters of preprocessing (bool) and
+    a list of keywords (strings) to delete
+    Returns preprocessed text
+
+    '''
+    tokens = _tokenize(text, keywords)
+
     if stop_words:
         # delete stop_words
         tokens = [token for token in tokens if token not in STOPWORDS]
 
     if stem:
         # apply stemming
-        stemmer = PorterStemmer()
-        tokens = [stemmer.stem(token) for token in tokens]
+        tokens = [STEMMER.stem(token) for token in tokens]
 
     if lemmatize:
         # lemmatize tokens
-        lemmatizer = WordNetLemmatizer()
-        tokens = [lemmatizer.lemmatize(token, get_part_of_speech(token)) for token in tokens]
+        tokens = [lemmatize_token(token) for token in tokens]
 
     return tokens
+
+
+# Views produced by preprocess_texts, each one is equivalent to:
+# 'tokens'       - text_preprocess(text)
+# 'no_stopwords' - text_preprocess(text, stop_words=True)
+# 'stemmed'      - text_preprocess(text, stop_words=True, stem=True)
+# 'lemmatized'   - text_preprocess(text, stop_words=True, lemmatize=True)
+PREPROCESS_VIEWS = ('tokens', 'no_stopwords', 'stemmed', 'lemmatized')
+
+
+@timed('preprocess_texts')
+def preprocess_texts(texts, views=('tokens', 'lemmatized'), keywords=False):
+    """
+    Tokenizes every text once and derives all requested views from the same tokens.
+
+    Accepts:
+    --> texts - pd.Series or list of strings
+    --> views - names from PREPROCESS_VIEWS
+    --> keywords - list of keywords (strings) to delete
+
+    Returns a dictionary {view: list of lists of tokens}
+
+    """
+    unknown = set(views) - set(PREPROCESS_VIEWS)
+    if unknown:
+        raise ValueError(f'Unknown views: {unknown}, expected some of {PREPROCESS_VIEWS}')
+
+    results = {view: [] for view in views}
+    need_filtered = any(view != 'tokens' for view in views)
+
+    for text in texts:
+        tokens = _tokenize(text, keywords)
+        if 'tokens' in results:
+            results['tokens'].append(tokens)
+
+        if not need_filtered:
+            continue
+        filtered = [token for token in tokens if token not in STOPWORDS]
+        if 'no_stopwords' in results:
+            results['no_stopwords'].append(filtered)
+        if 'stemmed' in results:
+            results['stemmed'].append([STEMMER.stem(token) for token in filtered])
+        if 'lemmatized' in results:
+            results['lemmatized'].append([lemmatize_token(token) for token in filtered])
+
+    return results
+
+
+def preprocess_tweets(df, keywords=None):
+    """
+    Accepts dataframe with 'content' column and list of keywords
+    Cleans tweets and adds columns 'content_cleaned', 'hashtags',
+    'content_preprocessed' and 'content_preprocessed_with_stopwords'
+    Returns a new dataframe
+
+    """
+    df = clean_tweets(df, keywords)
+    # copies (retweets) are the same once cleaned, every distinct text is preprocessed once
+    codes, texts = pd.factorize(df['content_cleaned'])
+    views = preprocess_texts(texts, views=('tokens', 'lemmatized'))
+    df['content_preprocessed'] = [views['lemmatized'][code] for code in codes]
+    df['content_preprocessed_with_stopwords'] = [views['tokens'][code] for code in codes]
+    return df
@@ -0,0 +1,47 @@
+import sys
+
+
+class Progress:
+    """
+    Receives progress of long-running stages. Does nothing by itself;
+    subclasses show it in the app, in the console, etc.
+    """
+
+    def start(self, stage, total, message=None):
+        """
+        :param stage: str, name of the stage ('collect', 'analyze', ...)
+        :param total: int, number of steps (e.g. days)
+        :param message: str, what is being done
+        """
+
+    def update(self, stage, done, total, message=None):
+        """
+        Called after each of `total` steps, `done` steps are finished
+        """
+
+    def finish(self, stage, message=None):
+        """
+        Called once the stage is done
+        """
+
+
+class ConsoleProgress(Progress):
+    """
+    Prints progress to stderr, for the command line
+    """
+
+    def __init__(self, stream=sys.stderr):
+        self.stream = stream
+
+    def _print(self, text):
+        print(text, file=self.stream, flush=True)
+
+    def start(self, stage, total, message=None):
+        self._print(f'[{stage}] {message or "started"} ({total} steps)')
+
+    def update(self, stage, done, total, message=None):
+        self._print(f'[{stage}] {done}/{total}' + (f' {message}' if message else ''))
+
+    def finish(self, stage, message=None):
+        self._print(f'[{stage}] {message or "done"}')
+
@@ -0,0 +1,56 @@
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter shared between threads.
+
+    Allows bursts of up to `capacity` requests and `rate` requests per
+    second on average.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: float, tokens added per second
+        :param capacity: int, maximum number of tokens (default - max(1, rate))
+        """
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a token is available and takes it
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def retry(func, retries=3, backoff=1., max_backoff=30.):
+    """
+    Calls func() and retries it on exception with exponential backoff and jitter.
+
+    :param retries: int, number of retries after the first attempt
+    :param backoff: float, seconds to wait before the first retry, doubled after each one
+    :return: result of func()
+    """
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except Exception:
+            if attempt == retries:
+                raise
+            delay = min(max_backoff, backoff * 2 ** attempt)
+            time.sleep(delay * random.uniform(0.5, 1.))
@@ -0,0 +1,47 @@
+import nltk
+
+# NLTK resources used in preprocessing: {package name: path in nltk_data}
+NLTK_RESOURCES = {'punkt': 'tokenizers/punkt',
+                  'stopwords': 'corpora/stopwords',
+                  'wordnet': 'corpora/wordnet',
+                  'omw-1.4': 'corpora/omw-1.4'}
+
+
+def _is_installed(path):
+    # zipped corpora are found as well
+    for candidate in (path, path + '.zip'):
+        try:
+            nltk.data.find(candidate)
+            return True
+        except LookupError:
+            pass
+    return False
+
+
+def missing_nltk_resources():
+    """
+    Returns list of NLTK packages not found locally, never goes to the network
+    """
+    return [name for name, path in NLTK_RESOURCES.items() if not _is_installed(path)]
+
+
+def check_nltk_resources():
+    """
+    Raises LookupError if some NLTK packages are not installed
+    """
+    missing = missing_nltk_resources()
+    if missing:
+        raise LookupError(f'NLTK packages {missing} are not installed, '
+                          f'run `python provision.py` once to download them')
+
+
+def download_nltk_resources(quiet=False):
+    """
+    Downloads missing NLTK packages
+
+    :return: list of downloaded packages
+    """
+    missing = missing_nltk_resources()
+    for name in missing:
+        nltk.download(name, quiet=quiet)
+    return missing
@@ -0,0 +1,332 @@
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from constants import RUNS_PATH
+from utils import storage
+from utils.aggregate import counts_to_dict, emotion_counts_frame, estimated_counts, intervals_frame
+from utils.heavy_hitters import TERM_COLUMNS, SpaceSaving, TermSketches, day_sketches
+
+MANIFEST = 'manifest.json'
+# Saved in the data folder to remember which run its files belong to
+CURRENT_RUN = '_run.json'
+
+# Locks of every run folder, shared by all RunStores of the process:
+# {path: (RLock held by a search or analysis, Lock of the manifest)}
+_RUN_LOCKS = {}
+_LOCK = threading.Lock()
+
+
+def _run_locks(path):
+    with _LOCK:
+        return _RUN_LOCKS.setdefault(os.path.abspath(path), (threading.RLock(), threading.Lock()))
+
+
+def query_id(query):
+    """
+    Accepts dict of search parameters (without dates)
+    Returns str, identifier of the query
+    """
+    query = dict(query)
+    if query.get('keywords'):
+        query['keywords'] = sorted(k.strip().lower() for k in query['keywords'] if k.strip())
+    return hashlib.sha1(json.dumps(query, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+class RunStore:
+    """
+    Collected and analyzed days of a single search query, kept between searches.
+
+    Files are stored in RUNS_PATH/<query id>/ as raw/YYYY-MM-DD.parquet,
+    analyzed/YYYY-MM-DD.parquet (with predicted labels),
+    preprocessed/YYYY-MM-DD.parquet and sketches/YYYY-MM-DD.json
+    (most popular words and hashtags); manifest.json keeps, for every day,
+    when it was collected and analyzed, number of tweets and emotion counts.
+    A new search only collects and analyzes days that are missing or stale.
+
+    Jobs of the same query (e.g. a search and an analysis in other sessions)
+    share the folder: the manifest is re-read and updated under a lock of its own,
+    and whoever writes days holds `lock` for the whole search or analysis
+    (its pipeline threads save days without taking it).
+    """
+
+    def __init__(self, query, root=RUNS_PATH):
+        """
+        :param query: dict of search parameters (keywords, min likes, ...), without dates
+        :param root: str, folder with all runs
+        """
+        self.query = query
+        self.path = os.path.join(root, query_id(query))
+        self.lock, self._manifest_lock = _run_locks(self.path)
+        for sub in ('raw', 'analyzed', 'preprocessed', 'sketches'):
+            os.makedirs(os.path.join(self.path, sub), exist_ok=True)
+        self.manifest = self._read_manifest()
+
+    # ---  Manifest  -----------------------------------------------------------
+    def _read_manifest(self):
+        path = os.path.join(self.path, MANIFEST)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        return {'query': self.query, 'created_at': time.time(), 'days': {}}
+
+    def reload(self):
+        """
+        Re-reads the manifest, e.g. once the lock is taken after another job of the query
+        """
+        with self._manifest_lock:
+            self.manifest = self._read_manifest()
+
+    def _write_manifest(self):
+        path = os.path.join(self.path, MANIFEST)
+        # write to a temporary file first, so the manifest is never half-written
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, default=str)
+        os.replace(path + '.tmp', path)
+
+    def _update_day(self, day, **values):
+        with self._manifest_lock:
+            # other RunStores of the query may have updated other days
+            self.manifest = self._read_manifest()
+            self.manifest['days'].setdefault(day, {}).update(values)
+            self.manifest['last_used'] = time.time()
+            self._write_manifest()
+
+    # ---  Days  ---------------------------------------------------------------
+    def is_stale(self, day):
+        """
+        A day is stale if it was collected before it was over (UTC)
+        """
+        entry = self.manifest['days'].get(day)
+        if entry is None or 'collected_at' not in entry:
+            return True
+        day_end = datetime.datetime.strptime(day, '%Y-%m-%d').replace(
+            tzinfo=datetime.timezone.utc) + datetime.timedelta(days=1)
+        return entry['collected_at'] < day_end.timestamp()
+
+    def missing_days(self, days):
+        """
+        Returns days from the list, which have to be collected
+        """
+        return [day for day in days if self.is_stale(day)]
+
+    def unanalyzed_days(self, days):
+        """
+        Returns days from the list, which were not analyzed since they were collected
+        """
+        days_info = self.manifest['days']
+        return [day for day in days
+                if day not in days_info
+                or days_info[day].get('analyzed_at', 0) < days_info[day].get('collected_at', 0)
+                or 'counts' not in days_info[day]]
+
+    def _file(self, sub, day, ext='.parquet'):
+        return os.path.join(self.path, sub, day + ext)
+
+    def _folder(self, sub):
+        return os.path.join(self.path, sub)
+
+    def save_raw(self, day, df, population=None):
+        """
+        :param population: dict {stratum: number of tweets}, if df is a sample of the day
+            (see utils.sampling.sample_stream)
+        """
+        storage.write_day(df, self._folder('raw'), day)
+        self._update_day(day, collected_at=time.time(), rows=len(df), population=population)
+        # collected again - old analysis is not valid
+        storage.remove_day(self._folder('analyzed'), day)
+        storage.remove_day(self._folder('preprocessed'), day)
+        if os.path.exists(self._file('sketches', day, '.json')):
+            os.remove(self._file('sketches', day, '.json'))
+
+    def load_raw(self, day, columns=None):
+        """
+        Returns DataFrame of the day, with predicted labels if it was analyzed
+
+        :param columns: list of columns to read, None - all of them
+        """
+        sub = 'analyzed' if os.path.exists(storage.day_file(self._folder('analyzed'), day)) else 'raw'
+        return storage.read_day(self._folder(sub), day, columns)
+
+    def population(self, day):
+        """
+        Returns dict {stratum: number of tweets} if the day was sampled, else None
+        """
+        return self.manifest['days'].get(day, {}).get('population')
+
+    def save_analysis(self, day, df_raw, df_preprocessed, counts, words, estimates=None, sketches=None):
+        """
+        Saves results of analysis of a day.
+
+        :param df_raw: DataFrame with 'date', 'content', 'predicted_labels'
+        :param df_preprocessed: DataFrame with preprocessed columns
+        :param counts: dict {label: number of tweets}
+        :param words: str, most popular words of the day
+        :param estimates: dict, counts of the whole day estimated from the sample,
+            see utils.sampling.estimate_counts
+        :param sketches: dict {kind: utils.heavy_hitters.SpaceSaving} of the day
+        """
+        storage.write_day(df_raw, self._folder('analyzed'), day)
+        storage.write_day(df_preprocessed, self._folder('preprocessed'), day)
+        if sketches is not None:
+            self._save_sketches(day, sketches)
+        self._update_day(day, analyzed_at=time.time(),
+                         counts={str(k): int(v) for k, v in counts.items()},
+                         words=words,
+                         estimates=estimates)
+
+    def analysis(self, day):
+        """
+        Returns tuple (dict {label: number of tweets}, str most popular words)
+        of an analyzed day; counts of a sampled day are estimated for the whole day
+        """
+        entry = self.manifest['days'][day]
+        if entry.get('estimates'):
+            return counts_to_dict(estimated_counts(entry['estimates'])), entry['words']
+        return {int(k): v for k, v in entry['counts'].items()}, entry['words']
+
+    def estimates(self, day):
+        """
+        Returns dict of estimates of a sampled day (see utils.sampling.estimate_counts), else None
+        """
+        return self.manifest['days'][day].get('estimates')
+
+    def _save_sketches(self, day, sketches):
+        with open(self._file('sketches', day, '.json'), 'w', encoding='utf-8') as f:
+            json.dump({kind: sketch.to_dict() for kind, sketch in sketches.items()}, f)
+
+    def sketches(self, day):
+        """
+        Returns dict {kind: utils.heavy_hitters.SpaceSaving} of an analyzed day,
+        None if it was not analyzed
+        """
+        path = self._file('sketches', day, '.json')
+        if not os.path.exists(path):
+            preprocessed = self._file('preprocessed', day)
+            if not os.path.exists(preprocessed):
+                return None
+            # analyzed before sketches were saved - counted once from the preprocessed data
+            df = storage.read_day(self._folder('preprocessed'), day,
+                                  columns=list(TERM_COLUMNS.values()))
+            sketches = day_sketches(df, TERM_COLUMNS)
+            self._save_sketches(day, sketches)
+            return sketches
+        with open(path, encoding='utf-8') as f:
+            return {kind: SpaceSaving.from_dict(data) for kind, data in json.load(f).items()}
+
+    def term_sketches(self, days):
+        """
+        Returns utils.heavy_hitters.TermSketches of the days with saved sketches
+        """
+        term_sketches = TermSketches()
+        for day in days:
+            sketches = self.sketches(day)
+            if sketches:
+                term_sketches.add_sketches(day, sketches)
+        return term_sketches
+
+    def emotion_counts(self, days):
+        """
+        Returns DataFrame with emotion counts of analyzed days, see utils.aggregate.emotion_counts_frame
+        """
+        analyses = [self.analysis(day) for day in days]
+        return emotion_counts_frame(days,
+                                    [counts for counts, _ in analyses],
+                                    [words for _, words in analyses])
+
+    def emotion_intervals(self, days):
+        """
+        Returns DataFrame with confidence intervals of sampled days
+        (see utils.aggregate.intervals_frame), None if no day was sampled
+        """
+        return intervals_frame({day: self.estimates(day) for day in days})
+
+    def export_day(self, day, data_path, preprocessed_path):
+        """
+        Copies files of the day to the folders the app reads
+        """
+        storage.write_day(self.load_raw(day), data_path, day)
+        preprocessed = self._file('preprocessed', day)
+        if os.path.exists(preprocessed):
+            shutil.copy(preprocessed, storage.day_path(preprocessed_path, day))
+
+    # ---  Current run of the data folder  -------------------------------------
+    def mark_current(self, data_path):
+        """
+        Remembers that files in data_path were exported from this run
+        """
+        with open(os.path.join(data_path, CURRENT_RUN), 'w', encoding='utf-8') as f:
+            json.dump({'query': self.query, 'root': os.path.dirname(self.path)}, f, default=str)
+
+    @classmethod
+    def current(cls, data_path):
+        """
+        Returns RunStore the files in data_path were exported from, or None
+        """
+        path = os.path.join(data_path, CURRENT_RUN)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as f:
+            info = json.load(f)
+        return cls(info['query'], info['root'])
+
+
+def _folder_size(path):
+    return sum(os.path.getsize(os.path.join(root, f))
+               for root, _, files in os.walk(path) for f in files)
+
+
+def gc_runs(root=RUNS_PATH, max_age_days=None, max_size_mb=None):
+    """
+    Deletes stored runs.
+
+    Accepts:
+    --> root - str, folder with all runs
+    --> max_age_days - float, runs not used for longer are deleted
+    --> max_size_mb - float, then least recently used runs are deleted
+        until all runs together take less space
+
+    Returns list of deleted run folders
+
+    """
+    if not os.path.isdir(root):
+        return []
+
+    runs = []
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if not os.path.isdir(path):
+            continue
+        manifest_path = os.path.join(path, MANIFEST)
+        last_used = os.path.getmtime(manifest_path) if os.path.exists(manifest_path) else 0
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding='utf-8') as f:
+                last_used = json.load(f).get('last_used', last_used)
+        runs.append((last_used, path, _folder_size(path)))
+
+    # least recently used first
+    runs.sort()
+    deleted = []
+    now = time.time()
+
+    if max_age_days is not None:
+        for last_used, path, _ in runs:
+            if now - last_used > max_age_days * 86400:
+                shutil.rmtree(path)
+                deleted.append(path)
+
+    if max_size_mb is not None:
+        kept = [run for run in runs if run[1] not in deleted]
+        total = sum(size for _, _, size in kept)
+        for _, path, size in kept:
+            if total <= max_size_mb * 2 ** 20:
+                break
+            shutil.rmtree(path)
+            deleted.append(path)
+            total -= size
+
+    return deleted
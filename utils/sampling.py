@@ -0,0 +1,170 @@
+"""
+Approximate analysis: every day is reservoir-sampled while it is collected,
+only the sample is classified, counts of the whole day are estimated
+with confidence intervals.
+"""
+import random
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+# Stratum of every tweet when the sample is not stratified
+ALL = 'all'
+
+
+def tweet_hour(date):
+    """
+    Accepts date of a tweet (datetime or str)
+    Returns str, hour of the day, used as the stratum
+    """
+    return str(date.hour if hasattr(date, 'hour') else pd.Timestamp(date).hour)
+
+
+def allocate(size, population):
+    """
+    Splits the sample between strata in proportion to their size
+    (largest remainder), at least one tweet per stratum when possible.
+
+    Accepts:
+    --> size - int, sample size
+    --> population - dict {stratum: number of tweets}
+
+    Returns dict {stratum: number of tweets to sample}
+
+    """
+    total = sum(population.values())
+    if total <= size:
+        return dict(population)
+    quotas = {key: size * n / total for key, n in population.items()}
+    allocation = {key: min(n, int(quotas[key])) for key, n in population.items()}
+    if size >= len(population):
+        allocation = {key: max(1, n) for key, n in allocation.items()}
+
+    remaining = size - sum(allocation.values())
+    order = sorted(quotas, key=lambda key: quotas[key] - int(quotas[key]), reverse=True)
+    while remaining > 0:
+        grown = False
+        for key in order:
+            if remaining and allocation[key] < population[key]:
+                allocation[key] += 1
+                remaining -= 1
+                grown = True
+        if not grown:
+            break
+    return allocation
+
+
+def sample_stream(items, size, stratum=None, seed=0):
+    """
+    Draws a uniform random sample from a stream of unknown length,
+    keeping at most size items per stratum in memory (reservoir sampling).
+
+    Accepts:
+    --> items - iterable, e.g. tweets as they are scraped
+    --> size - int, sample size
+    --> stratum - function item -> str, e.g. lambda tweet: tweet_hour(tweet[0]);
+        None - no strata
+    --> seed - int, the same seed and stream give the same sample
+
+    Returns tuple (list of sampled items, dict {stratum: number of items seen})
+
+    """
+    rng = random.Random(seed)
+    reservoirs = {}
+    seen = Counter()
+    for item in items:
+        key = stratum(item) if stratum else ALL
+        seen[key] += 1
+        reservoir = reservoirs.setdefault(key, [])
+        if len(reservoir) < size:
+            reservoir.append(item)
+        else:
+            position = rng.randrange(seen[key])
+            if position < size:
+                reservoir[position] = item
+
+    sample = []
+    for key, n in allocate(size, seen).items():
+        reservoir = reservoirs[key]
+        # a random part of a uniform sample is a uniform sample
+        rng.shuffle(reservoir)
+        sample.extend(reservoir[:n])
+    return sample, dict(seen)
+
+
+def wilson_interval(p, n, z=1.96):
+    """
+    Accepts arrays of proportions and (effective) sample sizes
+    Returns tuple of arrays (lower bound, upper bound) of the Wilson score interval
+    """
+    p = np.asarray(p, dtype='float64')
+    n = np.maximum(np.asarray(n, dtype='float64'), 1e-12)
+    denominator = 1. + z ** 2 / n
+    center = (p + z ** 2 / (2 * n)) / denominator
+    half = z * np.sqrt(p * (1. - p) / n + z ** 2 / (4 * n ** 2)) / denominator
+    return np.clip(center - half, 0., 1.), np.clip(center + half, 0., 1.)
+
+
+def estimate_counts(labels, strata, population, num_classes, z=1.96):
+    """
+    Estimates share and number of tweets of every class in the whole day
+    from a (stratified) sample.
+
+    Accepts:
+    --> labels - array of int labels of the sampled tweets
+    --> strata - array of str, stratum of every sampled tweet
+    --> population - dict {stratum: number of tweets in the day}
+    --> num_classes - int
+    --> z - float, 1.96 for 95% intervals
+
+    Returns dict of lists, one value per class: 'proportions', 'low', 'high',
+    'counts', 'counts_low', 'counts_high'; and 'sample', 'population' sizes
+
+    Proportions are weighted by strata sizes; the Wilson interval is computed
+    with the effective sample size of the stratified estimate, with the
+    finite population correction.
+
+    """
+    labels = np.asarray(labels, dtype='int64')
+    strata = np.asarray(strata)
+    total = sum(population.values())
+    sampled = {key: n for key, n in population.items() if np.any(strata == key)}
+    covered = sum(sampled.values())
+
+    p = np.zeros(num_classes)
+    variance = np.zeros(num_classes)
+    for key, size in sampled.items():
+        in_stratum = labels[strata == key]
+        n = len(in_stratum)
+        p_stratum = np.bincount(in_stratum, minlength=num_classes) / n
+        weight = size / covered
+        fpc = (size - n) / (size - 1) if size > 1 else 0.
+        p += weight * p_stratum
+        variance += weight ** 2 * p_stratum * (1. - p_stratum) / max(n - 1, 1) * fpc
+
+    if len(labels) >= total:
+        # the whole day was classified
+        low, high = p.copy(), p.copy()
+    else:
+        effective = np.where(variance > 0, p * (1. - p) / np.maximum(variance, 1e-300), len(labels))
+        low, high = wilson_interval(p, effective, z)
+
+    return {'proportions': p.tolist(),
+            'low': low.tolist(),
+            'high': high.tolist(),
+            'counts': (p * total).tolist(),
+            'counts_low': (low * total).tolist(),
+            'counts_high': (high * total).tolist(),
+            'sample': int(len(labels)),
+            'population': int(total)}
+
+
+def strata_of(dates, population):
+    """
+    Accepts array of tweet dates and population of the day, as returned by sample_stream
+    Returns np.array of str, stratum of every tweet
+    """
+    if set(population) == {ALL}:
+        return np.full(len(dates), ALL)
+    return np.array([tweet_hour(date) for date in dates], dtype=object).astype(str)
@@ -0,0 +1,100 @@
+import itertools
+import json
+import os
+from abc import ABC, abstractmethod
+
+import pandas as pd
+
+from constants import DATA_PATH
+from utils.storage import day_file, read_day
+
+COLUMNS = ['date', 'content']
+
+
+class TweetSource(ABC):
+    """
+    Where tweets come from. A source returns tweets of a single day window.
+    """
+
+    @abstractmethod
+    def get_tweets(self, query, since, until, limit):
+        """
+        Accepts:
+        --> query - str, search query without dates
+        --> since - str date 'YYYY-MM-DD', included
+        --> until - str date 'YYYY-MM-DD', not included
+        --> limit - int, maximum number of tweets
+
+        Returns DataFrame with columns 'date' and 'content'
+
+        """
+
+    def iter_tweets(self, query, since, until, limit=None):
+        """
+        Same as get_tweets, but yields tuples (date, content) one by one,
+        so a day can be sampled without keeping all its tweets in memory.
+        limit=None - all tweets of the day
+        """
+        df = self.get_tweets(query, since, until, limit)
+        yield from zip(df['date'], df['content'])
+
+
+class SnscrapeSource(TweetSource):
+    """
+    Live Twitter search through snscrape.
+    """
+
+    def _scrape(self, query, since, until, limit):
+        import snscrape.modules.twitter as sntwitter
+
+        search = query + ' since:{}'.format(since) + ' until:{}'.format(until)
+        scraped_tweets = sntwitter.TwitterSearchScraper(search).get_items()
+
+        # get necessary number of tweets
+        return itertools.islice(scraped_tweets, limit)
+
+    def get_tweets(self, query, since, until, limit):
+        df = pd.DataFrame(self._scrape(query, since, until, limit))
+
+        if len(df) > 0:
+            return df[COLUMNS]
+        return pd.DataFrame(columns=COLUMNS)
+
+    def iter_tweets(self, query, since, until, limit=None):
+        for tweet in self._scrape(query, since, until, limit):
+            yield tweet.date, tweet.content
+
+
+class ReplaySource(TweetSource):
+    """
+    Replays previously collected tweets instead of the live search,
+    for tests and benchmarks. The query is ignored.
+
+    Reads either a folder with files 'YYYY-MM-DD.parquet' (e.g. data/raw)
+    or a JSONL file with objects {"date": ..., "content": ...}.
+    """
+
+    def __init__(self, path=DATA_PATH):
+        self.path = path
+        self._jsonl = None
+
+    def _load_jsonl(self):
+        if self._jsonl is None:
+            with open(self.path, encoding='utf-8') as f:
+                records = [json.loads(line) for line in f if line.strip()]
+            df = pd.DataFrame(records, columns=COLUMNS)
+            df['day'] = df['date'].astype(str).str[:10]
+            self._jsonl = df
+        return self._jsonl
+
+    def get_tweets(self, query, since, until, limit):
+        if os.path.isdir(self.path):
+            if not os.path.exists(day_file(self.path, since)):
+                return pd.DataFrame(columns=COLUMNS)
+            df = read_day(self.path, since, columns=COLUMNS)
+        else:
+            df = self._load_jsonl()
+            df = df[(df['day'] >= since) & (df['day'] < until)][COLUMNS]
+        if limit is not None:
+            df = df.head(limit)
+        return df.reset_index(drop=True)
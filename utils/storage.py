@@ -0,0 +1,191 @@
+import ast
+import os
+
+import pandas as pd
+
+from utils.instrument import timed
+
+# Columns holding lists of tokens, stored as native list<string> columns
+LIST_COLUMNS = ['hashtags', 'content_preprocessed', 'content_preprocessed_with_stopwords']
+# Columns with few distinct values, stored dictionary-encoded
+DICTIONARY_COLUMNS = ['predicted_labels']
+
+COMPRESSION = 'zstd'
+
+
+def _pyarrow():
+    # imported when a file is read or written, not when the app starts
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    return pa, pq
+
+
+@timed('io.parquet_write')
+def write_table(df, path, compression=COMPRESSION):
+    """
+    Saves dataframe to a Parquet file.
+    Token lists are stored as list columns, labels are dictionary-encoded.
+
+    :param df: pd.DataFrame
+    :param path: str, path to the .parquet file
+    :param compression: str, Parquet compression codec
+    """
+    df = df.copy()
+    for col in DICTIONARY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    for col in LIST_COLUMNS:
+        # hashtags of emotion counts are comma separated words, stored as strings
+        if col in df.columns and not any(isinstance(tokens, str) for tokens in df[col]):
+            df[col] = [list(tokens) for tokens in df[col]]
+
+    pa, pq = _pyarrow()
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    pq.write_table(table, path, compression=compression, use_dictionary=True)
+
+
+@timed('io.parquet_read')
+def read_table(path, columns=None, memory_map=True):
+    """
+    Reads a Parquet file saved by write_table.
+
+    :param path: str, path to the .parquet file
+    :param columns: list of columns to read, None - all of them
+    :param memory_map: bool, if True - map the file instead of reading it into memory
+    :return: pd.DataFrame, token lists come back as Python lists
+    """
+    pa, pq = _pyarrow()
+    table = pq.read_table(path, columns=columns, memory_map=memory_map)
+    df = table.to_pandas()
+    for col in LIST_COLUMNS:
+        if col in df.columns and pa.types.is_list(table.schema.field(col).type):
+            df[col] = [list(tokens) if tokens is not None else [] for tokens in df[col]]
+    for col in DICTIONARY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype(str)
+    return df
+
+
+def count_rows(path):
+    """
+    Number of rows of a Parquet file, read from its footer
+    """
+    _, pq = _pyarrow()
+    return pq.ParquetFile(path).metadata.num_rows
+
+
+def day_path(folder, day):
+    return os.path.join(folder, day + '.parquet')
+
+
+def day_file(folder, day):
+    """
+    Path to the file of a day: 'YYYY-MM-DD.parquet',
+    or 'YYYY-MM-DD.csv' saved before migrate_to_parquet.py was run
+    """
+    path = day_path(folder, day)
+    path_to_csv = os.path.join(folder, day + '.csv')
+    if not os.path.exists(path) and os.path.exists(path_to_csv):
+        return path_to_csv
+    return path
+
+
+def list_days(folder):
+    """
+    :param folder: str, folder with files saved by write_day (or csv files of days)
+    :return: sorted list of str dates
+    """
+    return sorted({name.rsplit('.', 1)[0] for name in os.listdir(folder)
+                   if name.endswith(('.parquet', '.csv'))})
+
+
+def write_day(df, folder, day, compression=COMPRESSION):
+    """
+    Saves data of a single day as 'YYYY-MM-DD.parquet' in the folder,
+    a csv file of the day saved before is removed
+    """
+    write_table(df, day_path(folder, day), compression)
+    path_to_csv = os.path.join(folder, day + '.csv')
+    if os.path.exists(path_to_csv):
+        os.remove(path_to_csv)
+
+
+def read_day(folder, day, columns=None, memory_map=True):
+    """
+    Reads a day saved by write_day, a csv file of the day - with the same columns
+
+    :param columns: list of columns to read, None - all of them
+    """
+    path = day_file(folder, day)
+    if path.endswith('.csv'):
+        return read_csv(path, columns)
+    return read_table(path, columns, memory_map)
+
+
+def day_columns(folder, day):
+    """
+    Returns list of columns of a day's file, without reading its data
+    """
+    path = day_file(folder, day)
+    if path.endswith('.csv'):
+        return list(pd.read_csv(path, nrows=0).columns)
+    _, pq = _pyarrow()
+    return pq.read_schema(path).names
+
+
+def remove_day(folder, day):
+    """
+    Removes the file of a day, Parquet or csv
+    """
+    for path in (day_path(folder, day), os.path.join(folder, day + '.csv')):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _is_list_column(values):
+    # token lists saved as strings; hashtags of emotion_counts.csv are plain comma separated words
+    strings = [value for value in values if isinstance(value, str)]
+    return bool(strings) and all(value.startswith('[') for value in strings)
+
+
+@timed('io.csv_read')
+def read_csv(path, columns=None):
+    """
+    Reads a csv file saved by the app, where token lists
+    were saved as strings ("['and', 'they', ...]"),
+    other columns with the same names are left as they are
+
+    :param columns: list of columns to read, None - all of them
+    """
+    df = pd.read_csv(path, usecols=columns)
+    for col in LIST_COLUMNS:
+        if col in df.columns and _is_list_column(df[col]):
+            df[col] = [ast.literal_eval(tokens) if isinstance(tokens, str) else []
+                       for tokens in df[col]]
+    return df
+
+
+def migrate_csv_folder(src, dst=None, delete_csv=False, compression=COMPRESSION):
+    """
+    Converts every csv file in a folder to Parquet.
+
+    :param src: str, folder with csv files
+    :param dst: str, folder for Parquet files, default - the same folder
+    :param delete_csv: bool, if True - delete csv files after conversion
+    :return: list of created files
+    """
+    dst = dst or src
+    created = []
+    for f in sorted(os.listdir(src)):
+        if not f.endswith('.csv'):
+            continue
+        path_to_csv = os.path.join(src, f)
+        path_to_parquet = os.path.join(dst, f[:-len('.csv')] + '.parquet')
+        write_table(read_csv(path_to_csv), path_to_parquet, compression)
+        created.append(path_to_parquet)
+        if delete_csv:
+            os.remove(path_to_csv)
+    return created
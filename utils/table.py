@@ -0,0 +1,66 @@
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.get_data import _file_state, load_day
+from utils.storage import day_file
+from utils.instrument import timed
+
+# Rows matching a filter: {(path to file, mtime, size, query, labels): np.array of row numbers}
+_ROWS_CACHE = OrderedDict()
+_ROWS_CACHE_SIZE = 64
+_LOCK = threading.Lock()
+
+
+@timed('table.filter')
+def filter_rows(path, day, query='', labels=()):
+    """
+    Finds tweets of a day matching a filter, cached by file and filter,
+    so changing the page does not filter the day again.
+
+    Accepts:
+    --> path - str, folder with files of days
+    --> day - str date
+    --> query - str, tweets containing it (case insensitive), '' - all tweets
+    --> labels - list of emotions, tweets with these predicted labels, empty - all tweets
+
+    Returns np.array of row numbers of the day's DataFrame (see utils.get_data.load_day)
+
+    """
+    path_to_file = day_file(path, day)
+    query = query.strip().lower()
+    labels = tuple(sorted(labels))
+    key = (path_to_file,) + _file_state(path_to_file) + (query, labels)
+
+    with _LOCK:
+        if key in _ROWS_CACHE:
+            _ROWS_CACHE.move_to_end(key)
+            return _ROWS_CACHE[key]
+
+    df = load_day(path, day)
+    mask = np.ones(len(df), dtype=bool)
+    if query:
+        mask &= df['content'].str.lower().str.contains(query, regex=False, na=False).to_numpy()
+    if labels and 'predicted_labels' in df.columns:
+        mask &= df['predicted_labels'].isin(labels).to_numpy()
+    rows = np.flatnonzero(mask)
+
+    with _LOCK:
+        _ROWS_CACHE[key] = rows
+        while len(_ROWS_CACHE) > _ROWS_CACHE_SIZE:
+            _ROWS_CACHE.popitem(last=False)
+    return rows
+
+
+def num_pages(num_rows, page_size):
+    return max(1, math.ceil(num_rows / page_size))
+
+
+def page_slice(df, rows, page, page_size):
+    """
+    Returns DataFrame with rows of the page (numbered from 1)
+    """
+    start = (page - 1) * page_size
+    return df.iloc[rows[start:start + page_size]]
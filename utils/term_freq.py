@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+
+from utils.heavy_hitters import TERM_COLUMNS
+from utils.instrument import timed
+
+
+class TermIndex:
+    """
+    Sparse day x term count matrices for words and hashtags.
+
+    All days are counted in a single pass and words and hashtags share
+    one vocabulary, so most popular terms for any day are a slice of
+    the matrix instead of a recount.
+
+    Each kind is stored in CSR format: for day i the term ids are
+    indices[indptr[i]:indptr[i+1]] and their counts are the same slice of data.
+
+    Counts are exact; utils.heavy_hitters counts in bounded memory instead.
+    """
+
+    @timed('term_freq.build')
+    def __init__(self, dfs, days, kinds=('words', 'hashtags')):
+        """
+        :param dfs: dict in format {'date': pd.DataFrame}, dataframes contain
+            columns with lists of tokens (see TERM_COLUMNS)
+        :param days: list of str dates, order of the matrix rows
+        :param kinds: what to count, keys of TERM_COLUMNS
+        """
+        self.days = list(days)
+        self.day_to_row = {day: i for i, day in enumerate(self.days)}
+        self.vocab = {}
+        self.matrices = {}
+
+        for kind in kinds:
+            self.matrices[kind] = self._build(dfs, TERM_COLUMNS[kind])
+
+        # id -> term, ids are given in order of first appearance
+        self.terms = np.array(list(self.vocab.keys()), dtype=object)
+
+    def _build(self, dfs, column):
+        vocab = self.vocab
+        ids = []
+        day_lengths = []
+
+        for day in self.days:
+            n_before = len(ids)
+            for tokens in dfs[day][column]:
+                ids.extend([vocab.setdefault(t, len(vocab)) for t in tokens])
+            day_lengths.append(len(ids) - n_before)
+
+        ids = np.array(ids, dtype=np.int64)
+        rows = np.repeat(np.arange(len(self.days), dtype=np.int64), day_lengths)
+
+        # one code per (day, term) pair, unique codes come out sorted by day
+        n_terms = max(len(vocab), 1)
+        codes, counts = np.unique(rows * n_terms + ids, return_counts=True)
+
+        indices = codes % n_terms
+        indptr = np.searchsorted(codes // n_terms, np.arange(len(self.days) + 1))
+
+        return indptr, indices, counts
+
+    def day_counts(self, day, kind='words'):
+        """
+        :return: tuple (term ids, counts) of a single day
+        """
+        indptr, indices, counts = self.matrices[kind]
+        row = self.day_to_row[day]
+        return (indices[indptr[row]:indptr[row + 1]],
+                counts[indptr[row]:indptr[row + 1]])
+
+    def total_counts(self, kind='words'):
+        """
+        :return: np.array, counts of each term id over all days
+        """
+        _, indices, counts = self.matrices[kind]
+        return np.bincount(indices, weights=counts, minlength=len(self.terms)).astype(np.int64)
+
+    @timed('term_freq.top_k')
+    def top_k(self, day, kind='words', num_words=20, min_occur=2):
+        """
+        Most popular terms of a day.
+
+        Accepts:
+        --> day - str date
+        --> kind - 'words' or 'hashtags'
+        --> num_words - int, how many most popular terms to return
+        --> min_occur - int, minimum of how many times term appeared
+
+        Returns DataFrame with columns 'word' and 'num', sorted by 'num'.
+        Ties are broken by the order in which terms first appeared.
+
+        """
+        ids, counts = self.day_counts(day, kind)
+
+        keep = counts >= min_occur
+        ids, counts = ids[keep], counts[keep]
+
+        if 0 < num_words < len(counts):
+            # partial selection: only the k largest, then everything tied
+            # with the smallest of them, so ties are resolved deterministically
+            part = np.argpartition(-counts, num_words - 1)[:num_words]
+            candidates = np.flatnonzero(counts >= counts[part].min())
+            ids, counts = ids[candidates], counts[candidates]
+
+        order = np.lexsort((ids, -counts))[:num_words]
+
+        return pd.DataFrame({'word': self.terms[ids[order]] if len(order) else [],
+                             'num': counts[order]})
@@ -0,0 +1,250 @@
+"""
+Compact replacement of the pickled Keras Tokenizer.
+
+The vocabulary is saved as a folder of .npy files: words (UTF-8, sorted,
+fixed width) and their indices, both memory-mapped when loaded, plus
+settings of the Keras tokenizer in tokenizer.json. Only words the model
+can see are kept: with num_words set, less frequent words are treated
+by Keras the same as unknown ones. Texts are encoded into one flat array
+of indices and padded with array operations, see pad_encoded; words are
+looked up by binary search in the sorted word table, so no dict of the
+whole vocabulary is built.
+"""
+import json
+import os
+import pickle
+from itertools import chain
+
+import numpy as np
+
+from utils.instrument import timed
+
+SETTINGS_FILE = 'tokenizer.json'
+WORDS_FILE = 'words.npy'
+INDICES_FILE = 'indices.npy'
+
+# Default filters of keras_preprocessing.text.Tokenizer
+KERAS_FILTERS = '!"#$%&()*+,-./:;<=>?@[\\]^_`{|}~\t\n'
+
+
+def text_to_word_sequence(text, filters=KERAS_FILTERS, lower=True, split=' '):
+    """
+    The same as keras_preprocessing.text.text_to_word_sequence
+    """
+    if lower:
+        text = text.lower()
+    text = text.translate(str.maketrans({c: split for c in filters}))
+    return [word for word in text.split(split) if word]
+
+
+def pad_encoded(ids, lengths, maxlen=None, rows=None, padding='pre', truncating='pre', dtype='int32'):
+    """
+    Pads encoded texts to a matrix, the same as keras pad_sequences
+    applied to the lists of indices.
+
+    Accepts:
+    --> ids - np.array of indices of all texts, one after another
+    --> lengths - np.array, number of indices of every text
+    --> maxlen - int, length of the rows, None - the longest text
+    --> rows - np.array of text numbers to pad, None - all texts
+    --> padding, truncating - 'pre' or 'post', as in pad_sequences
+
+    Returns np.array of shape (number of rows, maxlen)
+
+    """
+    lengths = np.asarray(lengths, dtype='int64')
+    starts = np.cumsum(lengths) - lengths
+    if rows is None:
+        rows = np.arange(len(lengths))
+    rows = np.asarray(rows, dtype='int64')
+    row_lengths = lengths[rows]
+    if maxlen is None:
+        maxlen = int(row_lengths.max()) if len(rows) else 0
+
+    kept = np.minimum(row_lengths, maxlen)
+    # first token kept of every row and the column it goes to
+    first = row_lengths - kept if truncating == 'pre' else np.zeros_like(kept)
+    offset = maxlen - kept if padding == 'pre' else np.zeros_like(kept)
+
+    # one entry per kept token
+    row_of_token = np.repeat(np.arange(len(rows)), kept)
+    position = np.arange(kept.sum()) - np.repeat(np.cumsum(kept) - kept, kept)
+    token = np.repeat(starts[rows] + first, kept) + position
+
+    matrix = np.zeros((len(rows), maxlen), dtype=dtype)
+    matrix[row_of_token, np.repeat(offset, kept) + position] = ids[token]
+    return matrix
+
+
+class CompactTokenizer:
+    """
+    Array-backed tokenizer, gives the same indices as the Keras tokenizer
+    it was converted from
+    """
+
+    def __init__(self, words, indices, num_words=None, oov_index=None, lower=True,
+                 filters=KERAS_FILTERS, split=' '):
+        """
+        :param words: np.array of UTF-8 words (bytes), sorted
+        :param indices: np.array of int32, index of every word
+        :param num_words: int, indices from num_words are out of vocabulary
+        :param oov_index: int, index of the out-of-vocabulary token, None - unknown words are dropped
+        :param lower, filters, split: how texts are split into words, as in the Keras tokenizer
+        """
+        self.words = words
+        self.indices = indices
+        self.num_words = num_words
+        self.oov_index = oov_index
+        self.lower = lower
+        self.filters = filters
+        self.split = split
+
+    @classmethod
+    def from_keras(cls, tokenizer):
+        """
+        Converts a keras_preprocessing.text.Tokenizer (word level only)
+        """
+        if tokenizer.char_level:
+            raise ValueError('char level tokenizers are not supported')
+        num_words = tokenizer.num_words
+        oov_index = tokenizer.word_index.get(tokenizer.oov_token) if tokenizer.oov_token is not None else None
+        # words past num_words are encoded as unknown ones, they are not needed
+        vocabulary = sorted((word.encode('utf-8'), index) for word, index in tokenizer.word_index.items()
+                            if not num_words or index < num_words)
+        width = max((len(word) for word, _ in vocabulary), default=1)
+        words = np.array([word for word, _ in vocabulary], dtype=f'S{width}')
+        indices = np.array([index for _, index in vocabulary], dtype='int32')
+        return cls(words, indices, num_words, oov_index, tokenizer.lower,
+                   tokenizer.filters, tokenizer.split)
+
+    def save(self, folder):
+        os.makedirs(folder, exist_ok=True)
+        np.save(os.path.join(folder, WORDS_FILE), self.words)
+        np.save(os.path.join(folder, INDICES_FILE), self.indices)
+        with open(os.path.join(folder, SETTINGS_FILE), 'w', encoding='utf-8') as f:
+            json.dump({'num_words': self.num_words, 'oov_index': self.oov_index, 'lower': self.lower,
+                       'filters': self.filters, 'split': self.split}, f)
+
+    @classmethod
+    def load(cls, folder, mmap=True):
+        """
+        :param folder: str, folder saved by save()
+        :param mmap: bool, if True - arrays are memory-mapped, not read
+        """
+        mmap_mode = 'r' if mmap else None
+        with open(os.path.join(folder, SETTINGS_FILE), encoding='utf-8') as f:
+            settings = json.load(f)
+        return cls(np.load(os.path.join(folder, WORDS_FILE), mmap_mode=mmap_mode),
+                   np.load(os.path.join(folder, INDICES_FILE), mmap_mode=mmap_mode),
+                   **settings)
+
+    def nbytes(self):
+        """
+        Returns int, size of the word table
+        """
+        return self.words.nbytes + self.indices.nbytes
+
+    def _words_of(self, text):
+        if isinstance(text, str):
+            return text_to_word_sequence(text, self.filters, self.lower, self.split)
+        return text
+
+    def lookup(self, words):
+        """
+        Accepts list of words (str)
+        Returns np.array of int32 indices, -1 for words that are dropped
+        """
+        if self.lower:
+            # one lower() for all words instead of one per word
+            joined = '\x00'.join(words)
+            lowered = joined.lower()
+            if lowered != joined:
+                lowered = lowered.split('\x00')
+                words = lowered if len(lowered) == len(words) else [w.lower() for w in words]
+        unknown = -1 if self.oov_index is None else self.oov_index
+        if not len(words) or not len(self.words):
+            return np.full(len(words), unknown, dtype='int32')
+
+        width = self.words.dtype.itemsize
+        encoded = [word.encode('utf-8') for word in words]
+        # longer words are truncated to the width of the table, they are not in it
+        fits = np.fromiter(map(len, encoded), dtype='int64', count=len(encoded)) <= width
+        queries = np.array(encoded, dtype=f'S{width}')
+        positions = np.minimum(np.searchsorted(self.words, queries), len(self.words) - 1)
+        found = fits & (self.words[positions] == queries)
+        return np.where(found, self.indices[positions], unknown).astype('int32')
+
+    @timed('tokenizer.encode')
+    def encode(self, texts):
+        """
+        Accepts array of texts (strings or lists of tokens)
+        Returns tuple (np.array of int32 indices of all texts, one after another,
+        np.array with number of indices of every text)
+        """
+        words = [self._words_of(text) for text in texts]
+        lengths = np.fromiter((len(w) for w in words), dtype='int64', count=len(words))
+        ids = self.lookup(list(chain.from_iterable(words)))
+
+        # drop unknown words, as texts_to_sequences does without an oov token
+        keep = ids >= 0
+        if not keep.all():
+            text_of_word = np.repeat(np.arange(len(lengths)), lengths)
+            lengths = np.bincount(text_of_word[keep], minlength=len(lengths))
+            ids = ids[keep]
+        return ids, lengths
+
+    def texts_to_matrix(self, texts, maxlen=None, padding='pre', truncating='pre', dtype='int32'):
+        """
+        The same as pad_sequences(tokenizer.texts_to_sequences(texts), maxlen, ...)
+        of the Keras tokenizer
+        """
+        ids, lengths = self.encode(texts)
+        return pad_encoded(ids, lengths, maxlen, padding=padding, truncating=truncating, dtype=dtype)
+
+    def texts_to_sequences(self, texts):
+        """
+        The same as texts_to_sequences of the Keras tokenizer, returns list of lists
+        """
+        ids, lengths = self.encode(texts)
+        return [part.tolist() for part in np.split(ids, np.cumsum(lengths)[:-1])] if len(lengths) else []
+
+
+def encode(tokenizer, texts):
+    """
+    Accepts CompactTokenizer or Keras tokenizer and array of texts
+    Returns tuple (np.array of indices of all texts, np.array with number of indices of every text)
+    """
+    if isinstance(tokenizer, CompactTokenizer):
+        return tokenizer.encode(texts)
+    sequences = tokenizer.texts_to_sequences(texts)
+    lengths = np.fromiter((len(s) for s in sequences), dtype='int64', count=len(sequences))
+    ids = np.fromiter(chain.from_iterable(sequences), dtype='int32', count=int(lengths.sum()))
+    return ids, lengths
+
+
+def compact_path(tokenizer_path):
+    """
+    Returns str, folder of the compact tokenizer converted from a pickled one,
+    e.g. tokenizers/lstm/tokenizer.compact
+    """
+    return os.path.splitext(tokenizer_path)[0] + '.compact'
+
+
+def load_tokenizer(tokenizer_path, compact=True):
+    """
+    Loads the tokenizer. The pickled Keras tokenizer is converted to
+    CompactTokenizer on first use and again whenever the pickle changes.
+
+    :param tokenizer_path: str, path to the pickled Keras tokenizer
+    :param compact: bool, if False - return the Keras tokenizer
+    """
+    if not compact:
+        with open(tokenizer_path, 'rb') as f:
+            return pickle.load(f)
+
+    folder = compact_path(tokenizer_path)
+    settings = os.path.join(folder, SETTINGS_FILE)
+    if not os.path.exists(settings) or os.path.getmtime(settings) < os.path.getmtime(tokenizer_path):
+        with open(tokenizer_path, 'rb') as f:
+            CompactTokenizer.from_keras(pickle.load(f)).save(folder)
+    return CompactTokenizer.load(folder)
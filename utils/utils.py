@@ -1,5 +1,8 @@
 import os
-import pandas as pd
+
+from utils.heavy_hitters import TERM_COLUMNS, day_sketches
+from utils.instrument import timed
+from utils.term_freq import TermIndex
 
 
 def del_folder_content(path):
@@ -8,7 +11,8 @@ def del_folder_content(path):
             os.remove(os.path.join(path, f))
 
 
-def most_popular_to_days(dfs, days,  words_or_hashtags='h', min_occur=2, num_words=20):
+@timed('most_popular_to_days')
+def most_popular_to_days(dfs, days,  words_or_hashtags='h', min_occur=2, num_words=20, approximate=False):
     '''
     Counts most popular words or hashtags in dataframe
     Accepts:
@@ -17,41 +21,25 @@ def most_popular_to_days(dfs, days,  words_or_hashtags='h', min_occur=2, num_wor
     --> words_or_hashtags - 'h' or 'w' - what to count
     --> min_occur - int, minimum of how many times word or hashtag appeared
     --> num_words - int, how many most popular words to return
+    --> approximate - bool, if True - count every day in a Space-Saving sketch,
+        as the pipeline does: faster on large days, counts are exact unless a day
+        has more distinct terms than the sketch keeps
 
     Returns a dictionary, where:
     --> key - string date in format Y-m-d
-    --> value - DataFrame with columns 'word' and 'num',
+    --> value - DataFrame with columns 'word' and 'num'; with approximate=True
+        also 'error', see utils.heavy_hitters.SpaceSaving.top_k
+
+    Builds a TermIndex on every call; when several days or both kinds are
+    needed, build one TermIndex and use TermIndex.top_k instead.
 
     '''
-    words_counts_arr = []
-
-    if words_or_hashtags=='h':
-        column = 'hashtags'
-    else:
-        column = 'content_preprocessed'
-
-    for day in days:
-        # create an array of dictionaries
-        # with words and their counts for each day
-        words_counts = {}
-        for string in dfs[day][column]:
-            for word in string:
-                if word not in words_counts:
-                    words_counts[word] = 1
-                else:
-                    words_counts[word] += 1
-        words_counts_arr.append(words_counts)
-
-    words_to_days = {}
-    # create a dictionary with dates and dataframes
-    for i, day in enumerate(days):
-        df_popular = pd.DataFrame({'word': words_counts_arr[i].keys(),
-                                   'num': words_counts_arr[i].values()})
-        # select most popular
-        df_popular = df_popular.sort_values(by=['num'], ascending=False)
-        df_slice = df_popular[df_popular.num >= min_occur]
-        df_slice = df_slice[:num_words]
-
-        words_to_days[day] = df_slice
-
-    return words_to_days
+    kind = 'hashtags' if words_or_hashtags == 'h' else 'words'
+
+    if approximate:
+        return {day: day_sketches(dfs[day], TERM_COLUMNS, kinds=(kind,))[kind].top_k(num_words, min_occur)
+                for day in days}
+
+    term_index = TermIndex(dfs, days, kinds=(kind,))
+    return {day: term_index.top_k(day, kind, num_words=num_words, min_occur=min_occur)
+            for day in days}